@@ -0,0 +1,386 @@
+"""模型调用准入控制：进程内共享的令牌桶（每分钟请求数 RPM / 每分钟 token 数 TPM）+ 优先级通道
+
+所有模型调用（Runner 的每次模型请求、规划器和摘要的 chat.completions 调用）在发出前都要取得令牌。
+令牌不足时按通道优先级排队，高优先级通道的请求总是先被放行：
+    interactive   /message 对话（含流式）
+    batch         同步的协作任务、任务规划和上下文摘要
+    background    后台任务（jobs）
+
+预计等待时间超过 LLM_MAX_WAIT 秒（或通道排队数达到 LLM_MAX_QUEUE）时立即拒绝（AdmissionRejected，
+HTTP 层返回 429 和排队位置、建议重试时间），而不是让请求一起打到上游后同时失败；background 通道不限等待时间。
+TPM 按估算的输入 token + LLM_EXPECTED_OUTPUT_TOKENS 预扣，模型返回后按实际用量多退少补；
+调用失败、超时或被取消（没有返回用量）时全部退还。
+
+LLM_RPM 和 LLM_TPM 都为 0（默认）时不做限制。
+"""
+import asyncio
+import json
+import math
+import os
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+from agent_systems.context import estimate_tokens
+from metrics import MetricsHooks, record_span, registry
+from usage import current_usage_scope
+
+# 上游的速率限制（按账号额度设置），0 表示不限制
+LLM_RPM = int(os.getenv("LLM_RPM", "0"))
+LLM_TPM = int(os.getenv("LLM_TPM", "0"))
+# 预计等待超过该时间（秒）时直接拒绝
+LLM_MAX_WAIT = float(os.getenv("LLM_MAX_WAIT", "10"))
+# 每个通道最多排队的请求数，0 表示只受 LLM_MAX_WAIT 限制
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "0"))
+# 预扣 TPM 时假设的输出 token 数
+LLM_EXPECTED_OUTPUT_TOKENS = int(os.getenv("LLM_EXPECTED_OUTPUT_TOKENS", "256"))
+
+# 通道按优先级从高到低排列
+LANES = ("interactive", "batch", "background")
+# 不限等待时间的通道
+UNBOUNDED_LANES = frozenset(("background",))
+# 接口（usage_scope 的 endpoint）→ 通道；没有作用域或未列出的接口使用 batch
+ENDPOINT_LANES = {
+    "message": "interactive",
+    "message_stream": "interactive",
+    "collaborative": "batch",
+    "collaborative_stream": "batch",
+    "analyze": "batch",
+    "collaborative_job": "background",
+}
+
+ADMISSION_REQUESTS = registry.counter(
+    "llm_admission_total", "Model calls by admission lane and outcome", ("lane", "outcome")
+)
+
+
+def current_lane() -> str:
+    """当前请求的通道（由 usage_scope 的接口决定）"""
+    scope = current_usage_scope()
+    return ENDPOINT_LANES.get(scope.endpoint, "batch") if scope is not None else "batch"
+
+
+class AdmissionRejected(Exception):
+    """队列已饱和，请求被拒绝"""
+
+    def __init__(self, lane: str, position: int, retry_after: float, reason: str):
+        super().__init__(f"模型调用排队已满（{lane} 通道第 {position} 位）: {reason}")
+        self.lane = lane
+        self.position = position
+        self.retry_after = retry_after
+        self.reason = reason
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "detail": str(self),
+            "lane": self.lane,
+            "queue_position": self.position,
+            "retry_after": self.retry_after,
+        }
+
+
+class TokenBucket:
+    """每分钟补满的令牌桶；per_minute 为 0 时不限制"""
+
+    __slots__ = ("capacity", "rate", "tokens", "updated")
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    @property
+    def enabled(self) -> bool:
+        return self.capacity > 0
+
+    def refill(self, now: float) -> None:
+        if self.enabled:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """取得 amount 个令牌还需要等待的时间（秒）；允许透支，amount 超过容量时按容量计算"""
+        if not self.enabled:
+            return 0.0
+        missing = min(amount, self.capacity) - self.tokens
+        return max(0.0, missing / self.rate)
+
+    def take(self, amount: float) -> None:
+        if self.enabled:
+            self.tokens -= amount
+
+    def give_back(self, amount: float) -> None:
+        if self.enabled:
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class _Waiter:
+    __slots__ = ("tokens", "future")
+
+    def __init__(self, tokens: int, future: asyncio.Future):
+        self.tokens = tokens
+        self.future = future
+
+
+class AdmissionController:
+    """按优先级通道排队的 RPM / TPM 令牌桶"""
+
+    def __init__(
+        self,
+        rpm: Optional[int] = None,
+        tpm: Optional[int] = None,
+        max_wait: Optional[float] = None,
+        max_queue: Optional[int] = None,
+    ):
+        self.requests = TokenBucket(LLM_RPM if rpm is None else rpm)
+        self.tokens = TokenBucket(LLM_TPM if tpm is None else tpm)
+        self.max_wait = LLM_MAX_WAIT if max_wait is None else max_wait
+        self.max_queue = LLM_MAX_QUEUE if max_queue is None else max_queue
+        self._lanes: Dict[str, Deque[_Waiter]] = {lane: deque() for lane in LANES}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._pump_task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.requests.enabled or self.tokens.enabled
+
+    def _bind_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._wakeup = asyncio.Event()
+            self._pump_task = None
+            for waiters in self._lanes.values():
+                waiters.clear()
+
+    def _ahead(self, lane: str) -> List[_Waiter]:
+        """排在该通道新请求前面的请求：同一通道和更高优先级通道中的全部等待者"""
+        ahead: List[_Waiter] = []
+        for name in LANES[:LANES.index(lane) + 1]:
+            ahead.extend(w for w in self._lanes[name] if not w.future.done())
+        return ahead
+
+    def _projected_wait(self, waiters: List[_Waiter], tokens: int) -> float:
+        """放行 waiters 之后再放行 tokens 的预计等待时间"""
+        wait = 0.0
+        if self.requests.enabled:
+            wait = max(wait, (len(waiters) + 1 - self.requests.tokens) / self.requests.rate)
+        if self.tokens.enabled:
+            demand = sum(w.tokens for w in waiters) + min(tokens, self.tokens.capacity)
+            wait = max(wait, (demand - self.tokens.tokens) / self.tokens.rate)
+        return max(0.0, wait)
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.requests.refill(now)
+        self.tokens.refill(now)
+
+    def _check_locked(self, lane: str, tokens: int, ahead: List[_Waiter], bounded: bool = True) -> None:
+        if not bounded or lane in UNBOUNDED_LANES:
+            return
+        position = len(ahead) + 1
+        wait = self._projected_wait(ahead, tokens)
+        queued = sum(1 for w in self._lanes[lane] if not w.future.done())
+        if self.max_queue > 0 and queued >= self.max_queue:
+            ADMISSION_REQUESTS.inc((lane, "rejected"))
+            raise AdmissionRejected(lane, position, math.ceil(wait), f"通道排队数已达上限 {self.max_queue}")
+        if wait > self.max_wait:
+            ADMISSION_REQUESTS.inc((lane, "rejected"))
+            raise AdmissionRejected(
+                lane, position, math.ceil(wait), f"预计等待 {wait:.1f} 秒，超过 {self.max_wait:g} 秒"
+            )
+
+    def check(self, lane: str) -> None:
+        """请求进入前的快速检查：该通道已饱和时抛出 AdmissionRejected"""
+        if not self.enabled:
+            return
+        self._bind_loop()
+        self._refill()
+        self._check_locked(lane, 0, self._ahead(lane))
+
+    async def acquire(self, lane: str, tokens: int, bounded: bool = True) -> int:
+        """等待放行一次模型调用，返回预扣的 token 数（调用结束后传给 settle）
+
+        bounded=False 时不因等待时间过长而拒绝（已经开始的运行中的后续调用）。
+        """
+        if not self.enabled:
+            return 0
+        if self.tokens.enabled:
+            tokens = min(tokens, int(self.tokens.capacity))
+        self._bind_loop()
+        self._refill()
+        ahead = self._ahead(lane)
+        if not ahead and self.requests.wait_time(1) == 0 and self.tokens.wait_time(tokens) == 0:
+            self.requests.take(1)
+            self.tokens.take(tokens)
+            ADMISSION_REQUESTS.inc((lane, "admitted"))
+            return tokens
+
+        self._check_locked(lane, tokens, ahead, bounded)
+        waiter = _Waiter(tokens, self._loop.create_future())
+        self._lanes[lane].append(waiter)
+        self._wakeup.set()
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = self._loop.create_task(self._pump(), name="llm-admission")
+
+        start = time.perf_counter()
+        timeout = self.max_wait if bounded and lane not in UNBOUNDED_LANES else None
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout)
+        except asyncio.TimeoutError:
+            pass
+        except BaseException:
+            if not waiter.future.done():
+                waiter.future.cancel()
+            raise
+        if not waiter.future.done():
+            # 超时（可能在等待期间来了更高优先级的请求）
+            waiter.future.cancel()
+            ADMISSION_REQUESTS.inc((lane, "timeout"))
+            ahead = self._ahead(lane)
+            raise AdmissionRejected(
+                lane, len(ahead) + 1, math.ceil(self._projected_wait(ahead, tokens)), f"等待超过 {self.max_wait:g} 秒"
+            )
+        record_span("admission", lane, start)
+        ADMISSION_REQUESTS.inc((lane, "queued"))
+        return tokens
+
+    def settle(self, charged: int, actual: int) -> None:
+        """按实际用量修正预扣的 TPM"""
+        if not self.tokens.enabled:
+            return
+        if actual > charged:
+            self.tokens.take(actual - charged)
+        else:
+            self.tokens.give_back(charged - actual)
+
+    async def _pump(self) -> None:
+        """按优先级依次放行等待者；令牌不足时等到足够或有新的请求到达"""
+        while True:
+            self._wakeup.clear()
+            self._refill()
+            head = None
+            for lane in LANES:
+                waiters = self._lanes[lane]
+                while waiters and waiters[0].future.done():
+                    waiters.popleft()
+                if waiters:
+                    head = waiters[0]
+                    break
+            if head is None:
+                return
+            wait = max(self.requests.wait_time(1), self.tokens.wait_time(head.tokens))
+            if wait <= 0:
+                self.requests.take(1)
+                self.tokens.take(head.tokens)
+                for lane in LANES:
+                    if self._lanes[lane] and self._lanes[lane][0] is head:
+                        self._lanes[lane].popleft()
+                        break
+                head.future.set_result(None)
+                continue
+            try:
+                # 有更高优先级的请求到达时重新选择
+                await asyncio.wait_for(self._wakeup.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "rpm": int(self.requests.capacity),
+            "tpm": int(self.tokens.capacity),
+            "available_requests": round(self.requests.tokens, 2) if self.requests.enabled else None,
+            "available_tokens": round(self.tokens.tokens) if self.tokens.enabled else None,
+            "queued": {lane: sum(1 for w in waiters if not w.future.done()) for lane, waiters in self._lanes.items()},
+        }
+
+
+# 全局单例
+_admission: Optional[AdmissionController] = None
+
+def get_admission_controller() -> AdmissionController:
+    """获取全局准入控制器（所有请求共享同一组令牌桶）"""
+    global _admission
+    if _admission is None:
+        _admission = AdmissionController()
+    return _admission
+
+
+def estimate_request_tokens(*parts: Any) -> int:
+    """一次模型调用预扣的 token 数：输入（字符串或可 JSON 序列化的对象）+ 预期输出"""
+    text = "".join(p if isinstance(p, str) else json.dumps(p, ensure_ascii=False, default=str) for p in parts if p)
+    return estimate_tokens(text) + LLM_EXPECTED_OUTPUT_TOKENS
+
+
+class AdmissionHooks(MetricsHooks):
+    """在每次模型请求前取得准入（排队时间不计入 llm span），返回后按实际用量修正
+
+    只有一次运行中的第一次模型请求可能被拒绝；之后的请求只排队，避免丢弃已经完成的工作。
+    模型请求失败时不会调用 on_llm_end，运行结束后（with 块退出时）退还未结算的预扣。
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._charged: Dict[str, int] = {}
+        self._admitted = False
+
+    def __enter__(self) -> "AdmissionHooks":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.release()
+
+    def release(self) -> None:
+        """退还没有返回用量的模型请求的预扣 TPM"""
+        controller = get_admission_controller()
+        for charged in self._charged.values():
+            controller.settle(charged, 0)
+        self._charged.clear()
+
+    async def on_llm_start(self, context, agent, system_prompt, input_items) -> None:
+        previous = self._charged.pop(agent.name, None)
+        if previous is not None:
+            get_admission_controller().settle(previous, 0)
+        self._charged[agent.name] = await get_admission_controller().acquire(
+            current_lane(), estimate_request_tokens(system_prompt, input_items), bounded=not self._admitted
+        )
+        self._admitted = True
+        await super().on_llm_start(context, agent, system_prompt, input_items)
+
+    async def on_llm_end(self, context, agent, response) -> None:
+        charged = self._charged.pop(agent.name, None)
+        usage = getattr(response, "usage", None)
+        if charged is not None and usage is not None:
+            get_admission_controller().settle(charged, usage.input_tokens + usage.output_tokens)
+        await super().on_llm_end(context, agent, response)
+
+
+def run_hooks() -> AdmissionHooks:
+    """传给 Runner.run(hooks=...) 的钩子：准入控制 + 运行指标
+
+    用法：with run_hooks() as hooks: Runner.run(..., hooks=hooks)，退出时退还失败请求的预扣。
+    """
+    return AdmissionHooks()
+
+
+async def admitted_completion(create, lane: Optional[str] = None, **kwargs: Any) -> Any:
+    """在准入控制下调用 chat.completions.create（规划器、摘要）"""
+    controller = get_admission_controller()
+    charged = await controller.acquire(
+        lane or current_lane(), estimate_request_tokens(kwargs.get("messages"))
+    )
+    actual = 0
+    try:
+        response = await create(**kwargs)
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            actual = (usage.prompt_tokens or 0) + (usage.completion_tokens or 0)
+        else:
+            actual = charged
+        return response
+    finally:
+        # 失败、超时和被取消的对冲请求没有用量，退还预扣
+        controller.settle(charged, actual)
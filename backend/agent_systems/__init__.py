@@ -2,7 +2,13 @@
 from .agents import (
     create_agent_system
 )
+from .registry import (
+    AgentRegistry,
+    get_agent_registry
+)
 
 __all__ = [
-    "create_agent_system"
+    "create_agent_system",
+    "AgentRegistry",
+    "get_agent_registry"
 ]
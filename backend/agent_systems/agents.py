@@ -7,6 +7,7 @@ from typing import Dict, Any, List
 backend_path = Path(__file__).parent.parent
 sys.path.insert(0, str(backend_path))
 from state_store import get_state_store
+from .models import agent_model
 
 # 获取状态存储实例
 state_store = get_state_store()
@@ -251,7 +252,7 @@ def create_agent_system() -> Agent:
 - 需要代码实现时，可以 handoff 给工程师
 - 始终以简洁、清晰的方式给出最终答案
 """,
-        model="gpt-4o-mini",
+        model=agent_model("mathematician"),
         tools=[update_world_state, query_world_state]
     )
     
@@ -274,7 +275,7 @@ def create_agent_system() -> Agent:
 - 用简单语言解释设计理念
 - 需要代码实现时，可以 handoff 给工程师
 """,
-        model="gpt-4o-mini",
+        model=agent_model("artist"),
         tools=[update_world_state, query_world_state, render_idea_to_svg]
     )
 
@@ -298,7 +299,7 @@ def create_agent_system() -> Agent:
 - 需要数学分析时，可以 handoff 给数学家
 - 需要设计优化时，可以 handoff 给艺术家
 """,
-        model="gpt-4o-mini",
+        model=agent_model("engineer"),
         tools=[update_world_state, query_world_state, render_idea_to_svg]
     )
     
@@ -321,7 +322,7 @@ def create_agent_system() -> Agent:
 - 需要数据可视化时，可以 handoff 给艺术家
 - 始终以客观、理性的方式给出建议
 """,
-        model="gpt-4o-mini",
+        model=agent_model("merchant"),
         tools=[update_world_state, query_world_state]
     )
     
@@ -344,7 +345,7 @@ def create_agent_system() -> Agent:
 - 需要健康建议时，可以 handoff 给医生
 - 始终以积极、鼓励的方式给出建议
 """,
-        model="gpt-4o-mini",
+        model=agent_model("athlete"),
         tools=[update_world_state, query_world_state]
     )
     
@@ -367,7 +368,7 @@ def create_agent_system() -> Agent:
 - 需要运动建议时，可以 handoff 给运动员
 - 始终以关怀、负责任的方式给出建议
 """,
-        model="gpt-4o-mini",
+        model=agent_model("doctor"),
         tools=[update_world_state, query_world_state]
     )
     
@@ -405,7 +406,7 @@ def create_agent_system() -> Agent:
 
 你的目标是确保用户的需求得到最好的满足，智能体之间会协作完成任务。
 """,
-        model="gpt-4o-mini",
+        model=agent_model("triage"),
         handoffs=[mathematician, artist, engineer, merchant, athlete, doctor],
         tools=[query_world_state]
     )
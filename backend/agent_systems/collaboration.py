@@ -0,0 +1,176 @@
+"""协作任务执行：按顺序或按依赖关系运行多个智能体，并逐步产出结果"""
+import asyncio
+import sys
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List, Optional
+from agents import Runner
+
+backend_path = Path(__file__).parent.parent
+sys.path.insert(0, str(backend_path))
+from admission import run_hooks
+from resilience import run_config, with_deadline
+from session_compaction import item_text
+from state_store import get_state_store
+
+from .context import ContextBuilder
+from .registry import get_agent_registry
+from .scheduler import run_dependency_graph
+
+state_store = get_state_store()
+
+
+async def iter_collaborative_steps(
+    room_id: str,
+    description: str,
+    agent_order: List[str],
+    session,
+    graph: Optional[Dict[str, List[str]]] = None,
+    max_concurrency: int = 1,
+    context_builder: Optional[ContextBuilder] = None,
+) -> AsyncIterator[Dict[str, Any]]:
+    """执行协作任务，每个智能体完成后立即产出该步骤的结果
+
+    - graph 为 None：按 agent_order 顺序执行，每一步的上下文包含房间之前的对话和之前所有智能体的结果
+    - graph 不为 None：按依赖图执行，结果按完成顺序产出
+
+    上下文由 context_builder 组装（每个前置结果只出现一次并受 token 预算约束），
+    每一步的结果中附带 context_tokens 和 tokens_saved 统计。
+    """
+    builder = context_builder or ContextBuilder(description)
+    if graph is None:
+        async for step in _iter_sequential_steps(room_id, agent_order, session, builder):
+            yield step
+    else:
+        async for step in _iter_graph_steps(room_id, graph, session, max_concurrency, builder):
+            yield step
+
+
+async def _iter_sequential_steps(
+    room_id: str,
+    agent_order: List[str],
+    session,
+    builder: ContextBuilder,
+) -> AsyncIterator[Dict[str, Any]]:
+    """按照指定顺序执行智能体
+
+    房间之前的对话在开始时读取一次（压缩会话返回摘要 + 最近的对话），与之前所有步骤的结果
+    一起由 builder 按预算放入每一步的输入；运行时不回放会话（否则前置结果会重复出现），
+    每步完成后再把该步的输入和输出追加到房间会话中。
+    """
+    agent_registry = get_agent_registry()
+    results = []
+    history = [item_text(item) for item in await session.get_items()]
+
+    for agent_id in agent_order:
+        agent = agent_registry.get(agent_id)
+        agent_name = agent.name
+
+        # 构建上下文消息（包含之前智能体的结果）
+        context, context_stats = await builder.build(agent_name, results, history=history)
+
+        # 运行智能体（不超过请求的截止时间）
+        with run_hooks() as hooks:
+            result = await with_deadline(Runner.run(agent, context, hooks=hooks, run_config=run_config()))
+        await session.add_items([
+            {"role": "user", "content": context},
+            {"role": "assistant", "content": str(result.final_output)}
+        ])
+
+        # 获取当前世界状态
+        world_state = state_store.get_world(room_id)
+
+        step = {
+            "agent_id": agent_id,
+            "agent_name": agent_name,
+            "output": result.final_output,
+            "world_state": world_state,
+            **context_stats
+        }
+        results.append(step)
+        yield step
+
+
+async def _iter_graph_steps(
+    room_id: str,
+    graph: Dict[str, List[str]],
+    session,
+    max_concurrency: int,
+    builder: ContextBuilder,
+) -> AsyncIterator[Dict[str, Any]]:
+    """按依赖图执行协作任务，每个智能体的上下文只包含其直接前置智能体的结果
+
+    并行的步骤不共享会话历史（否则会看到非前置智能体的输出），
+    每步完成后再把该步的输入和输出追加到房间会话中。
+    """
+    agent_registry = get_agent_registry()
+    completed: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue()
+
+    async def run_step(agent_id: str, predecessor_results: List[Dict[str, Any]]) -> Dict[str, Any]:
+        agent = agent_registry.get(agent_id)
+        agent_name = agent.name
+
+        context, context_stats = await builder.build(
+            agent_name, predecessor_results, heading="前置智能体的结果"
+        )
+
+        with run_hooks() as hooks:
+            result = await with_deadline(Runner.run(agent, context, hooks=hooks, run_config=run_config()))
+        await session.add_items([
+            {"role": "user", "content": context},
+            {"role": "assistant", "content": str(result.final_output)}
+        ])
+
+        step = {
+            "agent_id": agent_id,
+            "agent_name": agent_name,
+            "depends_on": graph[agent_id],
+            "output": result.final_output,
+            "world_state": state_store.get_world(room_id),
+            **context_stats
+        }
+        completed.put_nowait(step)
+        return step
+
+    runner = asyncio.ensure_future(run_dependency_graph(graph, run_step, max_concurrency))
+    try:
+        while True:
+            if not completed.empty():
+                yield completed.get_nowait()
+                continue
+            if runner.done():
+                break
+            get_step = asyncio.ensure_future(completed.get())
+            await asyncio.wait({get_step, runner}, return_when=asyncio.FIRST_COMPLETED)
+            if get_step.done():
+                yield get_step.result()
+            else:
+                get_step.cancel()
+        # 传播执行过程中的异常
+        await runner
+    finally:
+        if not runner.done():
+            runner.cancel()
+            await asyncio.gather(runner, return_exceptions=True)
+
+
+def build_summary(description: str, results: List[Dict[str, Any]], use_graph: bool = False) -> str:
+    """生成协作任务的 Markdown 汇总"""
+    if len(results) == 0:
+        return "没有智能体参与任务。"
+
+    summary = f"## 任务完成汇总\n\n"
+    summary += f"**任务描述**: {description}\n\n"
+    summary += f"**参与智能体**: {', '.join([r['agent_name'] for r in results])}\n\n"
+    summary += f"**执行顺序**: {' → '.join([r['agent_name'] for r in results])}\n\n"
+    summary += "---\n\n"
+
+    for i, result in enumerate(results, 1):
+        summary += f"### {i}. {result['agent_name']}\n\n"
+        summary += f"{result['output']}\n\n"
+        summary += "---\n\n"
+
+    if use_graph:
+        summary += f"\n**最终状态**: 所有智能体已按依赖关系完成任务，结果已汇总。"
+    else:
+        summary += f"\n**最终状态**: 所有智能体已按顺序完成任务，结果已汇总。"
+    return summary
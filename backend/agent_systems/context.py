@@ -0,0 +1,243 @@
+"""协作任务上下文构建：每个前置结果只出现一次，并按 token 预算压缩"""
+import inspect
+import math
+import os
+import re
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, Union
+
+# 每一步上下文的默认 token 预算和压缩策略
+COLLAB_CONTEXT_BUDGET = int(os.getenv("COLLAB_CONTEXT_BUDGET", "2000"))
+COLLAB_CONTEXT_STRATEGY = os.getenv("COLLAB_CONTEXT_STRATEGY", "extractive")
+
+# 上下文中房间历史部分的标题
+HISTORY_HEADING = "房间之前的对话"
+
+# 压缩策略：(文本, token 上限) → 压缩后的文本（可以是协程）
+CompactionStrategy = Callable[[str, int], Union[str, Awaitable[str]]]
+
+# 中日韩字符及全角标点大约各占一个 token，其余字符大约 4 个占一个 token
+_CJK_RE = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]")
+_SENTENCE_SPLIT_RE = re.compile(r"(?<=[。！？!?；;\n])|(?<=\.)\s+")
+_WORD_RE = re.compile(r"[A-Za-z][A-Za-z0-9_]{2,}")
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算文本的 token 数（不依赖分词器）"""
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """截断策略：保留开头不超过 max_tokens 的部分"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    budget = max(max_tokens - 1, 0) * 4  # 以 1/4 token 为单位计数，预留省略号
+    used = 0
+    for i, char in enumerate(text):
+        used += 4 if _CJK_RE.match(char) else 1
+        if used > budget:
+            return text[:i].rstrip() + "…"
+    return text
+
+
+def _terms(sentence: str) -> List[str]:
+    """句子的关键词：英文单词 + 中文字符二元组"""
+    terms = [word.lower() for word in _WORD_RE.findall(sentence)]
+    cjk = "".join(_CJK_RE.findall(sentence))
+    terms.extend(cjk[i:i + 2] for i in range(len(cjk) - 1))
+    return terms
+
+
+def extractive_compact(text: str, max_tokens: int) -> str:
+    """抽取式策略：按词频给句子打分，在预算内选出得分最高的句子并保持原有顺序"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    sentences = [s.strip() for s in _SENTENCE_SPLIT_RE.split(text) if s and s.strip()]
+    if len(sentences) <= 1:
+        return truncate_to_tokens(text, max_tokens)
+
+    frequencies = Counter(term for sentence in sentences for term in _terms(sentence))
+    scored = []
+    for position, sentence in enumerate(sentences):
+        terms = _terms(sentence)
+        score = sum(frequencies[t] for t in set(terms)) / math.sqrt(len(terms) + 1)
+        if position == 0:
+            # 首句通常是结论或概述
+            score *= 1.5
+        scored.append((score, position))
+
+    chosen = []
+    seen = set()
+    used = 0
+    for _, position in sorted(scored, reverse=True):
+        sentence = sentences[position]
+        cost = estimate_tokens(sentence) + 1
+        if sentence not in seen and used + cost <= max_tokens:
+            chosen.append(position)
+            seen.add(sentence)
+            used += cost
+    if not chosen:
+        best = max(scored)[1]
+        return truncate_to_tokens(sentences[best], max_tokens)
+    return " ".join(sentences[position] for position in sorted(chosen))
+
+
+async def llm_summarize(text: str, max_tokens: int) -> str:
+    """摘要策略：调用 LLM 生成不超过预算的摘要，失败时退回抽取式压缩"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    try:
+        from admission import admitted_completion
+        from metrics import record_completion_usage
+        from .models import AGENT_MODEL
+        from resilience import call_with_retries
+        from .planner import async_client
+        response = await call_with_retries(lambda: admitted_completion(
+            async_client.chat.completions.create,
+            model=AGENT_MODEL,
+            messages=[
+                {"role": "system", "content": f"请用不超过 {max_tokens} 个 token 概括以下内容，保留关键结论和数据。"},
+                {"role": "user", "content": text}
+            ],
+            max_tokens=max_tokens,
+            temperature=0.2
+        ))
+        record_completion_usage("summarizer", response)
+        summary = response.choices[0].message.content or ""
+        return truncate_to_tokens(summary.strip(), max_tokens)
+    except Exception as e:
+        print(f"[WARNING] 生成摘要失败，改用抽取式压缩: {e}")
+        return extractive_compact(text, max_tokens)
+
+
+COMPACTION_STRATEGIES: Dict[str, CompactionStrategy] = {
+    "truncate": truncate_to_tokens,
+    "extractive": extractive_compact,
+    "summarize": llm_summarize,
+}
+
+
+def register_compaction_strategy(name: str, strategy: CompactionStrategy) -> None:
+    """注册自定义压缩策略"""
+    COMPACTION_STRATEGIES[name] = strategy
+
+
+def keep_recent(lines: List[str], max_tokens: int) -> str:
+    """保留最近的若干行（最早的行先被丢弃），最近一行也放不下时截断"""
+    text = "\n".join(lines)
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    budget = max_tokens - 2  # 预留开头的省略行
+    if budget <= 0:
+        return "…"
+    kept: List[str] = []
+    used = 0
+    for line in reversed(lines):
+        size = estimate_tokens(line) + 1
+        if used + size > budget:
+            if not kept:
+                kept.append(truncate_to_tokens(line, budget))
+            break
+        kept.append(line)
+        used += size
+    kept.append("…")
+    return "\n".join(reversed(kept))
+
+
+def _allocate_budget(sizes: List[int], budget: int) -> List[int]:
+    """按水位线分配预算：较短的结果完整保留，剩余预算平均分给较长的结果"""
+    allocation = [0] * len(sizes)
+    remaining = max(budget, 0)
+    order = sorted(range(len(sizes)), key=lambda i: sizes[i])
+    for k, i in enumerate(order):
+        share = remaining // (len(sizes) - k)
+        allocation[i] = min(sizes[i], share)
+        remaining -= allocation[i]
+    return allocation
+
+
+class ContextBuilder:
+    """为协作任务的每一步组装上下文
+
+    - 每个前置智能体的结果只出现一次（不再随步骤累积重复）
+    - 整个上下文不超过 budget_tokens，超出部分由压缩策略处理
+    - 返回每一步的 token 统计，便于观察压缩节省了多少输入
+    """
+
+    def __init__(
+        self,
+        description: str,
+        budget_tokens: Optional[int] = None,
+        strategy: Optional[str] = None,
+    ):
+        strategy = strategy or COLLAB_CONTEXT_STRATEGY
+        if strategy not in COMPACTION_STRATEGIES:
+            raise ValueError(
+                f"未知的上下文压缩策略 '{strategy}'。可用策略: {list(COMPACTION_STRATEGIES)}"
+            )
+        self.description = description
+        self.budget_tokens = budget_tokens or COLLAB_CONTEXT_BUDGET
+        self.strategy = strategy
+
+    async def build(
+        self,
+        agent_name: str,
+        prior_results: List[Dict[str, Any]],
+        heading: str = "之前智能体的结果",
+        history: Optional[List[str]] = None,
+    ) -> Tuple[str, Dict[str, int]]:
+        """构建发给 agent_name 的上下文，返回 (上下文, token 统计)
+
+        history 为房间之前的对话（每个条目一行，按时间顺序），与前置结果共用预算，
+        超出分配的部分时保留最近的对话。
+        """
+        header = f"任务描述：{self.description}\n\n"
+        footer = f"请{agent_name}根据以上信息完成任务。"
+        history = history or []
+        if not prior_results and not history:
+            context = header + footer
+            tokens = estimate_tokens(context)
+            return context, {"context_tokens": tokens, "full_tokens": tokens, "tokens_saved": 0}
+
+        prefixes = [f"- {r['agent_name']}: " for r in prior_results]
+        outputs = [str(r["output"]) for r in prior_results]
+
+        def assemble(history_text: str, lines: List[str]) -> str:
+            context = header
+            if history:
+                context += f"\n{HISTORY_HEADING}：\n{history_text}\n"
+            if prior_results:
+                context += f"\n{heading}：\n" + "".join(lines)
+            return context + "\n" + footer
+
+        fixed = assemble("", [prefix + "\n" for prefix in prefixes])
+        history_text = "\n".join(history)
+        sizes = ([estimate_tokens(history_text)] if history else []) + [estimate_tokens(o) for o in outputs]
+        full_tokens = estimate_tokens(fixed) + sum(sizes)
+
+        allocation = _allocate_budget(sizes, self.budget_tokens - estimate_tokens(fixed))
+        if history:
+            history_limit, allocation = allocation[0], allocation[1:]
+            history_text = keep_recent(history, history_limit)
+            sizes = sizes[1:]
+        compact = COMPACTION_STRATEGIES[self.strategy]
+        lines = []
+        for prefix, output, size, limit in zip(prefixes, outputs, sizes, allocation):
+            if limit <= 0:
+                output = "…"
+            elif size > limit:
+                output = compact(output, limit)
+                if inspect.isawaitable(output):
+                    output = await output
+            lines.append(prefix + output + "\n")
+
+        context = assemble(history_text, lines)
+        context_tokens = estimate_tokens(context)
+        return context, {
+            "context_tokens": context_tokens,
+            "full_tokens": full_tokens,
+            "tokens_saved": max(full_tokens - context_tokens, 0)
+        }
@@ -0,0 +1,385 @@
+"""离线的假模型和假规划客户端（MODEL_PROVIDER=fake）
+
+不访问网络、不需要 API Key，用于压测和延迟基准：
+- FakeModel 实现 agents SDK 的 Model 接口（get_response / stream_response），
+  按脚本产生 handoff、工具调用（update_world_state / query_world_state）和最终回复
+- FakePlannerClient / FakeAsyncPlannerClient 模拟 OpenAI chat.completions.create，按关键词返回规划 JSON
+
+延迟 = 首 token 延迟（FAKE_MODEL_LATENCY，按分布采样）+ 输出 token 数 / FAKE_MODEL_TOKENS_PER_SEC。
+设置 FAKE_MODEL_ERROR_RATE 时按该概率抛出连接错误，用于验证超时和重试。
+
+脚本（FAKE_MODEL_SCRIPT 指向的 JSON 文件）按智能体 ID（路由智能体为 triage）列出每一轮的动作：
+    {
+      "triage": [{"handoff": "artist"}],
+      "artist": [
+        {"tool": "update_world_state", "arguments": {"mood": "creative"}},
+        {"tool": "query_world_state"},
+        {"text": "设计完成"}
+      ]
+    }
+脚本用完（或没有脚本）时使用默认行为：路由智能体按关键词 handoff，
+其他智能体先调用一次 update_world_state，再给出回复。
+"""
+import asyncio
+import json
+import math
+import os
+import random
+import time
+import uuid
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import httpx
+import openai
+from agents.items import ModelResponse
+from agents.models.interface import Model
+from agents.usage import Usage
+from openai.types import CompletionUsage
+from openai.types.responses import (
+    Response,
+    ResponseCompletedEvent,
+    ResponseFunctionToolCall,
+    ResponseOutputMessage,
+    ResponseOutputText,
+    ResponseTextDeltaEvent,
+    ResponseUsage,
+)
+from openai.types.responses.response_usage import InputTokensDetails, OutputTokensDetails
+
+from .context import estimate_tokens
+
+# 首 token 延迟（秒）的分布：0.2 / fixed:0.2 / uniform:0.1,0.5 / normal:0.3,0.1 / lognormal:0.3,0.5
+FAKE_MODEL_LATENCY = os.getenv("FAKE_MODEL_LATENCY", "0")
+# 输出速度（token/秒），0 表示输出不额外耗时
+FAKE_MODEL_TOKENS_PER_SEC = float(os.getenv("FAKE_MODEL_TOKENS_PER_SEC", "0"))
+# 最终回复的 token 数
+FAKE_MODEL_OUTPUT_TOKENS = int(os.getenv("FAKE_MODEL_OUTPUT_TOKENS", "60"))
+# 脚本文件（JSON），为空时使用默认行为
+FAKE_MODEL_SCRIPT = os.getenv("FAKE_MODEL_SCRIPT", "")
+# 随机种子，设置后延迟采样可复现
+FAKE_MODEL_SEED = os.getenv("FAKE_MODEL_SEED")
+# 每次调用失败（抛出 openai.APIConnectionError）的概率，0~1
+FAKE_MODEL_ERROR_RATE = float(os.getenv("FAKE_MODEL_ERROR_RATE", "0"))
+
+# 路由智能体和规划器使用的关键词
+AGENT_KEYWORDS: Dict[str, Tuple[str, ...]] = {
+    "mathematician": ("数学", "计算", "算法", "证明", "逻辑", "math"),
+    "artist": ("设计", "画", "颜色", "配色", "视觉", "svg", "design"),
+    "engineer": ("代码", "编程", "实现", "程序", "开发", "code"),
+    "merchant": ("经济", "投资", "成本", "商业", "价格", "市场"),
+    "athlete": ("运动", "健身", "训练", "体能"),
+    "doctor": ("健康", "医", "疾病", "症状"),
+}
+
+_rng = random.Random(FAKE_MODEL_SEED)
+
+
+def _maybe_fail() -> None:
+    """按 FAKE_MODEL_ERROR_RATE 模拟上游的瞬时错误"""
+    if FAKE_MODEL_ERROR_RATE > 0 and _rng.random() < FAKE_MODEL_ERROR_RATE:
+        raise openai.APIConnectionError(
+            message="假模型模拟的连接错误", request=httpx.Request("POST", "http://fake-model/v1")
+        )
+
+
+class LatencyDistribution:
+    """按 "类型:参数" 描述的延迟分布采样（秒，不小于 0）"""
+
+    KINDS = ("fixed", "uniform", "normal", "lognormal")
+
+    def __init__(self, spec: str, rng: Optional[random.Random] = None):
+        kind, _, params = spec.partition(":")
+        if not params:
+            kind, params = "fixed", kind
+        if kind not in self.KINDS:
+            raise ValueError(f"未知的延迟分布 '{kind}'。可用分布: {list(self.KINDS)}")
+        self.kind = kind
+        self.params = [float(p) for p in params.split(",")]
+        self.rng = rng or _rng
+
+    def sample(self) -> float:
+        p = self.params
+        if self.kind == "fixed":
+            value = p[0]
+        elif self.kind == "uniform":
+            value = self.rng.uniform(p[0], p[1])
+        elif self.kind == "normal":
+            value = self.rng.gauss(p[0], p[1])
+        else:
+            # 参数为中位数和对数标准差，便于直接填写观测到的 p50
+            value = self.rng.lognormvariate(math.log(p[0]), p[1]) if p[0] > 0 else 0.0
+        return max(value, 0.0)
+
+
+def load_script(path: str = FAKE_MODEL_SCRIPT) -> Dict[str, List[Dict[str, Any]]]:
+    if not path:
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def match_agents(text: str) -> List[str]:
+    """按关键词匹配的智能体 ID（按 AGENT_KEYWORDS 的顺序）"""
+    lowered = text.casefold()
+    return [agent_id for agent_id, words in AGENT_KEYWORDS.items() if any(w in lowered for w in words)]
+
+
+def _content_text(content: Any) -> str:
+    if isinstance(content, list):
+        return " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return str(content or "")
+
+
+def _current_turn(input: Any) -> Tuple[str, int]:
+    """从模型输入中取出最后一条用户消息，以及当前智能体在本轮已经做过的调用次数
+
+    handoff（transfer_to_*）之后由新的智能体接手，计数从 0 开始。
+    """
+    if isinstance(input, str):
+        return input, 0
+    user_text, start = "", 0
+    for i, item in enumerate(input):
+        if item.get("role") == "user":
+            user_text, start = _content_text(item.get("content")), i + 1
+    step = 0
+    for item in input[start:]:
+        if item.get("type") == "function_call":
+            step = 0 if item.get("name", "").startswith("transfer_to_") else step + 1
+    return user_text, step
+
+
+def _handoff_agent_id(handoff) -> Optional[str]:
+    from .registry import _AGENT_NAME_TO_ID
+    return _AGENT_NAME_TO_ID.get(handoff.agent_name)
+
+
+class FakeModel(Model):
+    """按脚本响应的本地模型，每个智能体一个实例"""
+
+    def __init__(
+        self,
+        agent_id: str,
+        latency: Optional[str] = None,
+        tokens_per_sec: Optional[float] = None,
+        output_tokens: Optional[int] = None,
+        script: Optional[Dict[str, List[Dict[str, Any]]]] = None,
+    ):
+        self.agent_id = agent_id
+        self.latency = LatencyDistribution(latency or FAKE_MODEL_LATENCY)
+        self.tokens_per_sec = FAKE_MODEL_TOKENS_PER_SEC if tokens_per_sec is None else tokens_per_sec
+        self.output_tokens = FAKE_MODEL_OUTPUT_TOKENS if output_tokens is None else output_tokens
+        self.script = (load_script() if script is None else script).get(agent_id, [])
+        self.calls = 0
+
+    # 决定本轮动作
+
+    def _action(self, user_text: str, step: int, tools, handoffs) -> Dict[str, Any]:
+        if step < len(self.script):
+            return self.script[step]
+        if handoffs and self.agent_id == "triage" and step == 0:
+            matched = match_agents(user_text)
+            return {"handoff": matched[0] if matched else None}
+        tool_names = {tool.name for tool in tools}
+        if step == 0 and "update_world_state" in tool_names:
+            return {"tool": "update_world_state", "arguments": {"mood": "focused", "task": user_text[:40]}}
+        return {"text": None}
+
+    def _output(self, action: Dict[str, Any], user_text: str, handoffs, max_tokens: Optional[int]) -> List[Any]:
+        if "handoff" in action:
+            target = action["handoff"]
+            for handoff in handoffs:
+                if target is None or _handoff_agent_id(handoff) == target:
+                    return [self._function_call(handoff.tool_name, {})]
+        if "tool" in action:
+            arguments = dict(action.get("arguments", {}))
+            if action["tool"] == "update_world_state":
+                arguments.setdefault("agent_id", self.agent_id)
+            arguments.setdefault("room_id", "default")
+            return [self._function_call(action["tool"], arguments)]
+        return [self._message(action.get("text") or self._reply(user_text, max_tokens))]
+
+    def _reply(self, user_text: str, max_tokens: Optional[int] = None) -> str:
+        head = f"[{self.agent_id}] 已处理：{user_text[:30]}。"
+        # 和真实模型一样遵守 model_settings.max_tokens
+        output_tokens = min(self.output_tokens, max_tokens) if max_tokens else self.output_tokens
+        filler = max(output_tokens - estimate_tokens(head), 0)
+        return head + "好" * filler
+
+    @staticmethod
+    def _function_call(name: str, arguments: Dict[str, Any]) -> ResponseFunctionToolCall:
+        return ResponseFunctionToolCall(
+            id=f"fc_{uuid.uuid4().hex}",
+            call_id=f"call_{uuid.uuid4().hex}",
+            type="function_call",
+            name=name,
+            arguments=json.dumps(arguments, ensure_ascii=False),
+        )
+
+    @staticmethod
+    def _message(text: str) -> ResponseOutputMessage:
+        return ResponseOutputMessage(
+            id=f"msg_{uuid.uuid4().hex}",
+            type="message",
+            role="assistant",
+            status="completed",
+            content=[ResponseOutputText(type="output_text", text=text, annotations=[])],
+        )
+
+    def _respond(self, system_instructions, input, model_settings, tools, handoffs) -> Tuple[List[Any], Usage]:
+        self.calls += 1
+        user_text, step = _current_turn(input)
+        max_tokens = getattr(model_settings, "max_tokens", None)
+        output = self._output(self._action(user_text, step, tools, handoffs), user_text, handoffs, max_tokens)
+        prompt = (system_instructions or "") + json.dumps(input, ensure_ascii=False, default=str)
+        input_tokens = estimate_tokens(prompt)
+        output_tokens = sum(
+            estimate_tokens(item.content[0].text) if isinstance(item, ResponseOutputMessage)
+            else estimate_tokens(item.arguments)
+            for item in output
+        )
+        usage = Usage(
+            requests=1,
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+            total_tokens=input_tokens + output_tokens,
+        )
+        return output, usage
+
+    def _generation_time(self, tokens: int) -> float:
+        return tokens / self.tokens_per_sec if self.tokens_per_sec > 0 else 0.0
+
+    # Model 接口
+
+    async def get_response(self, system_instructions, input, model_settings, tools, output_schema,
+                           handoffs, tracing, *, previous_response_id=None, conversation_id=None,
+                           prompt=None) -> ModelResponse:
+        _maybe_fail()
+        output, usage = self._respond(system_instructions, input, model_settings, tools, handoffs)
+        await asyncio.sleep(self.latency.sample() + self._generation_time(usage.output_tokens))
+        return ModelResponse(output=output, usage=usage, response_id=None)
+
+    async def stream_response(self, system_instructions, input, model_settings, tools, output_schema,
+                              handoffs, tracing, *, previous_response_id=None, conversation_id=None,
+                              prompt=None) -> AsyncIterator[Any]:
+        _maybe_fail()
+        output, usage = self._respond(system_instructions, input, model_settings, tools, handoffs)
+        await asyncio.sleep(self.latency.sample())
+        sequence = 0
+        for index, item in enumerate(output):
+            if not isinstance(item, ResponseOutputMessage):
+                await asyncio.sleep(self._generation_time(estimate_tokens(item.arguments)))
+                continue
+            # 每次输出约 4 个 token
+            text = item.content[0].text
+            for start in range(0, len(text), 4):
+                chunk = text[start:start + 4]
+                await asyncio.sleep(self._generation_time(estimate_tokens(chunk)))
+                yield ResponseTextDeltaEvent(
+                    type="response.output_text.delta", item_id=item.id, output_index=index,
+                    content_index=0, delta=chunk, logprobs=[], sequence_number=sequence,
+                )
+                sequence += 1
+
+        response = Response(
+            id=f"resp_{uuid.uuid4().hex}",
+            created_at=time.time(),
+            model="fake",
+            object="response",
+            output=output,
+            parallel_tool_calls=False,
+            tool_choice="auto",
+            tools=[],
+            usage=ResponseUsage(
+                input_tokens=usage.input_tokens,
+                output_tokens=usage.output_tokens,
+                total_tokens=usage.total_tokens,
+                # 不同版本的 openai 包字段不同，这里不做校验
+                input_tokens_details=InputTokensDetails.model_construct(cached_tokens=0),
+                output_tokens_details=OutputTokensDetails.model_construct(reasoning_tokens=0),
+            ),
+        )
+        yield ResponseCompletedEvent(type="response.completed", response=response, sequence_number=sequence)
+
+
+# 假规划客户端：只实现 planner（和摘要策略）用到的 chat.completions.create
+
+def fake_plan(user_request: str) -> Dict[str, Any]:
+    """按关键词选择智能体，没有匹配时使用 数学家 → 艺术家 → 工程师"""
+    agent_ids = match_agents(user_request) or ["mathematician", "artist", "engineer"]
+    return {
+        "description": user_request,
+        "steps": [
+            {"agent": agent_id, "instruction": f"{user_request}（{agent_id} 部分）", "reason": "关键词匹配"}
+            for agent_id in agent_ids
+        ],
+    }
+
+
+class _Message:
+    def __init__(self, content: str):
+        self.content = content
+
+
+class _Choice:
+    def __init__(self, content: str):
+        self.message = _Message(content)
+
+
+class _Completion:
+    def __init__(self, content: str, prompt_tokens: int):
+        self.choices = [_Choice(content)]
+        completion_tokens = estimate_tokens(content)
+        self.usage = CompletionUsage(
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            total_tokens=prompt_tokens + completion_tokens,
+        )
+
+
+def _complete(messages: List[Dict[str, str]], json_mode: bool) -> Tuple[_Completion, float]:
+    user_text = next((m["content"] for m in reversed(messages) if m["role"] == "user"), "")
+    # JSON 模式为规划请求，否则（摘要）原样返回用户内容，由调用方截断
+    content = json.dumps(fake_plan(user_text), ensure_ascii=False) if json_mode else user_text
+    prompt_tokens = sum(estimate_tokens(m["content"]) for m in messages)
+    completion = _Completion(content, prompt_tokens)
+    delay = LatencyDistribution(FAKE_MODEL_LATENCY).sample()
+    if FAKE_MODEL_TOKENS_PER_SEC > 0:
+        delay += completion.usage.completion_tokens / FAKE_MODEL_TOKENS_PER_SEC
+    return completion, delay
+
+
+class _Completions:
+    def __init__(self, is_async: bool):
+        self._async = is_async
+
+    def create(self, messages: List[Dict[str, str]], **kwargs):
+        completion, delay = _complete(messages, json_mode=kwargs.get("response_format") is not None)
+        if not self._async:
+            _maybe_fail()
+            time.sleep(delay)
+            return completion
+
+        async def wait():
+            _maybe_fail()
+            await asyncio.sleep(delay)
+            return completion
+        return wait()
+
+
+class _Chat:
+    def __init__(self, is_async: bool):
+        self.completions = _Completions(is_async)
+
+
+class FakePlannerClient:
+    """同步假客户端（替代 OpenAI）"""
+
+    def __init__(self):
+        self.chat = _Chat(is_async=False)
+
+
+class FakeAsyncPlannerClient:
+    """异步假客户端（替代 AsyncOpenAI）"""
+
+    def __init__(self):
+        self.chat = _Chat(is_async=True)
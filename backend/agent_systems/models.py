@@ -0,0 +1,40 @@
+"""模型提供方选择：MODEL_PROVIDER=openai（默认）使用 OpenAI，fake 使用本地假模型（见 fake_models）"""
+import os
+from typing import Any, Tuple, Union
+
+from agents.models.interface import Model
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# openai / fake
+MODEL_PROVIDER = os.getenv("MODEL_PROVIDER", "openai")
+# 智能体和规划器使用的 OpenAI 模型
+AGENT_MODEL = os.getenv("AGENT_MODEL", "gpt-4o-mini")
+
+MODEL_PROVIDERS = ("openai", "fake")
+if MODEL_PROVIDER not in MODEL_PROVIDERS:
+    raise ValueError(f"未知的模型提供方 '{MODEL_PROVIDER}'。可用提供方: {list(MODEL_PROVIDERS)}")
+
+
+def is_fake_provider() -> bool:
+    return MODEL_PROVIDER == "fake"
+
+
+def agent_model(agent_id: str) -> Union[str, Model]:
+    """智能体使用的模型：OpenAI 模型名，或该智能体的假模型实例"""
+    if is_fake_provider():
+        from .fake_models import FakeModel
+        return FakeModel(agent_id)
+    return AGENT_MODEL
+
+
+def planner_clients() -> Tuple[Any, Any]:
+    """规划器使用的 (同步客户端, 异步客户端)"""
+    if is_fake_provider():
+        from .fake_models import FakeAsyncPlannerClient, FakePlannerClient
+        return FakePlannerClient(), FakeAsyncPlannerClient()
+    from openai import AsyncOpenAI, OpenAI
+    api_key = os.getenv("OPENAI_API_KEY")
+    # 异步调用的超时和重试由 resilience.call_with_retries 处理，关闭客户端自带的重试
+    return OpenAI(api_key=api_key), AsyncOpenAI(api_key=api_key, max_retries=0)
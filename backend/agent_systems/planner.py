@@ -1,12 +1,26 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
+from collections import OrderedDict
+import asyncio
+import copy
 import json
-from openai import OpenAI
+import time
 import os
 from dotenv import load_dotenv
 
+from admission import AdmissionRejected, admitted_completion
+from metrics import record_completion_usage
+from resilience import PLAN_HEDGE_DELAY, DeadlineExceeded, call_with_retries
+
+from .models import AGENT_MODEL, planner_clients
+
 load_dotenv()
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# MODEL_PROVIDER=fake 时为本地假客户端
+client, async_client = planner_clients()
+
+# 规划缓存配置
+PLAN_CACHE_SIZE = int(os.getenv("PLAN_CACHE_SIZE", "256"))
+PLAN_CACHE_TTL = float(os.getenv("PLAN_CACHE_TTL", "600"))
 
 PLANNER_INSTRUCTIONS = """
 你是一个多智能体系统的任务规划专家。你的目标是将用户的复杂请求拆解为一系列有序的子任务，并分配给最合适的智能体。
@@ -49,27 +63,169 @@ PLANNER_INSTRUCTIONS = """
 }
 """
 
+class PlanCache:
+    """有界的 LRU + TTL 规划缓存"""
+
+    def __init__(self, max_size: int = PLAN_CACHE_SIZE, ttl: float = PLAN_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        # key → (过期时间, 规划结果)
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """获取未过期的规划，命中时移到最近使用位置"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, plan = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return plan
+
+    def set(self, key: str, plan: Dict[str, Any]) -> None:
+        """写入规划，超出容量时淘汰最久未使用的条目"""
+        if self.max_size <= 0:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, plan)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+plan_cache = PlanCache()
+
+# 正在进行中的规划请求：key → Task，相同描述的并发请求共享同一次上游调用
+_inflight: Dict[str, "asyncio.Task[Dict[str, Any]]"] = {}
+
+
+def normalize_description(user_request: str) -> str:
+    """规范化任务描述作为缓存 key（去除首尾空白、合并连续空白、忽略大小写）"""
+    return " ".join(user_request.split()).casefold()
+
+
+def _planner_messages(user_request: str) -> List[Dict[str, str]]:
+    return [
+        {"role": "system", "content": PLANNER_INSTRUCTIONS},
+        {"role": "user", "content": user_request}
+    ]
+
+
+def validate_plan(plan: Any) -> Dict[str, Any]:
+    """检查模型返回的规划结构：steps 为列表，每一步的 agent 是已注册的智能体 ID，
+    instruction 和 reason 为字符串；不符合时抛出 ValueError
+    """
+    from .registry import get_agent_registry
+
+    if not isinstance(plan, dict):
+        raise ValueError(f"规划结果不是 JSON 对象: {type(plan).__name__}")
+    if not isinstance(plan.get("description"), str):
+        raise ValueError("规划结果缺少 description")
+    steps = plan.get("steps")
+    if not isinstance(steps, list):
+        raise ValueError("规划结果的 steps 不是列表")
+    agent_ids = get_agent_registry().ids
+    for index, step in enumerate(steps, 1):
+        if not isinstance(step, dict):
+            raise ValueError(f"第 {index} 步不是 JSON 对象")
+        if step.get("agent") not in agent_ids:
+            raise ValueError(f"第 {index} 步的智能体 {step.get('agent')!r} 不存在")
+        for field in ("instruction", "reason"):
+            if not isinstance(step.get(field), str):
+                raise ValueError(f"第 {index} 步缺少 {field}")
+    return plan
+
+
+def _fallback_plan(user_request: str) -> Dict[str, Any]:
+    # 降级处理：如果规划失败，默认分配给任务分配员（这里返回空步骤，由前端处理）
+    return {
+        "description": user_request,
+        "steps": []
+    }
+
+
 def plan_task(user_request: str) -> Dict[str, Any]:
     """
-    使用 LLM 规划任务
+    使用 LLM 规划任务（同步版本，会阻塞调用线程）
     """
     try:
         response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": PLANNER_INSTRUCTIONS},
-                {"role": "user", "content": user_request}
-            ],
+            model=AGENT_MODEL,
+            messages=_planner_messages(user_request),
             response_format={"type": "json_object"},
             temperature=0.7
         )
+        record_completion_usage("planner", response)
         
         content = response.choices[0].message.content
-        return json.loads(content)
+        return validate_plan(json.loads(content))
+    except Exception as e:
+        print(f"规划任务失败: {e}")
+        return _fallback_plan(user_request)
+
+
+async def _fetch_plan(key: str, user_request: str) -> Dict[str, Any]:
+    """调用上游 LLM 规划任务，结构校验通过后写入缓存
+
+    规划是只读的，瞬时错误会重试；设置 PLAN_HEDGE_DELAY 时慢请求会被对冲。
+    """
+    response = await call_with_retries(
+        lambda: admitted_completion(
+            async_client.chat.completions.create,
+            model=AGENT_MODEL,
+            messages=_planner_messages(user_request),
+            response_format={"type": "json_object"},
+            temperature=0.7
+        ),
+        hedge_delay=PLAN_HEDGE_DELAY
+    )
+    record_completion_usage("planner", response)
+    plan = validate_plan(json.loads(response.choices[0].message.content))
+    plan_cache.set(key, plan)
+    return plan
+
+
+def _finish_inflight(key: str, task: "asyncio.Task[Dict[str, Any]]") -> None:
+    if _inflight.get(key) is task:
+        del _inflight[key]
+    # 标记异常已读取，避免所有等待者都被取消时出现 "exception was never retrieved"
+    if not task.cancelled():
+        task.exception()
+
+
+async def plan_task_async(user_request: str) -> Dict[str, Any]:
+    """
+    使用 LLM 规划任务（异步版本，不阻塞事件循环）
+
+    相同（规范化后）描述的规划结果会被缓存；并发的相同请求只触发一次上游调用。
+    模型调用或结果解析失败时返回降级结果，且不写入缓存；准入被拒绝和超时直接抛出，
+    由接口返回 429 / 504。
+    """
+    key = normalize_description(user_request)
+
+    plan = plan_cache.get(key)
+    if plan is not None:
+        return copy.deepcopy(plan)
+
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_fetch_plan(key, user_request))
+        _inflight[key] = task
+        task.add_done_callback(lambda t: _finish_inflight(key, t))
+
+    try:
+        # shield：单个请求被取消时不影响其他等待者，结果仍会写入缓存
+        plan = await asyncio.shield(task)
+    except (AdmissionRejected, DeadlineExceeded, asyncio.TimeoutError):
+        raise
     except Exception as e:
         print(f"规划任务失败: {e}")
-        # 降级处理：如果规划失败，默认分配给任务分配员（这里返回空步骤，由前端处理）
-        return {
-            "description": user_request,
-            "steps": []
-        }
+        return _fallback_plan(user_request)
+    return copy.deepcopy(plan)
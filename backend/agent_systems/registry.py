@@ -0,0 +1,110 @@
+"""智能体注册表：进程内只构建一次智能体图，并提供 O(1) 的 ID → 智能体索引"""
+from types import MappingProxyType
+from typing import Dict, Mapping, Optional, Tuple
+from agents import Agent
+
+from .agents import create_agent_system
+
+# 智能体英文 ID（与前端、planner 使用的 ID 一致），按 triage handoffs 的顺序排列
+AGENT_IDS: Tuple[str, ...] = (
+    "mathematician",
+    "artist",
+    "engineer",
+    "merchant",
+    "athlete",
+    "doctor",
+)
+
+# 英文 ID → 中文显示名
+AGENT_DISPLAY_NAMES: Mapping[str, str] = MappingProxyType({
+    "mathematician": "数学家",
+    "artist": "艺术家",
+    "engineer": "工程师",
+    "merchant": "商人",
+    "athlete": "运动员",
+    "doctor": "医生",
+})
+
+# Agent.name → 英文 ID（create_agent_system 中部分智能体用英文名，部分用中文名）
+_AGENT_NAME_TO_ID: Mapping[str, str] = MappingProxyType({
+    "Mathematician": "mathematician",
+    "Artist": "artist",
+    "Engineer": "engineer",
+    "商人": "merchant",
+    "运动员": "athlete",
+    "医生": "doctor",
+})
+
+
+class AgentRegistry:
+    """不可变的智能体注册表
+
+    智能体图（六个智能体 + 路由智能体及其 handoffs）只在构造时创建一次，
+    之后所有请求共享同一组 Agent 对象。Agent 本身是无状态的配置对象，
+    会话历史和世界状态分别由 session 和 StateStore 管理，因此可以安全复用。
+    """
+
+    __slots__ = ("_triage", "_agents", "_index")
+
+    def __init__(self, triage_agent: Agent):
+        agents_by_id: Dict[str, Agent] = {}
+        for handoff in triage_agent.handoffs:
+            agent_id = _AGENT_NAME_TO_ID.get(handoff.name)
+            if agent_id is None:
+                raise ValueError(f"未知的智能体名称: {handoff.name}")
+            agents_by_id[agent_id] = handoff
+
+        # 查找索引：英文 ID、Agent.name、小写 Agent.name、中文显示名都指向同一个智能体
+        index: Dict[str, str] = {}
+        for agent_id, agent in agents_by_id.items():
+            index[agent_id] = agent_id
+            index[agent.name] = agent_id
+            index[agent.name.lower()] = agent_id
+            index[AGENT_DISPLAY_NAMES[agent_id]] = agent_id
+
+        self._triage = triage_agent
+        self._agents: Mapping[str, Agent] = MappingProxyType(agents_by_id)
+        self._index: Mapping[str, str] = MappingProxyType(index)
+
+    @property
+    def triage(self) -> Agent:
+        """路由智能体（任务分配员）"""
+        return self._triage
+
+    @property
+    def agents(self) -> Mapping[str, Agent]:
+        """英文 ID → 智能体（只读）"""
+        return self._agents
+
+    @property
+    def ids(self) -> Tuple[str, ...]:
+        """所有智能体的英文 ID"""
+        return tuple(self._agents)
+
+    def resolve_id(self, key: str) -> Optional[str]:
+        """把英文 ID 或显示名解析为英文 ID，未找到返回 None"""
+        return self._index.get(key)
+
+    def get(self, key: str) -> Optional[Agent]:
+        """按英文 ID 或显示名获取智能体，未找到返回 None"""
+        agent_id = self._index.get(key)
+        if agent_id is None:
+            return None
+        return self._agents[agent_id]
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._index
+
+    def __len__(self) -> int:
+        return len(self._agents)
+
+
+# 全局单例
+_agent_registry: Optional[AgentRegistry] = None
+
+def get_agent_registry() -> AgentRegistry:
+    """获取全局智能体注册表（首次调用时构建智能体图）"""
+    global _agent_registry
+    if _agent_registry is None:
+        _agent_registry = AgentRegistry(create_agent_system())
+    return _agent_registry
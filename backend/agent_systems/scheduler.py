@@ -0,0 +1,100 @@
+"""协作任务调度：按依赖关系（DAG）并行执行智能体步骤"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+# 步骤执行函数：(智能体ID, 前置步骤结果列表) → 本步骤结果
+StepRunner = Callable[[str, List[Dict[str, Any]]], Awaitable[Dict[str, Any]]]
+
+
+def build_dependency_graph(
+    agent_order: List[str],
+    dependencies: Optional[Dict[str, List[str]]] = None,
+    parallel_groups: Optional[List[List[str]]] = None,
+) -> Dict[str, List[str]]:
+    """构建依赖图：智能体ID → 直接前置智能体列表
+
+    - dependencies: 显式给出每个智能体依赖的智能体，未出现的智能体视为无依赖
+    - parallel_groups: 分组执行，组内并行，每组依赖前一组的全部智能体
+
+    返回的字典按拓扑顺序排列（同层内保持 agent_order 的顺序）。
+    依赖不合法（重复、未知智能体、存在环）时抛出 ValueError。
+    """
+    if len(set(agent_order)) != len(agent_order):
+        raise ValueError("按依赖关系执行时，agent_order 中的智能体不能重复")
+
+    graph: Dict[str, List[str]] = {agent_id: [] for agent_id in agent_order}
+
+    if parallel_groups:
+        grouped = [agent_id for group in parallel_groups for agent_id in group]
+        if sorted(grouped) != sorted(agent_order):
+            raise ValueError("parallel_groups 必须恰好包含 agent_order 中的每个智能体一次")
+        for previous, group in zip(parallel_groups, parallel_groups[1:]):
+            for agent_id in group:
+                graph[agent_id] = list(previous)
+
+    for agent_id, predecessors in (dependencies or {}).items():
+        if agent_id not in graph:
+            raise ValueError(f"依赖关系中的智能体 '{agent_id}' 不在 agent_order 中")
+        for predecessor in predecessors:
+            if predecessor not in graph:
+                raise ValueError(f"智能体 '{agent_id}' 依赖的 '{predecessor}' 不在 agent_order 中")
+            if predecessor == agent_id:
+                raise ValueError(f"智能体 '{agent_id}' 不能依赖自身")
+            if predecessor not in graph[agent_id]:
+                graph[agent_id].append(predecessor)
+
+    # Kahn 拓扑排序，同时检测环
+    remaining = {agent_id: len(predecessors) for agent_id, predecessors in graph.items()}
+    ordered: Dict[str, List[str]] = {}
+    ready = [agent_id for agent_id in agent_order if remaining[agent_id] == 0]
+    while ready:
+        next_ready = []
+        for agent_id in ready:
+            ordered[agent_id] = graph[agent_id]
+            for other in agent_order:
+                if agent_id in graph[other]:
+                    remaining[other] -= 1
+                    if remaining[other] == 0:
+                        next_ready.append(other)
+        ready = next_ready
+
+    if len(ordered) != len(graph):
+        cyclic = [agent_id for agent_id in agent_order if agent_id not in ordered]
+        raise ValueError(f"依赖关系存在环: {cyclic}")
+    return ordered
+
+
+async def run_dependency_graph(
+    graph: Dict[str, List[str]],
+    run_step: StepRunner,
+    max_concurrency: int,
+) -> Dict[str, Dict[str, Any]]:
+    """按依赖图执行步骤
+
+    每个步骤在其全部前置步骤完成后立即开始，同时运行的步骤数不超过 max_concurrency。
+    任一步骤失败时取消其余步骤并抛出该异常。
+    """
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+    results: Dict[str, Dict[str, Any]] = {}
+    tasks: Dict[str, "asyncio.Task[Dict[str, Any]]"] = {}
+
+    async def run_node(agent_id: str) -> Dict[str, Any]:
+        predecessors = graph[agent_id]
+        if predecessors:
+            await asyncio.gather(*(tasks[p] for p in predecessors))
+        async with semaphore:
+            results[agent_id] = await run_step(agent_id, [results[p] for p in predecessors])
+        return results[agent_id]
+
+    # graph 已按拓扑顺序排列，创建任务时前置任务一定已存在
+    for agent_id in graph:
+        tasks[agent_id] = asyncio.ensure_future(run_node(agent_id))
+
+    try:
+        await asyncio.gather(*tasks.values())
+    except BaseException:
+        for task in tasks.values():
+            task.cancel()
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+        raise
+    return results
@@ -1,10 +1,13 @@
 """FastAPI 应用主文件"""
+import json
 import os
 from dotenv import load_dotenv
-from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
+import time
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Awaitable, Callable
 import asyncio
 from agents import Runner
 
@@ -14,10 +17,26 @@ from pathlib import Path
 backend_path = Path(__file__).parent
 sys.path.insert(0, str(backend_path))
 
-from agent_systems import create_agent_system
-from agent_systems.planner import plan_task
-from sessions import get_session
+from agent_systems import get_agent_registry
+from agent_systems.collaboration import build_summary, iter_collaborative_steps
+from agent_systems.context import COMPACTION_STRATEGIES, ContextBuilder
+from agent_systems.scheduler import build_dependency_graph
+from agent_systems.planner import plan_task_async
+from sessions import clear_session, get_session_manager, session_scope
+from session_compaction import CompactingSession
 from state_store import get_state_store
+from streaming import iter_run_events, sse_response
+from room_executor import get_room_executor
+from response_cache import get_response_cache
+from connections import Connection, ConnectionManager, encode_message
+from admission import AdmissionRejected, get_admission_controller, run_hooks
+from jobs import JOB_STATUSES, Job, JobQueueFull, get_job_manager
+from resilience import (
+    JOB_TIMEOUT, cancel_at_deadline, check_deadline, deadline_scope, error_status, request_timeout,
+    run_config, with_deadline
+)
+from usage import bind_usage_scope, get_usage_tracker, usage_scope
+from metrics import HTTP_REQUEST_DURATION, METRICS_TRACE, end_trace, get_trace, registry as metrics_registry, start_trace
 
 # 加载环境变量
 load_dotenv()
@@ -41,11 +60,60 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Trace-Id", "X-Correlation-Id", "Server-Timing"],
 )
 
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """记录请求耗时；开启追踪时返回 X-Trace-Id 和按类别汇总的 Server-Timing 响应头"""
+    trace = token = None
+    if METRICS_TRACE:
+        # 追踪ID由服务端生成；客户端的 X-Correlation-Id（或 X-Trace-Id）只作为关联ID记录并原样返回
+        correlation_id = request.headers.get("x-correlation-id") or request.headers.get("x-trace-id") or ""
+        trace, token = start_trace(correlation_id[:64] or None)
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        route = getattr(request.scope.get("route"), "path", "unmatched")
+        HTTP_REQUEST_DURATION.observe(time.perf_counter() - start, (request.method, route, str(status)))
+        if trace is not None:
+            end_trace(trace, token)
+    if trace is not None:
+        response.headers["X-Trace-Id"] = trace.trace_id
+        if trace.correlation_id is not None:
+            response.headers["X-Correlation-Id"] = trace.correlation_id
+        response.headers["Server-Timing"] = trace.server_timing()
+    return response
+
+@app.middleware("http")
+async def request_deadline(request: Request, call_next):
+    """为请求设置截止时间（REQUEST_TIMEOUT 秒，客户端可用 X-Request-Timeout 指定），
+    随请求传播到房间执行队列、handoff 和协作任务的每一步，超过时返回 504"""
+    with deadline_scope(request_timeout(request.headers.get("x-request-timeout"))):
+        return await call_next(request)
+
 # 获取状态存储
 state_store = get_state_store()
 
+# 协作任务按依赖关系并行执行时的默认并发上限
+COLLAB_MAX_CONCURRENCY = int(os.getenv("COLLAB_MAX_CONCURRENCY", "4"))
+
+# 智能体注册表（启动时构建一次智能体图，所有请求共享）
+agent_registry = get_agent_registry()
+# 同一房间的运行依次执行，不同房间并行
+room_executor = get_room_executor()
+# 响应缓存（RESPONSE_CACHE=1 时生效）
+response_cache = get_response_cache()
+# 按房间、智能体、接口统计模型用量，超出预算时拒绝或降级
+usage_tracker = get_usage_tracker()
+# 模型调用准入控制（RPM / TPM 令牌桶，interactive > batch > background 优先级通道）
+admission = get_admission_controller()
+# 后台任务（长时间运行的协作任务），由固定数量的工作协程执行
+job_manager = get_job_manager()
+
 # 请求模型
 class MessageRequest(BaseModel):
     message: str
@@ -55,19 +123,42 @@ class MessageResponse(BaseModel):
     output: str
     world_state: Dict[str, Any]
     agent_used: Optional[str] = None
+    # 合并模式下与本条消息一起运行的消息数
+    coalesced: int = 1
+    # 是否命中响应缓存
+    cached: bool = False
+    # 本次请求的模型用量（调用次数、token 数、费用、是否降级）
+    usage: Optional[Dict[str, Any]] = None
 
 class WorldStateResponse(BaseModel):
     world_state: Dict[str, Any]
+    version: Optional[int] = None
 
 class CollaborativeTaskRequest(BaseModel):
     description: str
     selected_agents: List[str]
     agent_order: List[str]
+    # 可选的依赖关系：智能体ID → 前置智能体ID 列表；提供后无依赖的智能体并行执行
+    dependencies: Optional[Dict[str, List[str]]] = None
+    # 可选的并行分组：组内并行，组间按顺序（每组依赖前一组的全部智能体）
+    parallel_groups: Optional[List[List[str]]] = None
+    # 并行执行时的最大并发数，默认使用 COLLAB_MAX_CONCURRENCY
+    max_concurrency: Optional[int] = None
+    # 每一步上下文的 token 预算和压缩策略（truncate/extractive/summarize），默认见 agent_systems.context
+    context_budget: Optional[int] = None
+    context_strategy: Optional[str] = None
 
 class CollaborativeTaskResponse(BaseModel):
     results: List[Dict[str, Any]]
     summary: str
     final_world_state: Dict[str, Any]
+    cached: bool = False
+    usage: Optional[Dict[str, Any]] = None
+
+class UsageBudgetRequest(BaseModel):
+    # 每天的 token / 费用（美元）预算，0 表示不限制，None 表示使用默认值（USAGE_ROOM_DAILY_*）
+    daily_tokens: Optional[int] = None
+    daily_cost_usd: Optional[float] = None
 
 class TaskAnalysisRequest(BaseModel):
     description: str
@@ -82,26 +173,83 @@ class TaskAnalysisResponse(BaseModel):
     steps: List[TaskStep]
 
 # WebSocket 连接管理器
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
+manager = ConnectionManager()
+
+def send_world_state(connection: Connection):
+    """发送完整的世界状态（连接建立、客户端请求重新同步或版本不连续时）"""
+    version, world_state = state_store.get_versioned_world(connection.room_id)
+    if manager.send(connection.websocket, {
+        "type": "world_state",
+        "version": version,
+        "data": world_state
+    }):
+        connection.version = version
+
+def push_world_delta(delta: Dict[str, Any]):
+    """把世界状态增量推送给房间内的连接
+    
+    客户端版本正好等于 base_version 时只发送增量；已经包含该版本的连接跳过；
+    版本不连续（例如错过了增量）时改为发送完整状态。增量帧只序列化一次。
+    """
+    connections = manager.room_connections(delta["room_id"])
+    if not connections:
+        return
+    frame = encode_message({
+        "type": "world_delta",
+        "base_version": delta["base_version"],
+        "version": delta["version"],
+        "patch": delta["patch"]
+    })
+    for connection in connections:
+        if connection.version == delta["base_version"]:
+            if manager.send(connection.websocket, frame) and connection.version is not None:
+                connection.version = delta["version"]
+        elif connection.version is None or connection.version < delta["version"]:
+            send_world_state(connection)
+
+def push_world_state(room_id: str):
+    """向房间内的所有连接发送完整状态"""
+    for connection in manager.room_connections(room_id):
+        send_world_state(connection)
+
+@app.on_event("startup")
+async def startup():
+    """订阅世界状态变化，把增量推送给 WebSocket 客户端"""
+    loop = asyncio.get_running_loop()
     
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
+    def on_world_delta(room_id: str, delta: Dict[str, Any]):
+        # 在持有状态锁的线程中调用，只把推送按顺序交给事件循环
+        loop.call_soon_threadsafe(push_world_delta, delta)
     
-    def disconnect(self, websocket: WebSocket):
-        if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
+    state_store.subscribe(on_world_delta)
+    app.state.world_delta_listener = on_world_delta
     
-    async def send_personal_message(self, message: str, websocket: WebSocket):
-        await websocket.send_text(message)
+    # 运行状态指标（读取 /metrics 时取值）
+    metrics_registry.gauge("sessions_open", "Open room sessions", lambda: get_session_manager().stats()["open_sessions"])
+    metrics_registry.gauge("room_queue_depth", "Runs waiting in room queues", lambda: room_executor.stats()["queued"])
+    metrics_registry.gauge("rooms_active", "Rooms with queued or running work", lambda: room_executor.stats()["active_rooms"])
+    metrics_registry.gauge("ws_connections", "Open WebSocket connections", lambda: len(manager.connections))
+    metrics_registry.gauge("response_cache_hits", "Response cache hits", lambda: response_cache.hits)
+    metrics_registry.gauge("response_cache_misses", "Response cache misses", lambda: response_cache.misses)
+    metrics_registry.gauge("llm_admission_queued", "Model calls waiting for admission", lambda: sum(admission.stats()["queued"].values()))
+    metrics_registry.gauge("jobs_queued", "Background jobs waiting for a worker", lambda: job_manager.stats()["queued"])
+    metrics_registry.gauge("jobs_running", "Background jobs being executed", lambda: job_manager.stats()["running"])
     
-    async def broadcast(self, message: str):
-        for connection in self.active_connections:
-            await connection.send_text(message)
+    # 后台任务：注册处理函数后启动工作协程（恢复上次未执行的任务）
+    job_manager.register("collaborative", run_collaborative_job)
+    await job_manager.start()
 
-manager = ConnectionManager()
+@app.on_event("shutdown")
+async def shutdown():
+    """关闭时把写回模式下尚未持久化的状态全部写入"""
+    listener = getattr(app.state, "world_delta_listener", None)
+    if listener is not None:
+        state_store.unsubscribe(listener)
+    await job_manager.close()
+    get_session_manager().close()
+    response_cache.close()
+    usage_tracker.close()
+    await asyncio.to_thread(state_store.close)
 
 @app.get("/")
 async def root():
@@ -112,17 +260,86 @@ async def root():
         "endpoints": {
             "health": "/api/health",
             "message": "/api/rooms/{room_id}/message",
+            "message-stream": "/api/rooms/{room_id}/message/stream",
             "state": "/api/rooms/{room_id}/state",
+            "events": "/api/rooms/{room_id}/events",
+            "session": "/api/rooms/{room_id}/session",
+            "queue": "/api/rooms/{room_id}/queue",
             "collaborative-task": "/api/rooms/{room_id}/collaborative-task",
+            "collaborative-task-stream": "/api/rooms/{room_id}/collaborative-task/stream",
+            "collaborative-task-job": "/api/rooms/{room_id}/collaborative-task/jobs",
+            "jobs": "/api/rooms/{room_id}/jobs",
+            "job": "/api/jobs/{job_id}",
+            "job-events": "/api/jobs/{job_id}/events",
             "clear": "/api/rooms/{room_id}",
-            "websocket": "/ws/rooms/{room_id}"
+            "websocket": "/ws/rooms/{room_id}",
+            "connections": "/api/connections",
+            "usage": "/api/usage",
+            "room-usage": "/api/rooms/{room_id}/usage",
+            "metrics": "/metrics",
+            "trace": "/api/traces/{trace_id}"
         }
     }
 
 @app.get("/api/health")
 async def health():
     """健康检查"""
-    return {"status": "ok", "message": "服务运行正常"}
+    return {"status": "ok", "message": "服务运行正常", "state": state_store.stats(), "sessions": get_session_manager().stats(), "rooms": room_executor.stats(), "response_cache": response_cache.stats(), "usage": usage_tracker.stats(), "jobs": job_manager.stats(), "admission": admission.stats()}
+
+def _check_budget(room_id: Optional[str]) -> bool:
+    """检查预算：超出且处理方式为 reject 时返回 429，返回本次请求是否降级"""
+    status = usage_tracker.check_budget(room_id)
+    if status.rejected:
+        raise HTTPException(status_code=429, detail=f"超出用量预算: {status.exceeded}")
+    return status.downgraded
+
+def _admission_error(e: AdmissionRejected) -> HTTPException:
+    """模型调用排队已满：429，附带通道、排队位置和建议的重试时间"""
+    return HTTPException(status_code=429, detail=e.to_dict(), headers={"Retry-After": str(int(e.retry_after))})
+
+def _http_error(e: Exception, action: str) -> HTTPException:
+    """把执行中的错误映射为 HTTP 状态码：超时 504，上游限流 503，上游出错 502，其余 500"""
+    if isinstance(e, HTTPException):
+        return e
+    if isinstance(e, AdmissionRejected):
+        return _admission_error(e)
+    status, reason = error_status(e)
+    if status == 500:
+        import traceback
+        traceback.print_exc()
+    return HTTPException(status_code=status, detail=f"{action}: {reason}")
+
+def _error_event(e: Exception, action: str) -> Dict[str, Any]:
+    """流式接口的 error 事件（状态码含义同 _http_error）"""
+    if isinstance(e, AdmissionRejected):
+        return {"status": 429, **e.to_dict()}
+    error = _http_error(e, action)
+    return {"status": error.status_code, "detail": error.detail}
+
+def _check_admission(lane: str) -> None:
+    """请求进入房间队列之前检查通道是否已饱和，饱和时直接返回 429"""
+    try:
+        admission.check(lane)
+    except AdmissionRejected as e:
+        raise _admission_error(e)
+
+def _resolve_message_target(request: MessageRequest):
+    """确定处理消息的智能体，返回 (智能体, 指定的智能体名称或 None, 用户输入)"""
+    # 默认由路由智能体分配；如果指定了目标智能体，直接使用该智能体
+    agent_to_use = agent_registry.triage
+    agent_name = None
+    
+    if request.target_agent:
+        target = agent_registry.get(request.target_agent)
+        if target is not None:
+            agent_to_use = target
+            agent_name = target.name
+    
+    # 构建用户消息
+    user_input = request.message
+    if agent_name:
+        user_input = f"[指定给{agent_name}] {request.message}"
+    return agent_to_use, agent_name, user_input
 
 @app.post("/api/rooms/{room_id}/message", response_model=MessageResponse)
 async def send_message(room_id: str, request: MessageRequest):
@@ -132,209 +349,478 @@ async def send_message(room_id: str, request: MessageRequest):
         room_id: 房间ID
         request: 消息请求，包含用户消息和可选的指定智能体
     """
+    downgraded = _check_budget(room_id)
+    _check_admission("interactive")
     try:
-        # 获取会话
-        session = get_session(room_id)
-        
-        # 创建智能体系统
-        triage_agent = create_agent_system()
-        
-        # 如果指定了目标智能体，直接使用该智能体
-        agent_to_use = triage_agent
-        agent_name = None
+        await state_store.preload(room_id)
         
-        if request.target_agent:
-            # 获取指定的智能体
-            for handoff in triage_agent.handoffs:
-                if handoff.name == request.target_agent or \
-                   (request.target_agent == "mathematician" and "数学" in handoff.name) or \
-                   (request.target_agent == "artist" and "艺术" in handoff.name) or \
-                   (request.target_agent == "engineer" and "工程" in handoff.name):
-                    agent_to_use = handoff
-                    agent_name = handoff.name
-                    break
+        agent_to_use, agent_name, user_input = _resolve_message_target(request)
         
-        # 构建用户消息
-        user_input = request.message
-        if request.target_agent:
-            user_input = f"[指定给{agent_name}] {request.message}"
+        async def run_messages(messages: List[str]):
+            text = "\n\n".join(messages)
+            # 运行智能体（运行期间持有会话，避免被淘汰关闭）
+            with session_scope(room_id) as session:
+                async def run():
+                    with run_hooks() as hooks:
+                        result = await with_deadline(Runner.run(
+                            agent_to_use, text, session=session, hooks=hooks, run_config=run_config()
+                        ))
+                    return {"output": result.final_output}
+                
+                # 降级运行的结果与正常运行分开缓存
+                value, cached = await response_cache.run_cached(
+                    room_id, session, "message", agent_to_use.name, text, run,
+                    options={"downgraded": True} if downgraded else None
+                )
+            return value, len(messages), cached
         
-        # 运行智能体
-        result = await Runner.run(agent_to_use, user_input, session=session)
+        # 在房间的执行队列中运行；合并模式下与排队中发给同一智能体的消息一起运行
+        # 合并运行的用量记在发起运行的请求名下；排队和运行都不超过本请求的截止时间
+        with usage_scope(room_id, "message", downgraded) as usage:
+            value, coalesced, cached = await with_deadline(room_executor.run_coalesced(
+                room_id, ("message", request.target_agent), user_input, run_messages
+            ))
         
         # 获取最新世界状态
         world_state = state_store.get_world(room_id)
         
         return MessageResponse(
-            output=result.final_output,
+            output=value["output"],
             world_state=world_state,
-            agent_used=agent_name or "任务分配员"
+            agent_used=agent_name or "任务分配员",
+            coalesced=coalesced,
+            cached=cached,
+            usage=usage.to_dict()
         )
     
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"处理消息时出错: {str(e)}")
+        raise _http_error(e, "处理消息时出错")
+
+@app.post("/api/rooms/{room_id}/message/stream")
+async def stream_message(room_id: str, request: MessageRequest):
+    """以 SSE 流式发送消息，模型 token、handoff 和工具调用事件产生后立即推送
+    
+    事件类型：
+        agent: 当前运行的智能体变化
+        token: 模型输出的文本增量（客户端读取较慢时相邻增量会合并）
+        handoff: 智能体之间的任务转移
+        tool_call / tool_output: 工具调用及其结果
+        done: 运行结束（完整输出、最终智能体、最新世界状态）
+        error: 运行出错（status 为对应的 HTTP 状态码，超过截止时间为 504）
+    """
+    usage = bind_usage_scope(room_id, "message_stream", _check_budget(room_id))
+    _check_admission("interactive")
+    agent_to_use, agent_name, user_input = _resolve_message_target(request)
+    
+    async def events():
+        await state_store.preload(room_id)
+        async with room_executor.exclusive(room_id):
+            with session_scope(room_id) as session, run_hooks() as hooks:
+                timer = None
+                try:
+                    result = Runner.run_streamed(
+                        agent_to_use, user_input, session=session, hooks=hooks, run_config=run_config()
+                    )
+                    # 到截止时间时取消运行
+                    timer = cancel_at_deadline(result.cancel)
+                    async for event in iter_run_events(result):
+                        yield event
+                    check_deadline()
+                except Exception as e:
+                    yield "error", _error_event(e, "处理消息时出错")
+                    return
+                finally:
+                    if timer is not None:
+                        timer.cancel()
+                    response_cache.forget_history(room_id)
+        
+        yield "done", {
+            "output": result.final_output,
+            "agent_used": agent_name or "任务分配员",
+            "last_agent": result.last_agent.name,
+            "world_state": state_store.get_world(room_id),
+            "usage": usage.to_dict()
+        }
+    
+    return sse_response(events())
 
 @app.get("/api/rooms/{room_id}/state", response_model=WorldStateResponse)
 async def get_world_state(room_id: str):
     """获取指定房间的世界状态"""
     try:
-        world_state = state_store.get_world(room_id)
-        return WorldStateResponse(world_state=world_state)
+        await state_store.preload(room_id)
+        version, world_state = state_store.get_versioned_world(room_id)
+        return WorldStateResponse(world_state=world_state, version=version)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取状态时出错: {str(e)}")
 
+@app.get("/api/rooms/{room_id}/session")
+async def get_session_stats(room_id: str):
+    """房间会话历史的压缩统计：完整历史与实际发送给模型的 token 数"""
+    try:
+        with session_scope(room_id) as session:
+            if not isinstance(session, CompactingSession):
+                return {"room_id": room_id, "compaction": False, "items": len(await session.get_items())}
+            await session.get_items()
+            return {"room_id": room_id, "compaction": True, **session.stats()}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取会话统计时出错: {str(e)}")
+
+@app.get("/api/rooms/{room_id}/queue")
+async def get_room_queue(room_id: str):
+    """房间执行队列的深度：排队中的运行数和是否正在执行"""
+    return {"room_id": room_id, **room_executor.depth(room_id)}
+
+@app.get("/api/usage")
+async def get_usage(group_by: str = "room_id", room_id: Optional[str] = None,
+                    since: Optional[str] = None, until: Optional[str] = None):
+    """模型用量汇总
+    
+    Args:
+        group_by: 逗号分隔的分组字段（day/room_id/agent_id/endpoint），为空时返回总量
+        room_id: 只统计该房间
+        since / until: 日期范围（UTC，YYYY-MM-DD，包含两端）
+    """
+    fields = [field.strip() for field in group_by.split(",") if field.strip()]
+    try:
+        usage = await asyncio.to_thread(usage_tracker.summary, fields, room_id, since, until)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"group_by": fields, "usage": usage, **usage_tracker.stats()}
+
+@app.get("/api/rooms/{room_id}/usage")
+async def get_room_usage(room_id: str):
+    """房间的模型用量（当天和累计、按智能体和接口的明细）以及预算状态"""
+    return await asyncio.to_thread(usage_tracker.room_usage, room_id)
+
+@app.put("/api/rooms/{room_id}/usage/budget")
+async def set_room_budget(room_id: str, request: UsageBudgetRequest):
+    """设置房间的每日用量预算（两项都为 None 时恢复默认值）"""
+    await asyncio.to_thread(usage_tracker.set_room_budget, room_id, request.daily_tokens, request.daily_cost_usd)
+    return await asyncio.to_thread(usage_tracker.room_usage, room_id)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus 文本格式的指标：span 耗时直方图、HTTP 请求耗时、handoff 次数、token 数和运行状态"""
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/traces/{trace_id}")
+async def get_request_trace(trace_id: str):
+    """按 trace ID（响应头 X-Trace-Id）查看一次请求的 span 和各类别耗时"""
+    trace = get_trace(trace_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail=f"追踪 {trace_id} 不存在或已过期")
+    return trace.to_dict()
+
+@app.get("/api/connections")
+async def get_connection_metrics():
+    """WebSocket 连接数、各房间订阅数和发送队列积压情况"""
+    return manager.metrics()
+
+@app.get("/api/rooms/{room_id}/events")
+async def get_room_events(room_id: str, limit: int = 100):
+    """获取房间最近的世界状态事件（需开启 STATE_EVENT_LOG 事件日志模式）"""
+    try:
+        events = state_store.get_history(room_id, limit)
+        return {"room_id": room_id, "event_log": state_store.event_log, "events": events}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取事件历史时出错: {str(e)}")
+
 @app.delete("/api/rooms/{room_id}")
 async def clear_room(room_id: str):
     """清空指定房间的会话和状态"""
     try:
-        from sessions import clear_session
-        clear_session(room_id)
-        state_store.clear_room(room_id)
+        async def clear():
+            await clear_session(room_id)
+            # 可能需要等待正在进行的刷写完成，在线程池中执行
+            await asyncio.to_thread(state_store.clear_room, room_id)
+            await asyncio.to_thread(response_cache.invalidate_room, room_id)
+        
+        # 等待房间中正在执行的运行结束后再清空
+        await room_executor.run(room_id, clear)
+        push_world_state(room_id)
         return {"message": f"房间 {room_id} 已清空"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"清空房间时出错: {str(e)}")
 
+def _prepare_collaborative_task(request: CollaborativeTaskRequest) -> Optional[Dict[str, List[str]]]:
+    """校验协作任务请求，返回依赖图（未指定依赖关系时返回 None，表示按顺序执行）"""
+    if request.context_strategy and request.context_strategy not in COMPACTION_STRATEGIES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"未知的上下文压缩策略 '{request.context_strategy}'。可用策略: {list(COMPACTION_STRATEGIES)}"
+        )
+    
+    # 确保所有请求的智能体都存在
+    for agent_id in request.agent_order:
+        if agent_id not in agent_registry:
+            raise HTTPException(
+                status_code=400,
+                detail=f"智能体 '{agent_id}' 不存在。可用智能体: {list(agent_registry.ids)}"
+            )
+    
+    if not (request.dependencies or request.parallel_groups):
+        return None
+    try:
+        return build_dependency_graph(
+            request.agent_order, request.dependencies, request.parallel_groups
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def _iter_steps(room_id: str, request: CollaborativeTaskRequest, graph: Optional[Dict[str, List[str]]], session):
+    return iter_collaborative_steps(
+        room_id,
+        request.description,
+        request.agent_order,
+        session,
+        graph=graph,
+        max_concurrency=request.max_concurrency or COLLAB_MAX_CONCURRENCY,
+        context_builder=ContextBuilder(
+            request.description, request.context_budget, request.context_strategy
+        )
+    )
+
+async def _collaborative_steps(room_id: str, request: CollaborativeTaskRequest, graph: Optional[Dict[str, List[str]]]):
+    """执行协作任务，逐步产出每个智能体的结果"""
+    # 独占房间的执行队列，整个协作任务期间不与该房间的其他运行交错
+    async with room_executor.exclusive(room_id):
+        with session_scope(room_id) as session:
+            try:
+                async for step in _iter_steps(room_id, request, graph, session):
+                    yield step
+            finally:
+                response_cache.forget_history(room_id)
+
+async def _run_collaborative_task(
+    room_id: str,
+    request: CollaborativeTaskRequest,
+    graph: Optional[Dict[str, List[str]]],
+    downgraded: bool,
+    on_step: Optional[Callable[[Dict[str, Any]], Awaitable[None]]] = None,
+):
+    """执行整个协作任务并汇总（同步接口和后台任务共用），返回 (结果, 是否命中缓存)
+    
+    on_step 在每个智能体完成后调用；命中缓存时依次以缓存的结果调用。
+    """
+    async def run():
+        results = []
+        async for step in _iter_steps(room_id, request, graph, session):
+            results.append(step)
+            if on_step is not None:
+                await on_step(step)
+        if graph is not None:
+            # 并行执行时结果按完成顺序产出，这里按拓扑顺序返回
+            position = {agent_id: i for i, agent_id in enumerate(graph)}
+            results.sort(key=lambda r: position[r["agent_id"]])
+        
+        # 生成汇总
+        summary = build_summary(request.description, results, use_graph=graph is not None)
+        return {"results": results, "summary": summary}
+    
+    # 独占房间的执行队列，整个协作任务期间不与该房间的其他运行交错
+    async with room_executor.exclusive(room_id):
+        with session_scope(room_id) as session:
+            value, cached = await response_cache.run_cached(
+                room_id, session, "collaborative", ",".join(request.agent_order), request.description, run,
+                options={
+                    "dependencies": graph,
+                    "context": [request.context_budget, request.context_strategy],
+                    "downgraded": downgraded
+                }
+            )
+    if cached and on_step is not None:
+        for step in value["results"]:
+            await on_step(step)
+    return value, cached
+
 @app.post("/api/rooms/{room_id}/collaborative-task", response_model=CollaborativeTaskResponse)
 async def publish_collaborative_task(room_id: str, request: CollaborativeTaskRequest):
-    """发布协作任务，智能体按顺序执行并汇总结果
+    """发布协作任务，智能体按顺序（或按依赖关系并行）执行并汇总结果
     
     Args:
         room_id: 房间ID
         request: 协作任务请求，包含描述、选中的智能体和执行顺序
     """
     try:
-        # 获取会话
-        session = get_session(room_id)
-        
-        # 创建智能体系统
-        triage_agent = create_agent_system()
-
-        # 构建智能体映射 - 直接从 triage_agent.handoffs 中获取智能体
-        agent_map = {}
-        for handoff in triage_agent.handoffs:
-            agent_map[handoff.name.lower()] = handoff
-            print(f"[DEBUG] 添加智能体到映射: {handoff.name.lower()} -> {handoff.name}")
-            
-            # 为中文名智能体添加英文 ID 映射
-            if handoff.name == "商人":
-                agent_map["merchant"] = handoff
-                print(f"[DEBUG] 添加额外映射: merchant -> 商人")
-            elif handoff.name == "运动员":
-                agent_map["athlete"] = handoff
-                print(f"[DEBUG] 添加额外映射: athlete -> 运动员")
-            elif handoff.name == "医生":
-                agent_map["doctor"] = handoff
-                print(f"[DEBUG] 添加额外映射: doctor -> 医生")
-        
-        print(f"[DEBUG] 可用智能体: {list(agent_map.keys())}")
-
-        # 确保所有请求的智能体都存在
-        for agent_id in request.agent_order:
-            if agent_id not in agent_map:
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"智能体 '{agent_id}' 不存在。可用智能体: {list(agent_map.keys())}"
-                )
-        
-        # 按照指定顺序执行智能体
-        results = []
-        context = f"任务描述：{request.description}\n\n"
-        
-        for i, agent_id in enumerate(request.agent_order):
-            if agent_id not in agent_map:
-                continue
-            
-            agent = agent_map[agent_id]
-            agent_name = agent.name
-            
-            # 构建上下文消息（包含之前智能体的结果）
-            if i > 0:
-                context += f"\n之前智能体的结果：\n"
-                for j in range(i):
-                    prev_agent_id = request.agent_order[j]
-                    prev_result = results[j]
-                    context += f"- {prev_result['agent_name']}: {prev_result['output'][:200]}...\n"
-                context += "\n"
-            
-            context += f"请{agent_name}根据以上信息完成任务。"
-            
-            # 运行智能体
-            result = await Runner.run(agent, context, session=session)
-            
-            # 获取当前世界状态
-            world_state = state_store.get_world(room_id)
-            
-            results.append({
-                "agent_id": agent_id,
-                "agent_name": agent_name,
-                "output": result.final_output,
-                "world_state": world_state
-            })
+        graph = _prepare_collaborative_task(request)
+        downgraded = _check_budget(room_id)
+        _check_admission("batch")
+        await state_store.preload(room_id)
         
-        # 生成汇总
-        if len(results) > 0:
-            summary = f"## 任务完成汇总\n\n"
-            summary += f"**任务描述**: {request.description}\n\n"
-            summary += f"**参与智能体**: {', '.join([r['agent_name'] for r in results])}\n\n"
-            summary += f"**执行顺序**: {' → '.join([r['agent_name'] for r in results])}\n\n"
-            summary += "---\n\n"
-            
-            for i, result in enumerate(results, 1):
-                summary += f"### {i}. {result['agent_name']}\n\n"
-                summary += f"{result['output']}\n\n"
-                summary += "---\n\n"
-            
-            summary += f"\n**最终状态**: 所有智能体已按顺序完成任务，结果已汇总。"
-        else:
-            summary = "没有智能体参与任务。"
+        with usage_scope(room_id, "collaborative", downgraded) as usage:
+            value, cached = await _run_collaborative_task(room_id, request, graph, downgraded)
         
         # 获取最终世界状态
         final_world_state = state_store.get_world(room_id)
         
         return CollaborativeTaskResponse(
-            results=results,
-            summary=summary,
-            final_world_state=final_world_state
+            results=value["results"],
+            summary=value["summary"],
+            final_world_state=final_world_state,
+            cached=cached,
+            usage=usage.to_dict()
         )
     
     except Exception as e:
-        import traceback
-        traceback.print_exc()
-        raise HTTPException(status_code=500, detail=f"处理协作任务时出错: {str(e)}")
+        raise _http_error(e, "处理协作任务时出错")
+
+@app.post("/api/rooms/{room_id}/collaborative-task/stream")
+async def stream_collaborative_task(room_id: str, request: CollaborativeTaskRequest):
+    """以 SSE 流式发布协作任务，每个智能体完成后立即推送该步骤的结果
+    
+    事件类型：
+        start: 任务开始（执行顺序和依赖图）
+        step: 单个智能体完成（agent_id、agent_name、output、world_state）
+        summary: 全部完成后的汇总和最终世界状态
+        error: 执行出错（status 为对应的 HTTP 状态码，超过截止时间为 504）
+    """
+    graph = _prepare_collaborative_task(request)
+    usage = bind_usage_scope(room_id, "collaborative_stream", _check_budget(room_id))
+    _check_admission("batch")
+    
+    async def events():
+        yield "start", {"agent_order": request.agent_order, "dependencies": graph}
+        await state_store.preload(room_id)
+        results = []
+        try:
+            async for step in _collaborative_steps(room_id, request, graph):
+                results.append(step)
+                yield "step", {"index": len(results), **step}
+        except Exception as e:
+            yield "error", _error_event(e, "处理协作任务时出错")
+            return
+        
+        yield "summary", {
+            "summary": build_summary(request.description, results, use_graph=graph is not None),
+            "final_world_state": state_store.get_world(room_id),
+            "usage": usage.to_dict()
+        }
+    
+    return sse_response(events())
+
+async def run_collaborative_job(job: Job) -> Dict[str, Any]:
+    """后台任务处理函数：执行协作任务，每一步的结果随时保存"""
+    request = CollaborativeTaskRequest(**job.payload["request"])
+    graph = job.payload["dependencies"]
+    # 任务可能排队了一段时间，执行前重新检查预算
+    status = usage_tracker.check_budget(job.room_id)
+    if status.rejected:
+        raise RuntimeError(f"超出用量预算: {status.exceeded}")
+    await state_store.preload(job.room_id)
+    # 后台任务不受请求截止时间限制，使用 JOB_TIMEOUT
+    with usage_scope(job.room_id, "collaborative_job", status.downgraded) as usage, deadline_scope(JOB_TIMEOUT):
+        value, cached = await _run_collaborative_task(
+            job.room_id, request, graph, status.downgraded, on_step=job.add_step
+        )
+    return {
+        **value,
+        "final_world_state": state_store.get_world(job.room_id),
+        "cached": cached,
+        "usage": usage.to_dict()
+    }
+
+@app.post("/api/rooms/{room_id}/collaborative-task/jobs", status_code=202)
+async def submit_collaborative_job(room_id: str, request: CollaborativeTaskRequest):
+    """以后台任务发布协作任务，立即返回任务ID
+    
+    任务由工作协程执行（JOB_WORKERS 个同时执行），客户端断开不影响执行。
+    通过 GET /api/jobs/{job_id} 轮询状态和已完成的步骤，或订阅 GET /api/jobs/{job_id}/events；
+    DELETE /api/jobs/{job_id} 取消任务。
+    """
+    graph = _prepare_collaborative_task(request)
+    _check_budget(room_id)
+    try:
+        return await job_manager.submit(
+            "collaborative", room_id, {"request": request.model_dump(), "dependencies": graph}
+        )
+    except JobQueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e))
+
+@app.get("/api/rooms/{room_id}/jobs")
+async def list_room_jobs(room_id: str, status: Optional[str] = None, limit: int = 50):
+    """房间的后台任务（按提交时间倒序）"""
+    if status is not None and status not in JOB_STATUSES:
+        raise HTTPException(status_code=400, detail=f"未知的任务状态 '{status}'。可用状态: {list(JOB_STATUSES)}")
+    return {"room_id": room_id, "jobs": await job_manager.list_jobs(room_id, status, limit)}
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    """后台任务的状态、排队位置、已完成的步骤和最终结果"""
+    job = await job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"任务 {job_id} 不存在或已过期")
+    return job
+
+@app.get("/api/jobs/{job_id}/events")
+async def stream_job_events(job_id: str):
+    """以 SSE 订阅后台任务：先补发已完成的步骤，之后推送 status / step，结束时推送 done
+    
+    断开订阅不影响任务执行，可以随时重新订阅。
+    """
+    if await job_manager.get(job_id, with_steps=False) is None:
+        raise HTTPException(status_code=404, detail=f"任务 {job_id} 不存在或已过期")
+    return sse_response(job_manager.subscribe(job_id))
+
+@app.delete("/api/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """取消排队中或执行中的后台任务（已完成的步骤保留）"""
+    job = await job_manager.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"任务 {job_id} 不存在或已过期")
+    return job
 
 @app.post("/api/analyze-task", response_model=TaskAnalysisResponse)
 async def analyze_task(request: TaskAnalysisRequest):
     """分析任务并生成执行计划"""
+    # 规划不属于任何房间，只检查全局预算；规划器不经过 Runner，降级时不做处理
+    _check_budget(None)
+    _check_admission("batch")
     try:
-        plan = plan_task(request.description)
+        with usage_scope("", "analyze"):
+            plan = await plan_task_async(request.description)
         return TaskAnalysisResponse(**plan)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"任务分析失败: {str(e)}")
+        raise _http_error(e, "任务分析失败")
 
 @app.websocket("/ws/rooms/{room_id}")
 async def websocket_endpoint(websocket: WebSocket, room_id: str):
-    """WebSocket 连接，用于实时状态更新"""
-    await manager.connect(websocket)
+    """WebSocket 连接，用于实时状态更新
+    
+    连接后先收到带版本号的完整状态（world_state），之后每次状态变化收到
+    world_delta：{"base_version", "version", "patch"}，patch 为 JSON Patch 操作列表。
+    客户端发送 "resync"（或 {"type": "resync"}）可重新获取完整状态。
+    """
+    connection = await manager.connect(websocket, room_id)
     try:
         # 发送初始状态
-        world_state = state_store.get_world(room_id)
-        await websocket.send_json({
-            "type": "world_state",
-            "data": world_state
-        })
+        await state_store.preload(room_id)
+        send_world_state(connection)
         
         # 保持连接，等待消息
         while True:
             data = await websocket.receive_text()
-            # 这里可以处理来自客户端的消息
-            # 目前只是保持连接，状态更新通过 HTTP 接口触发
-            await websocket.send_json({
+            if _is_resync_request(data):
+                send_world_state(connection)
+                continue
+            manager.send(websocket, {
                 "type": "echo",
                 "message": f"收到消息: {data}"
             })
     except WebSocketDisconnect:
+        pass
+    finally:
         manager.disconnect(websocket)
 
+def _is_resync_request(data: str) -> bool:
+    if data.strip() == "resync":
+        return True
+    try:
+        message = json.loads(data)
+    except ValueError:
+        return False
+    return isinstance(message, dict) and message.get("type") == "resync"
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
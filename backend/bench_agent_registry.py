@@ -0,0 +1,60 @@
+"""微基准：对比每次请求重建智能体图与使用预编译注册表的开销"""
+import sys
+import timeit
+from pathlib import Path
+
+# 设置编码
+if sys.platform == 'win32':
+    sys.stdout.reconfigure(encoding='utf-8')
+
+# 添加路径
+backend_path = Path(__file__).parent
+sys.path.insert(0, str(backend_path))
+
+from agent_systems import create_agent_system
+from agent_systems.registry import AgentRegistry
+
+TARGETS = ["mathematician", "artist", "engineer", "merchant", "athlete", "doctor"]
+
+
+def per_request_before(target: str):
+    """旧路径：每个请求创建智能体系统，再线性扫描 handoffs 构建映射"""
+    triage_agent = create_agent_system()
+    agent_map = {}
+    for handoff in triage_agent.handoffs:
+        agent_map[handoff.name.lower()] = handoff
+        if handoff.name == "商人":
+            agent_map["merchant"] = handoff
+        elif handoff.name == "运动员":
+            agent_map["athlete"] = handoff
+        elif handoff.name == "医生":
+            agent_map["doctor"] = handoff
+    return agent_map.get(target)
+
+
+registry = AgentRegistry(create_agent_system())
+
+def per_request_after(target: str):
+    """新路径：从进程级注册表做一次字典查找"""
+    return registry.get(target)
+
+
+def bench(func, number: int) -> float:
+    """返回每次调用的平均耗时（微秒）"""
+    total = 0.0
+    for target in TARGETS:
+        total += timeit.timeit(lambda: func(target), number=number)
+    return total / (number * len(TARGETS)) * 1e6
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("智能体注册表微基准")
+    print("=" * 60)
+
+    before = bench(per_request_before, number=200)
+    after = bench(per_request_after, number=200000)
+
+    print(f"  - 每请求构建智能体图: {before:10.2f} µs/请求")
+    print(f"  - 预编译注册表查找:   {after:10.4f} µs/请求")
+    print(f"  - 加速比:             {before / after:10.0f}x")
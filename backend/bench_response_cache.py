@@ -0,0 +1,51 @@
+"""基准测试：响应缓存的查找耗时
+
+分别测量进程内 LRU 命中、SQLite 命中（关闭内存层）和写入的平均耗时。
+"""
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# 设置编码
+if sys.platform == 'win32':
+    sys.stdout.reconfigure(encoding='utf-8')
+
+# 添加路径
+backend_path = Path(__file__).parent
+sys.path.insert(0, str(backend_path))
+os.environ.setdefault("OPENAI_API_KEY", "bench")
+
+from response_cache import ResponseCache
+
+ENTRIES = 1_000
+LOOKUPS = 100_000
+
+
+def bench(name: str, memory_entries: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = ResponseCache(os.path.join(tmp, "cache.db"), enabled=True, memory_entries=memory_entries)
+        value = {"value": {"output": "回答" * 200}, "items": [], "events": []}
+        keys = [cache.make_key("message", "数学家", f"问题 {i}", "history") for i in range(ENTRIES)]
+
+        start = time.perf_counter()
+        for key in keys:
+            cache.put(key, "room", value)
+        put = (time.perf_counter() - start) / ENTRIES * 1e6
+
+        start = time.perf_counter()
+        for i in range(LOOKUPS):
+            assert cache.get(keys[i % ENTRIES]) is not None
+        get = (time.perf_counter() - start) / LOOKUPS * 1e6
+        cache.close()
+
+    print(f"  {name:>8} | 命中 {get:8.1f} µs | 写入 {put:8.1f} µs")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print(f"响应缓存基准（{ENTRIES} 个条目，{LOOKUPS} 次查找）")
+    print("=" * 60)
+    bench("内存层", 1024)
+    bench("SQLite", 0)
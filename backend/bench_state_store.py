@@ -0,0 +1,125 @@
+"""基准测试：StateStore.apply_events 在 10 / 1k / 10k 个智能体下的开销
+
+对比之前的实现（字典列表 + 线性扫描）和当前的实现（__slots__ 记录 + ID 索引），
+并比较两种表示方式的内存占用。旧实现只计循环本身；新实现计完整的 StateStore.apply_events
+（加锁、时间戳、标记脏房间），持久化使用写回模式且不触发刷写，只测量内存中的状态更新。
+"""
+import random
+import sys
+import tempfile
+import timeit
+import tracemalloc
+from pathlib import Path
+
+# 设置编码
+if sys.platform == 'win32':
+    sys.stdout.reconfigure(encoding='utf-8')
+
+# 添加路径
+backend_path = Path(__file__).parent
+sys.path.insert(0, str(backend_path))
+
+from state_store import StateStore
+from world_model import WorldState
+
+AGENT_COUNTS = [10, 1_000, 10_000]
+EVENTS_PER_BATCH = 4
+
+
+def make_world_dict(n: int) -> dict:
+    """构造包含 n 个智能体的世界（对外 JSON 结构）"""
+    return {
+        "agents": [
+            {
+                "id": f"agent-{i}",
+                "name": f"Agent {i}",
+                "role": "citizen",
+                "x": i % 800,
+                "y": i // 800,
+                "mood": "calm",
+                "currentTask": None,
+                "relations": {}
+            }
+            for i in range(n)
+        ],
+        "environment": {"timeOfDay": "day", "weather": "sunny", "rooms": []},
+        "lastUpdated": None
+    }
+
+
+def make_batches(n: int, count: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    batches = []
+    for _ in range(count):
+        batch = []
+        for _ in range(EVENTS_PER_BATCH):
+            agent_id = f"agent-{rng.randrange(n)}"
+            kind = rng.choice(["agent_moved", "task_started", "task_finished", "mood_changed"])
+            batch.append({"type": kind, "agent_id": agent_id, "x": 1, "y": 2, "task": "t", "mood": "focused"})
+        batches.append(batch)
+    return batches
+
+
+def legacy_apply_events(world: dict, events: list) -> None:
+    """之前的实现：每个事件线性扫描智能体列表"""
+    for event in events:
+        event_type = event.get("type")
+        agent_id = event.get("agent_id")
+        for agent in world["agents"]:
+            if agent["id"] == agent_id:
+                if event_type == "agent_moved":
+                    agent["x"] = event.get("x")
+                    agent["y"] = event.get("y")
+                elif event_type == "task_started":
+                    agent["currentTask"] = event.get("task")
+                    agent["mood"] = event.get("mood", agent["mood"])
+                elif event_type == "task_finished":
+                    agent["currentTask"] = None
+                    agent["mood"] = event.get("mood", "calm")
+                elif event_type == "mood_changed":
+                    agent["mood"] = event.get("mood")
+                break
+
+
+def measure_memory(build) -> int:
+    tracemalloc.start()
+    obj = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del obj
+    return size
+
+
+def bench(n: int, store: StateStore) -> None:
+    batches = make_batches(n, 200)
+    number = max(1, 20_000 // max(n, 1000) * 10)
+
+    legacy_world = make_world_dict(n)
+    legacy = timeit.timeit(
+        lambda: [legacy_apply_events(legacy_world, b) for b in batches], number=number
+    ) / (number * len(batches)) * 1e6
+
+    room_id = f"bench-{n}"
+    store._memory[room_id] = WorldState.from_dict(make_world_dict(n))
+    indexed = timeit.timeit(
+        lambda: [store.apply_events(room_id, b) for b in batches], number=number
+    ) / (number * len(batches)) * 1e6
+
+    dict_bytes = measure_memory(lambda: make_world_dict(n)["agents"])
+    record_bytes = measure_memory(lambda: WorldState.from_dict(make_world_dict(n)).agents)
+
+    print(f"  {n:>6} 个智能体 | apply_events 旧: {legacy:9.2f} µs  新: {indexed:7.2f} µs"
+          f"  ({legacy / indexed:6.1f}x) | 内存 旧: {dict_bytes / n:6.0f} B/个  新: {record_bytes / n:6.0f} B/个")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("StateStore.apply_events 基准（每批 4 个事件）")
+    print("=" * 60)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = StateStore(tmp, write_behind=True, flush_interval=3600)
+        for n in AGENT_COUNTS:
+            bench(n, store)
+        store._dirty.clear()
+        store.close()
@@ -0,0 +1,70 @@
+"""基准测试：每房间一个 JSON 文件 vs 单个 SQLite 数据库（WAL）
+
+对 10k 个房间分别测量保存、冷加载（新建后端实例后读取）和清空的平均耗时，
+以及写回模式下一次刷写全部房间的耗时和占用的文件数。
+"""
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# 设置编码
+if sys.platform == 'win32':
+    sys.stdout.reconfigure(encoding='utf-8')
+
+# 添加路径
+backend_path = Path(__file__).parent
+sys.path.insert(0, str(backend_path))
+
+from storage_backends import STORAGE_BACKENDS
+from world_model import WorldState
+
+ROOMS = 10_000
+
+
+def per_op(elapsed: float) -> float:
+    return elapsed / ROOMS * 1e6
+
+
+def bench(name: str) -> None:
+    data = WorldState.default("2025-01-01T00:00:00").to_dict()
+    serialized = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+    room_ids = [f"room-{i}" for i in range(ROOMS)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        backend = STORAGE_BACKENDS[name](tmp)
+        start = time.perf_counter()
+        for room_id in room_ids:
+            backend.save(room_id, data, serialized=serialized)
+        save = time.perf_counter() - start
+
+        start = time.perf_counter()
+        backend.save_many([(room_id, None, serialized) for room_id in room_ids], durable=True)
+        flush = time.perf_counter() - start
+        backend.close()
+        files = len(os.listdir(tmp))
+
+        backend = STORAGE_BACKENDS[name](tmp)
+        start = time.perf_counter()
+        for room_id in room_ids:
+            assert backend.load(room_id) is not None
+        load = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for room_id in room_ids:
+            backend.delete(room_id)
+        clear = time.perf_counter() - start
+        backend.close()
+
+    print(f"  {name:>6} | 保存 {per_op(save):7.1f} µs | 冷加载 {per_op(load):7.1f} µs | 清空 {per_op(clear):7.1f} µs"
+          f" | 刷写全部 {flush:6.2f} s（持久化） | 文件数 {files}")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print(f"本地存储后端基准（{ROOMS} 个房间）")
+    print("=" * 60)
+    for name in ("json", "sqlite"):
+        bench(name)
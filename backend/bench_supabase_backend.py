@@ -0,0 +1,82 @@
+"""基准测试：Supabase 延迟下 StateStore.apply_events 的开销
+
+使用进程内的假 Supabase 客户端模拟每个请求 50ms 的网络延迟，对比：
+- 之前的实现：每次状态变化在调用线程中同步 upsert 一行
+- 当前的实现：写入排队后立即返回，后台把多个房间合并成一次多行 upsert
+"""
+import asyncio
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# 设置编码
+if sys.platform == 'win32':
+    sys.stdout.reconfigure(encoding='utf-8')
+
+# 添加路径
+backend_path = Path(__file__).parent
+sys.path.insert(0, str(backend_path))
+
+from fake_supabase import FakeSupabaseClient
+from state_store import StateStore
+from supabase_backend import SupabaseBackend
+from world_model import WorldState
+
+LATENCY = 0.05
+ROOMS = 50
+UPDATES_PER_ROOM = 10
+THREADS = 8
+
+
+def legacy_upsert(client: FakeSupabaseClient, room_id: str, data: dict) -> None:
+    """之前的实现：同步等待一次单行 upsert"""
+    row = {"room_id": room_id, "data": data}
+    asyncio.run(client.table("world_states").upsert(row).execute())
+
+
+def run_updates(apply) -> float:
+    """ROOMS 个房间各更新 UPDATES_PER_ROOM 次，多线程并发，返回总耗时（秒）"""
+    def update_room(i: int) -> None:
+        for n in range(UPDATES_PER_ROOM):
+            apply(f"room-{i}", [{"type": "agent_moved", "agent_id": "artist", "x": n, "y": i}])
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(THREADS) as pool:
+        list(pool.map(update_room, range(ROOMS)))
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    total = ROOMS * UPDATES_PER_ROOM
+    print("=" * 60)
+    print(f"Supabase 写入基准（延迟 {LATENCY * 1000:.0f}ms，{ROOMS} 个房间 × {UPDATES_PER_ROOM} 次更新，{THREADS} 个线程）")
+    print("=" * 60)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_client = FakeSupabaseClient(latency=LATENCY)
+        worlds = {f"room-{i}": WorldState.default("") for i in range(ROOMS)}
+
+        def legacy_apply(room_id, events):
+            legacy_upsert(legacy_client, room_id, worlds[room_id].to_dict())
+
+        elapsed = run_updates(legacy_apply)
+        print(f"  旧: 总耗时 {elapsed:6.2f} s | 每次 apply_events {elapsed / total * THREADS * 1000:8.2f} ms"
+              f" | upsert 请求 {len(legacy_client.requests)}")
+
+        async def create_client():
+            return FakeSupabaseClient(latency=LATENCY)
+
+        store = StateStore(tmp)
+        store.supabase = SupabaseBackend(create_client, on_write_failed=store._save_local)
+        store.use_supabase = True
+        for room_id, world in worlds.items():
+            store._memory[room_id] = world
+
+        elapsed = run_updates(store.apply_events)
+        store.supabase.flush()
+        requests = store.supabase.client.requests
+        print(f"  新: 总耗时 {elapsed:6.2f} s | 每次 apply_events {elapsed / total * THREADS * 1000:8.2f} ms"
+              f" | upsert 请求 {len(requests)}（每批平均 {store.supabase.rows_written / max(len(requests), 1):.1f} 行）")
+        store.close()
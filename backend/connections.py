@@ -0,0 +1,159 @@
+"""WebSocket 连接管理：按房间分区，每个连接独立的有界发送队列
+
+广播只把消息放入各连接的发送队列（消息只序列化一次），由每个连接自己的发送任务
+并发写出，慢客户端不会拖慢其他连接。发送队列满时按策略处理：
+- drop_oldest：丢弃最早的未发送消息（连接标记为需要重新同步）
+- disconnect：断开该慢客户端
+"""
+import asyncio
+import json
+import os
+from typing import Any, Dict, List, Optional, Union
+from fastapi import WebSocket
+
+# 每个连接的发送队列长度（消息数）
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))
+# 发送队列满时的策略：drop_oldest / disconnect
+WS_SLOW_CONSUMER_POLICY = os.getenv("WS_SLOW_CONSUMER_POLICY", "drop_oldest")
+
+SLOW_CONSUMER_POLICIES = ("drop_oldest", "disconnect")
+
+
+def encode_message(message: Union[str, Dict[str, Any]]) -> str:
+    """把消息编码为文本帧（与 WebSocket.send_json 的格式一致）"""
+    if isinstance(message, str):
+        return message
+    return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+
+class Connection:
+    """单个 WebSocket 连接及其发送队列"""
+
+    __slots__ = ("websocket", "room_id", "queue", "sender", "version", "sent", "dropped")
+
+    def __init__(self, websocket: WebSocket, room_id: str, queue_size: int):
+        self.websocket = websocket
+        self.room_id = room_id
+        self.queue: "asyncio.Queue[str]" = asyncio.Queue(maxsize=max(1, queue_size))
+        self.sender: Optional[asyncio.Task] = None
+        # 客户端当前持有的世界状态版本，None 表示需要重新发送完整状态
+        self.version: Optional[int] = None
+        self.sent = 0
+        self.dropped = 0
+
+
+class ConnectionManager:
+    def __init__(self, queue_size: Optional[int] = None, policy: Optional[str] = None):
+        policy = policy or WS_SLOW_CONSUMER_POLICY
+        if policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"未知的慢客户端策略 '{policy}'。可用策略: {list(SLOW_CONSUMER_POLICIES)}")
+        self.queue_size = queue_size or WS_SEND_QUEUE_SIZE
+        self.policy = policy
+        # 连接 → 连接记录
+        self.connections: Dict[WebSocket, Connection] = {}
+        # 房间ID → {连接 → 连接记录}
+        self.rooms: Dict[str, Dict[WebSocket, Connection]] = {}
+        # 累计统计
+        self.total_dropped = 0
+        self.slow_disconnects = 0
+
+    @property
+    def active_connections(self) -> List[WebSocket]:
+        return list(self.connections)
+
+    async def connect(self, websocket: WebSocket, room_id: str) -> Connection:
+        await websocket.accept()
+        connection = Connection(websocket, room_id, self.queue_size)
+        connection.sender = asyncio.create_task(self._send_loop(connection))
+        self.connections[websocket] = connection
+        self.rooms.setdefault(room_id, {})[websocket] = connection
+        return connection
+
+    def disconnect(self, websocket: WebSocket) -> None:
+        connection = self.connections.pop(websocket, None)
+        if connection is None:
+            return
+        room = self.rooms.get(connection.room_id)
+        if room is not None:
+            room.pop(websocket, None)
+            if not room:
+                del self.rooms[connection.room_id]
+        if connection.sender is not None and connection.sender is not asyncio.current_task():
+            connection.sender.cancel()
+
+    def get(self, websocket: WebSocket) -> Optional[Connection]:
+        return self.connections.get(websocket)
+
+    def room_connections(self, room_id: str) -> List[Connection]:
+        return list(self.rooms.get(room_id, {}).values())
+
+    def send(self, websocket: WebSocket, message: Union[str, Dict[str, Any]]) -> bool:
+        """把消息放入连接的发送队列，返回是否成功入队"""
+        connection = self.connections.get(websocket)
+        if connection is None:
+            return False
+        return self._enqueue(connection, encode_message(message))
+
+    async def send_personal_message(self, message: str, websocket: WebSocket):
+        self.send(websocket, message)
+
+    async def broadcast(self, message: Union[str, Dict[str, Any]]):
+        """向所有连接广播"""
+        text = encode_message(message)
+        for connection in list(self.connections.values()):
+            self._enqueue(connection, text)
+
+    async def broadcast_to_room(self, room_id: str, message: Union[str, Dict[str, Any]]):
+        """向房间内的所有连接广播"""
+        text = encode_message(message)
+        for connection in self.room_connections(room_id):
+            self._enqueue(connection, text)
+
+    def _enqueue(self, connection: Connection, text: str) -> bool:
+        if connection.queue.full():
+            if self.policy == "disconnect":
+                print(f"[WARNING] WebSocket 客户端读取过慢，断开连接（房间 {connection.room_id}）")
+                self.slow_disconnects += 1
+                self.disconnect(connection.websocket)
+                asyncio.create_task(self._close(connection.websocket))
+                return False
+            connection.queue.get_nowait()
+            connection.dropped += 1
+            self.total_dropped += 1
+            # 丢弃的可能是状态增量，下一次推送改为发送完整状态
+            connection.version = None
+        connection.queue.put_nowait(text)
+        return True
+
+    async def _send_loop(self, connection: Connection) -> None:
+        websocket = connection.websocket
+        try:
+            while True:
+                text = await connection.queue.get()
+                await websocket.send_text(text)
+                connection.sent += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[WARNING] WebSocket 发送失败，断开连接: {e}")
+            self.disconnect(websocket)
+
+    async def _close(self, websocket: WebSocket) -> None:
+        try:
+            await websocket.close(code=1013)
+        except Exception:
+            pass
+
+    def metrics(self) -> Dict[str, Any]:
+        """连接数和发送队列积压情况"""
+        depths = [connection.queue.qsize() for connection in self.connections.values()]
+        return {
+            "connections": len(self.connections),
+            "rooms": {room_id: len(room) for room_id, room in self.rooms.items()},
+            "queue_size": self.queue_size,
+            "policy": self.policy,
+            "queue_depth_total": sum(depths),
+            "queue_depth_max": max(depths, default=0),
+            "dropped_messages": self.total_dropped,
+            "slow_disconnects": self.slow_disconnects,
+        }
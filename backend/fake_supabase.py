@@ -0,0 +1,85 @@
+"""进程内的假 Supabase 异步客户端
+
+只实现 StateStore 用到的 PostgREST 查询子集：
+table(...).upsert(rows) / select(columns).eq(...) / delete().eq(...)，以及 await execute()。
+可以模拟网络延迟和连续失败，用于本地开发（SUPABASE_URL=memory://）和测试重试、批量写入。
+"""
+import asyncio
+import copy
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+
+class FakeResponse:
+    def __init__(self, data: List[Dict[str, Any]]):
+        self.data = data
+
+
+class FakeQuery:
+    def __init__(self, client: "FakeSupabaseClient", table: str):
+        self._client = client
+        self._table = table
+        self._action: Optional[str] = None
+        self._rows: List[Dict[str, Any]] = []
+        self._columns: List[str] = []
+        self._filters: List[Tuple[str, Any]] = []
+
+    def upsert(self, rows: Union[Dict[str, Any], List[Dict[str, Any]]]) -> "FakeQuery":
+        self._action = "upsert"
+        self._rows = rows if isinstance(rows, list) else [rows]
+        return self
+
+    def select(self, columns: str = "*") -> "FakeQuery":
+        self._action = "select"
+        self._columns = [c.strip() for c in columns.split(",")] if columns != "*" else []
+        return self
+
+    def delete(self) -> "FakeQuery":
+        self._action = "delete"
+        return self
+
+    def eq(self, column: str, value: Any) -> "FakeQuery":
+        self._filters.append((column, value))
+        return self
+
+    def _matches(self, row: Dict[str, Any]) -> bool:
+        return all(row.get(column) == value for column, value in self._filters)
+
+    async def execute(self) -> FakeResponse:
+        client = self._client
+        client.requests.append((self._action, self._table, len(self._rows)))
+        if client.latency:
+            await asyncio.sleep(client.latency)
+        if client.fail_next > 0:
+            client.fail_next -= 1
+            raise ConnectionError("模拟的 Supabase 请求失败")
+
+        table = client.tables.setdefault(self._table, {})
+        if self._action == "upsert":
+            for row in self._rows:
+                table[row[client.primary_key]] = copy.deepcopy(row)
+            return FakeResponse(copy.deepcopy(self._rows))
+        if self._action == "select":
+            rows = [row for row in table.values() if self._matches(row)]
+            if self._columns:
+                rows = [{c: row.get(c) for c in self._columns} for row in rows]
+            return FakeResponse(copy.deepcopy(rows))
+        if self._action == "delete":
+            removed = [key for key, row in table.items() if self._matches(row)]
+            return FakeResponse([table.pop(key) for key in removed])
+        raise ValueError(f"不支持的查询: {self._action}")
+
+
+class FakeSupabaseClient:
+    """内存中的表：{表名: {主键: 行}}"""
+
+    def __init__(self, latency: float = 0.0, primary_key: str = "room_id"):
+        self.latency = latency
+        self.primary_key = primary_key
+        self.tables: Dict[str, Dict[Any, Dict[str, Any]]] = {}
+        # 接下来的 N 次请求失败（用于测试重试）
+        self.fail_next = 0
+        # 请求记录：(操作, 表名, 行数)
+        self.requests: List[Tuple[Optional[str], str, int]] = []
+
+    def table(self, name: str) -> FakeQuery:
+        return FakeQuery(self, name)
@@ -0,0 +1,607 @@
+"""后台任务：耗时较长的运行（如多智能体协作任务）提交后立即返回任务ID，由固定数量的工作协程执行
+
+任务状态和每一步的结果保存在 SQLite 中（JOB_DB_PATH），可以轮询查询，也可以订阅事件流。
+客户端断开不影响任务执行；排队中和执行中的任务都可以取消。吞吐量由工作协程数（JOB_WORKERS）决定，
+而不是由保持打开的 HTTP 连接数决定。
+
+状态：queued → running → succeeded / failed / cancelled。
+
+多个进程（uvicorn --workers N）可以共用同一个 JOB_DB_PATH：每个任务属于提交它的进程（owner），
+由该进程按 JOB_HEARTBEAT_INTERVAL 刷新心跳；开始执行前按 owner 和状态条件更新认领任务，
+同一个任务只会执行一次。心跳超过 JOB_LEASE_TIMEOUT 秒未刷新的任务视为所属进程已退出：
+排队中的任务由其他进程（或重启后的进程）接管，执行到一半的任务标记为 failed（不会重复执行已经产生的副作用）。
+查询、订阅和取消可以在任意进程进行：订阅其他进程的任务时轮询数据库，
+取消其他进程的任务时写入取消请求，由所属进程在下次心跳时取消。
+"""
+import asyncio
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+# 工作协程数（同时执行的任务数）
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+# 排队中的任务数上限，超过后拒绝提交
+JOB_MAX_QUEUED = int(os.getenv("JOB_MAX_QUEUED", "1000"))
+# 已结束的任务保留多久（秒）
+JOB_RETENTION = float(os.getenv("JOB_RETENTION", "86400"))
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", "backend/data/jobs.db")
+# 心跳间隔（秒）和租约超时（秒）：心跳超过租约未刷新的任务由其他进程接管或标记为 failed
+JOB_HEARTBEAT_INTERVAL = float(os.getenv("JOB_HEARTBEAT_INTERVAL", "2"))
+JOB_LEASE_TIMEOUT = float(os.getenv("JOB_LEASE_TIMEOUT", "15"))
+# 订阅和取消其他进程的任务时轮询数据库的间隔（秒）
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "0.5"))
+
+JOB_STATUSES = ("queued", "running", "succeeded", "failed", "cancelled")
+JOB_FINAL_STATUSES = ("succeeded", "failed", "cancelled")
+
+
+class JobQueueFull(Exception):
+    """排队中的任务数达到 JOB_MAX_QUEUED"""
+
+
+class Job:
+    """执行中的任务：处理函数通过 add_step() 逐步提交结果"""
+
+    __slots__ = ("job_id", "kind", "room_id", "payload", "status", "created_at", "started_at",
+                 "steps", "task", "cancel_requested", "finished", "listeners", "_manager")
+
+    def __init__(self, manager: "JobManager", job_id: str, kind: str, room_id: str,
+                 payload: Dict[str, Any], created_at: float):
+        self._manager = manager
+        self.job_id = job_id
+        self.kind = kind
+        self.room_id = room_id
+        self.payload = payload
+        self.status = "queued"
+        self.created_at = created_at
+        self.started_at: Optional[float] = None
+        self.steps: List[Dict[str, Any]] = []
+        self.task: Optional[asyncio.Task] = None
+        # 认领之后、处理函数开始之前收到的取消请求
+        self.cancel_requested = False
+        # 最终状态写入后设置
+        self.finished = asyncio.Event()
+        # 订阅者的事件队列
+        self.listeners: Set[asyncio.Queue] = set()
+
+    async def add_step(self, step: Dict[str, Any]) -> None:
+        """保存一步的结果并推送给订阅者（处理函数依次调用，不能并发）
+
+        先持久化，再在同一时刻追加到 steps 并推送：订阅时复制的 steps 和之后收到的事件不会重复。
+        """
+        index = len(self.steps)
+        await asyncio.to_thread(self._manager._save_step, self.job_id, index, step)
+        self.steps.append(step)
+        self.publish("step", {"index": index + 1, **step})
+
+    def publish(self, event: str, data: Dict[str, Any]) -> None:
+        for queue in self.listeners:
+            queue.put_nowait((event, data))
+
+    def close(self, info: Dict[str, Any]) -> None:
+        """最终状态写入后调用：推送 done 并结束所有订阅（重复调用时忽略）"""
+        if self.finished.is_set():
+            return
+        self.finished.set()
+        self.publish("done", info)
+        for queue in self.listeners:
+            queue.put_nowait(None)
+
+
+JobHandler = Callable[[Job], Awaitable[Dict[str, Any]]]
+
+
+def _dumps(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, default=str)
+
+
+class JobManager:
+    """SQLite 持久化的任务队列 + 固定大小的工作协程池"""
+
+    def __init__(
+        self,
+        db_path: str = JOB_DB_PATH,
+        workers: Optional[int] = None,
+        max_queued: Optional[int] = None,
+        retention: Optional[float] = None,
+    ):
+        self.db_path = db_path
+        self.workers = workers or JOB_WORKERS
+        self.max_queued = JOB_MAX_QUEUED if max_queued is None else max_queued
+        self.retention = JOB_RETENTION if retention is None else retention
+        self.heartbeat_interval = JOB_HEARTBEAT_INTERVAL
+        self.lease_timeout = JOB_LEASE_TIMEOUT
+        # 本进程的标识，写入所属任务的 owner 列
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        # 任务类型 → 处理函数
+        self._handlers: Dict[str, JobHandler] = {}
+        # 排队中的任务（按提交顺序）和执行中的任务
+        self._queued: "OrderedDict[str, Job]" = OrderedDict()
+        self._running: Dict[str, Job] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker_tasks: List[asyncio.Task] = []
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        # 统计
+        self.submitted = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.cancelled = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            with conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS jobs ("
+                    "job_id TEXT PRIMARY KEY, kind TEXT NOT NULL, room_id TEXT NOT NULL, status TEXT NOT NULL, "
+                    "payload TEXT NOT NULL, result TEXT, error TEXT, "
+                    "created_at REAL NOT NULL, started_at REAL, finished_at REAL, "
+                    "owner TEXT, heartbeat_at REAL, cancel_requested INTEGER NOT NULL DEFAULT 0)"
+                )
+                # 旧版本创建的表没有 owner / heartbeat_at / cancel_requested 列
+                columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+                for column, decl in (("owner", "TEXT"), ("heartbeat_at", "REAL"),
+                                     ("cancel_requested", "INTEGER NOT NULL DEFAULT 0")):
+                    if column not in columns:
+                        conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {decl}")
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_room ON jobs (room_id, created_at)")
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_finished ON jobs (finished_at)")
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_owner ON jobs (owner, status, created_at)")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS job_steps ("
+                    "job_id TEXT NOT NULL, idx INTEGER NOT NULL, step TEXT NOT NULL, PRIMARY KEY (job_id, idx))"
+                )
+            self._conn = conn
+        return self._conn
+
+    def _execute(self, sql: str, params: Tuple[Any, ...] = ()) -> None:
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute(sql, params)
+
+    def _save_step(self, job_id: str, index: int, step: Dict[str, Any]) -> None:
+        self._execute("INSERT OR REPLACE INTO job_steps (job_id, idx, step) VALUES (?, ?, ?)",
+                      (job_id, index, _dumps(step)))
+
+    def register(self, kind: str, handler: JobHandler) -> None:
+        """注册任务类型的处理函数：handler(job) 返回任务结果（可以 JSON 序列化的字典）"""
+        self._handlers[kind] = handler
+
+    # 生命周期
+
+    async def start(self) -> None:
+        """启动工作协程和心跳；接管已退出进程的排队任务，清理过期任务"""
+        if self._queue is not None:
+            return
+        self._queue = asyncio.Queue()
+        adopted = await asyncio.to_thread(self._sweep, time.time())
+        for job in adopted:
+            self._enqueue(job)
+        if adopted:
+            print(f"[INFO] 恢复了 {len(adopted)} 个排队中的后台任务")
+        self._worker_tasks = [
+            asyncio.create_task(self._work(), name=f"job-worker-{i}") for i in range(self.workers)
+        ]
+        self._heartbeat_task = asyncio.create_task(self._heartbeat(), name="job-heartbeat")
+
+    def _sweep(self, now: float) -> List[Job]:
+        """处理心跳超时的任务：执行中的标记为 failed，排队中的由本进程接管；清理过期任务
+
+        返回接管的任务（按提交顺序）。
+        """
+        stale = now - self.lease_timeout
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    "UPDATE jobs SET status = 'failed', error = ?, finished_at = ? "
+                    "WHERE status = 'running' AND (heartbeat_at IS NULL OR heartbeat_at < ?)",
+                    ("执行任务的进程已退出，任务中断", now, stale)
+                )
+                rows = conn.execute(
+                    "SELECT job_id, kind, room_id, payload, created_at FROM jobs "
+                    "WHERE status = 'queued' AND (heartbeat_at IS NULL OR heartbeat_at < ?) ORDER BY created_at",
+                    (stale,)
+                ).fetchall()
+                adopted = []
+                for job_id, kind, room_id, payload, created_at in rows:
+                    # 条件更新：多个进程同时接管时只有一个成功
+                    claimed = conn.execute(
+                        "UPDATE jobs SET owner = ?, heartbeat_at = ? WHERE job_id = ? AND status = 'queued' "
+                        "AND (heartbeat_at IS NULL OR heartbeat_at < ?)",
+                        (self.owner, now, job_id, stale)
+                    ).rowcount
+                    if claimed:
+                        adopted.append(Job(self, job_id, kind, room_id, json.loads(payload), created_at))
+                self._delete_expired(conn, now)
+        return adopted
+
+    def _delete_expired(self, conn: sqlite3.Connection, now: float) -> None:
+        expired = [row[0] for row in conn.execute(
+            "SELECT job_id FROM jobs WHERE finished_at < ?", (now - self.retention,)
+        )]
+        conn.executemany("DELETE FROM job_steps WHERE job_id = ?", [(j,) for j in expired])
+        conn.executemany("DELETE FROM jobs WHERE job_id = ?", [(j,) for j in expired])
+
+    def _beat(self, now: float) -> List[str]:
+        """刷新本进程任务的心跳，返回其他进程请求取消的本进程任务"""
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    "UPDATE jobs SET heartbeat_at = ? WHERE owner = ? AND status IN ('queued', 'running')",
+                    (now, self.owner)
+                )
+            return [row[0] for row in conn.execute(
+                "SELECT job_id FROM jobs WHERE owner = ? AND cancel_requested = 1 AND status IN ('queued', 'running')",
+                (self.owner,)
+            )]
+
+    async def _heartbeat(self) -> None:
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                now = time.time()
+                for job_id in await asyncio.to_thread(self._beat, now):
+                    await self._cancel_local(job_id, wait=False)
+                for job in await asyncio.to_thread(self._sweep, now):
+                    print(f"[INFO] 接管了已退出进程的后台任务 {job.job_id}")
+                    self._enqueue(job)
+            except sqlite3.Error as e:
+                print(f"[WARNING] 后台任务心跳失败: {e}")
+
+    async def close(self) -> None:
+        """停止工作协程：执行中的任务被取消并标记为 failed，排队中的任务由其他进程或下次启动时继续"""
+        tasks = self._worker_tasks + ([self._heartbeat_task] if self._heartbeat_task is not None else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._worker_tasks = []
+        self._heartbeat_task = None
+        self._queue = None
+        self._queued.clear()
+        with self._lock:
+            if self._conn is not None:
+                # 释放排队中的任务，其他进程在下次心跳时即可接管
+                with self._conn:
+                    self._conn.execute(
+                        "UPDATE jobs SET heartbeat_at = NULL WHERE owner = ? AND status = 'queued'", (self.owner,)
+                    )
+                self._conn.close()
+                self._conn = None
+
+    # 提交和执行
+
+    def _enqueue(self, job: Job) -> None:
+        self._queued[job.job_id] = job
+        self._queue.put_nowait(job.job_id)
+
+    async def submit(self, kind: str, room_id: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """提交任务，返回任务信息（包含 job_id 和排队位置）"""
+        if kind not in self._handlers:
+            raise ValueError(f"未知的任务类型 '{kind}'。可用类型: {list(self._handlers)}")
+        if self._queue is None:
+            raise RuntimeError("任务队列尚未启动")
+        if len(self._queued) >= self.max_queued:
+            raise JobQueueFull(f"排队中的任务数已达上限 {self.max_queued}")
+        job = Job(self, uuid.uuid4().hex, kind, room_id, payload, time.time())
+
+        def insert() -> int:
+            with self._lock:
+                conn = self._connect()
+                with conn:
+                    conn.execute(
+                        "INSERT INTO jobs (job_id, kind, room_id, status, payload, created_at, owner, heartbeat_at) "
+                        "VALUES (?, ?, ?, 'queued', ?, ?, ?, ?)",
+                        (job.job_id, kind, room_id, _dumps(payload), job.created_at, self.owner, job.created_at)
+                    )
+                return self._position(conn, self.owner, job.created_at)
+
+        position = await asyncio.to_thread(insert)
+        self._enqueue(job)
+        self.submitted += 1
+        return self._job_info(job, position=position)
+
+    async def _work(self) -> None:
+        while True:
+            job_id = await self._queue.get()
+            job = self._queued.pop(job_id, None)
+            if job is None:
+                # 排队时已取消
+                continue
+            self._running[job_id] = job
+            try:
+                await self._run(job)
+            finally:
+                del self._running[job_id]
+
+    def _claim(self, job: Job) -> Optional[bool]:
+        """认领排队中的任务：按 owner 和状态条件更新，返回是否已请求取消；任务已被取消或接管时返回 None"""
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                claimed = conn.execute(
+                    "UPDATE jobs SET status = 'running', started_at = ?, heartbeat_at = ? "
+                    "WHERE job_id = ? AND status = 'queued' AND owner = ?",
+                    (job.started_at, job.started_at, job.job_id, self.owner)
+                ).rowcount
+                if not claimed:
+                    return None
+                return bool(conn.execute(
+                    "SELECT cancel_requested FROM jobs WHERE job_id = ?", (job.job_id,)
+                ).fetchone()[0])
+
+    async def _run(self, job: Job) -> None:
+        job.started_at = time.time()
+        cancel_requested = await asyncio.to_thread(self._claim, job)
+        if cancel_requested is None:
+            # 排队时已被取消，或已由其他进程接管
+            info = await self.get(job.job_id, with_steps=False)
+            if info is not None:
+                job.status = info["status"]
+            job.close(info or self._job_info(job))
+            return
+        job.status = "running"
+        job.publish("status", {"status": "running"})
+
+        result, error, shutdown = None, None, False
+        if cancel_requested or job.cancel_requested:
+            # 认领期间收到取消请求，不再执行处理函数
+            job.status, error = "cancelled", "任务已取消"
+            self.cancelled += 1
+        else:
+            # 处理函数在单独的任务中执行：cancel() 只取消该任务，工作协程继续处理下一个任务
+            job.task = asyncio.create_task(self._handlers[job.kind](job))
+            try:
+                result = await asyncio.shield(job.task)
+                job.status = "succeeded"
+                self.succeeded += 1
+            except asyncio.CancelledError:
+                shutdown = not job.task.done()
+                if shutdown:
+                    # 工作协程本身被取消（服务关闭）
+                    job.task.cancel()
+                    await asyncio.gather(job.task, return_exceptions=True)
+                    job.status, error = "failed", "服务关闭，任务中断"
+                    self.failed += 1
+                else:
+                    job.status, error = "cancelled", "任务已取消"
+                    self.cancelled += 1
+            except Exception as e:
+                print(f"[ERROR] 后台任务 {job.job_id} 失败: {e}")
+                job.status, error = "failed", str(e)
+                self.failed += 1
+
+        finished_at = time.time()
+        await asyncio.to_thread(self._finish, job, result, error, finished_at)
+        job.close(self._job_info(job, result=result, error=error, finished_at=finished_at))
+        if shutdown:
+            raise asyncio.CancelledError()
+
+    def _finish(self, job: Job, result: Optional[Dict[str, Any]], error: Optional[str], finished_at: float) -> None:
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE job_id = ?",
+                    (job.status, _dumps(result) if result is not None else None, error, finished_at, job.job_id)
+                )
+                # 顺便清理过期任务
+                self._delete_expired(conn, finished_at)
+
+    def _cancel_queued(self, job_id: str, error: str, finished_at: float) -> bool:
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                return conn.execute(
+                    "UPDATE jobs SET status = 'cancelled', error = ?, finished_at = ? "
+                    "WHERE job_id = ? AND status = 'queued'",
+                    (error, finished_at, job_id)
+                ).rowcount == 1
+
+    def _request_cancel(self, job_id: str) -> bool:
+        """为其他进程的任务写入取消请求，返回任务是否仍未结束"""
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                return conn.execute(
+                    "UPDATE jobs SET cancel_requested = 1 WHERE job_id = ? AND status IN ('queued', 'running')",
+                    (job_id,)
+                ).rowcount == 1
+
+    async def _cancel_local(self, job_id: str, wait: bool = True) -> bool:
+        """取消本进程排队中或执行中的任务，返回任务是否在本进程中
+
+        wait 为 True 时等待执行中的任务写入最终状态。
+        """
+        job = self._queued.get(job_id)
+        if job is not None:
+            error, finished_at = "任务已取消", time.time()
+            # 条件更新：工作协程可能已经取出任务，此时由下面的执行中分支处理
+            if await asyncio.to_thread(self._cancel_queued, job_id, error, finished_at):
+                self._queued.pop(job_id, None)
+                job.status = "cancelled"
+                self.cancelled += 1
+                job.close(self._job_info(job, result=None, error=error, finished_at=finished_at))
+                return True
+        job = self._running.get(job_id)
+        if job is not None:
+            # 处理函数尚未开始时由 _run 检查该标记
+            job.cancel_requested = True
+            if job.task is not None:
+                job.task.cancel()
+            if wait:
+                # 等待工作协程写入最终状态
+                await job.finished.wait()
+            return True
+        return False
+
+    async def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """取消排队中或执行中的任务，返回任务信息（任务不存在时返回 None；已结束的任务不受影响）
+
+        其他进程的任务写入取消请求后等待所属进程处理，最多等待一个租约时间。
+        """
+        if await self._cancel_local(job_id):
+            return await self.get(job_id)
+        if not await asyncio.to_thread(self._request_cancel, job_id):
+            return await self.get(job_id)
+        deadline = time.monotonic() + self.lease_timeout + self.heartbeat_interval
+        while True:
+            info = await self.get(job_id)
+            if info is None or info["status"] in JOB_FINAL_STATUSES or time.monotonic() >= deadline:
+                return info
+            await asyncio.sleep(JOB_POLL_INTERVAL)
+
+    # 查询
+
+    @staticmethod
+    def _position(conn: sqlite3.Connection, owner: str, created_at: float) -> int:
+        """排队位置：所属进程中排在该任务之前（含该任务）的排队任务数"""
+        return conn.execute(
+            "SELECT COUNT(*) FROM jobs WHERE owner = ? AND status = 'queued' AND created_at <= ?",
+            (owner, created_at)
+        ).fetchone()[0]
+
+    def _job_info(self, job: Job, **extra: Any) -> Dict[str, Any]:
+        info = {
+            "job_id": job.job_id,
+            "kind": job.kind,
+            "room_id": job.room_id,
+            "status": job.status,
+            "created_at": job.created_at,
+            "started_at": job.started_at,
+            "position": None,
+            "steps_completed": len(job.steps),
+        }
+        info.update(extra)
+        return info
+
+    def _load(self, job_id: str, with_steps: bool) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT job_id, kind, room_id, status, result, error, created_at, started_at, finished_at, owner "
+                "FROM jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            position = self._position(conn, row[9], row[6]) if row[3] == "queued" else None
+            steps = [json.loads(step) for (step,) in conn.execute(
+                "SELECT step FROM job_steps WHERE job_id = ? ORDER BY idx", (job_id,)
+            )] if with_steps else None
+        info = dict(zip(
+            ("job_id", "kind", "room_id", "status", "result", "error", "created_at", "started_at", "finished_at"), row
+        ))
+        info["position"] = position
+        info["result"] = json.loads(info["result"]) if info["result"] is not None else None
+        if with_steps:
+            info["steps"] = steps
+        return info
+
+    async def get(self, job_id: str, with_steps: bool = True) -> Optional[Dict[str, Any]]:
+        """任务信息：状态、排队位置、已完成的步骤和最终结果"""
+        return await asyncio.to_thread(self._load, job_id, with_steps)
+
+    async def list_jobs(self, room_id: Optional[str] = None, status: Optional[str] = None,
+                   limit: int = 50) -> List[Dict[str, Any]]:
+        """按提交时间倒序列出任务（不包含步骤和结果）"""
+        conditions, params = [], []
+        if room_id is not None:
+            conditions.append("room_id = ?")
+            params.append(room_id)
+        if status is not None:
+            conditions.append("status = ?")
+            params.append(status)
+        sql = (
+            "SELECT job_id, kind, room_id, status, error, created_at, started_at, finished_at FROM jobs "
+            f"{'WHERE ' + ' AND '.join(conditions) if conditions else ''} ORDER BY created_at DESC LIMIT ?"
+        )
+
+        def query():
+            with self._lock:
+                return self._connect().execute(sql, (*params, limit)).fetchall()
+
+        keys = ("job_id", "kind", "room_id", "status", "error", "created_at", "started_at", "finished_at")
+        return [dict(zip(keys, row)) for row in await asyncio.to_thread(query)]
+
+    async def subscribe(self, job_id: str) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """任务事件流：先补发已完成的步骤，然后推送 status / step 事件，结束时推送 done
+
+        任务不存在时不产生任何事件。其他进程的任务通过轮询数据库推送。
+        """
+        job = self._queued.get(job_id) or self._running.get(job_id)
+        if job is None:
+            sent, status = 0, None
+            while True:
+                info = await self.get(job_id)
+                if info is None:
+                    return
+                steps = info.pop("steps")
+                if info["status"] not in JOB_FINAL_STATUSES and info["status"] != status:
+                    status = info["status"]
+                    yield "status", info
+                for index, step in enumerate(steps[sent:], sent + 1):
+                    yield "step", {"index": index, **step}
+                sent = len(steps)
+                if info["status"] in JOB_FINAL_STATUSES:
+                    yield "done", info
+                    return
+                await asyncio.sleep(JOB_POLL_INTERVAL)
+
+        # 复制已有步骤和注册监听之间没有 await，不会漏掉或重复事件
+        queue: asyncio.Queue = asyncio.Queue()
+        steps = list(job.steps)
+        job.listeners.add(queue)
+        try:
+            info = self._job_info(job)
+            if job.status == "queued":
+                info["position"] = await asyncio.to_thread(self._load_position, job)
+            yield "status", info
+            for index, step in enumerate(steps, 1):
+                yield "step", {"index": index, **step}
+            while True:
+                event = await queue.get()
+                if event is None:
+                    return
+                yield event
+        finally:
+            job.listeners.discard(queue)
+
+    def _load_position(self, job: Job) -> int:
+        with self._lock:
+            return self._position(self._connect(), self.owner, job.created_at)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "owner": self.owner,
+            "workers": self.workers,
+            "queued": len(self._queued),
+            "running": len(self._running),
+            "submitted": self.submitted,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+        }
+
+
+# 全局单例
+_job_manager: Optional[JobManager] = None
+
+def get_job_manager() -> JobManager:
+    """获取全局后台任务管理器"""
+    global _job_manager
+    if _job_manager is None:
+        _job_manager = JobManager()
+    return _job_manager
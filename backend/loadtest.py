@@ -0,0 +1,348 @@
+"""端到端压测：并发驱动 HTTP 接口和 WebSocket，输出 JSON 报告
+
+默认在后台线程中启动一个使用离线假模型（MODEL_PROVIDER=fake）的服务，数据写入临时目录；
+也可以用 --url 压测已经运行的服务。
+
+    python loadtest.py --rooms 20 --concurrency 50 --duration 30 \\
+        --mix message=5,collaborative=1,state=10,analyze=1,ws=2 --ws-watchers 1 --output report.json
+
+操作类型：
+    message        POST /api/rooms/{room}/message（随机指定或不指定智能体）
+    collaborative  POST /api/rooms/{room}/collaborative-task（随机 2~3 个智能体）
+    state          GET  /api/rooms/{room}/state
+    analyze        POST /api/analyze-task
+    ws             连接 /ws/rooms/{room}，收到完整状态后断开（连接建立 + 首帧延迟）
+
+--ws-watchers 为每个房间保持的 WebSocket 订阅数，报告中统计收到的帧数和字节数
+（智能体调用工具时未指定房间会写入 default 房间，因此也订阅 default）。
+报告包含每种操作的吞吐量、p50/p95/p99 延迟和错误率，以及结束时的 /api/health。
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+# 设置编码
+if sys.platform == 'win32':
+    sys.stdout.reconfigure(encoding='utf-8')
+
+# 添加路径
+backend_path = Path(__file__).parent
+sys.path.insert(0, str(backend_path))
+
+import httpx
+import websockets
+
+AGENT_IDS = ["mathematician", "artist", "engineer", "merchant", "athlete", "doctor"]
+MESSAGES = [
+    "帮我计算一下圆周率的前几位",
+    "设计一个简洁的 logo 配色",
+    "用 Python 实现快速排序",
+    "分析一下这个季度的投资成本",
+    "制定一个每周三次的健身训练计划",
+    "最近总是失眠，有什么健康建议",
+]
+DEFAULT_MIX = "message=5,collaborative=1,state=10,analyze=1,ws=2"
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise ValueError(f"未知的操作 '{name}'。可用操作: {list(OPERATIONS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * p / 100
+    lower = int(k)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (k - lower)
+
+
+class Recorder:
+    """按操作类型记录延迟和错误"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, Dict[str, int]] = {}
+
+    def record(self, op: str, latency: float, error: Optional[str] = None) -> None:
+        self.latencies.setdefault(op, [])
+        self.errors.setdefault(op, {})
+        if error is None:
+            self.latencies[op].append(latency)
+        else:
+            self.errors[op][error] = self.errors[op].get(error, 0) + 1
+
+    def summary(self, elapsed: float) -> Dict[str, Any]:
+        operations = {}
+        for op in self.latencies:
+            values = sorted(self.latencies[op])
+            errors = sum(self.errors[op].values())
+            total = len(values) + errors
+            operations[op] = {
+                "requests": total,
+                "ok": len(values),
+                "errors": errors,
+                "error_rate": round(errors / total, 4) if total else 0.0,
+                "error_kinds": self.errors[op],
+                "throughput_rps": round(len(values) / elapsed, 2),
+                "latency_ms": {
+                    "mean": round(sum(values) / len(values) * 1000, 2) if values else 0.0,
+                    "p50": round(percentile(values, 50) * 1000, 2),
+                    "p95": round(percentile(values, 95) * 1000, 2),
+                    "p99": round(percentile(values, 99) * 1000, 2),
+                    "max": round(values[-1] * 1000, 2) if values else 0.0,
+                },
+            }
+        requests = sum(op["requests"] for op in operations.values())
+        errors = sum(op["errors"] for op in operations.values())
+        return {
+            "requests": requests,
+            "errors": errors,
+            "error_rate": round(errors / requests, 4) if requests else 0.0,
+            "throughput_rps": round((requests - errors) / elapsed, 2),
+            "operations": operations,
+        }
+
+
+# 各类操作
+
+async def op_message(client: httpx.AsyncClient, ws_url: str, room_id: str, rng: random.Random) -> None:
+    body = {"message": rng.choice(MESSAGES)}
+    if rng.random() < 0.5:
+        body["target_agent"] = rng.choice(AGENT_IDS)
+    response = await client.post(f"/api/rooms/{room_id}/message", json=body)
+    response.raise_for_status()
+
+
+async def op_collaborative(client: httpx.AsyncClient, ws_url: str, room_id: str, rng: random.Random) -> None:
+    agents = rng.sample(AGENT_IDS, rng.randint(2, 3))
+    body = {"description": rng.choice(MESSAGES), "selected_agents": agents, "agent_order": agents}
+    response = await client.post(f"/api/rooms/{room_id}/collaborative-task", json=body)
+    response.raise_for_status()
+
+
+async def op_state(client: httpx.AsyncClient, ws_url: str, room_id: str, rng: random.Random) -> None:
+    response = await client.get(f"/api/rooms/{room_id}/state")
+    response.raise_for_status()
+
+
+async def op_analyze(client: httpx.AsyncClient, ws_url: str, room_id: str, rng: random.Random) -> None:
+    response = await client.post("/api/analyze-task", json={"description": rng.choice(MESSAGES)})
+    response.raise_for_status()
+
+
+async def op_ws(client: httpx.AsyncClient, ws_url: str, room_id: str, rng: random.Random) -> None:
+    async with websockets.connect(f"{ws_url}/ws/rooms/{room_id}") as ws:
+        message = json.loads(await ws.recv())
+        if message.get("type") != "world_state":
+            raise ValueError(f"unexpected first frame: {message.get('type')}")
+
+
+OPERATIONS = {
+    "message": op_message,
+    "collaborative": op_collaborative,
+    "state": op_state,
+    "analyze": op_analyze,
+    "ws": op_ws,
+}
+
+
+def _error_kind(e: Exception) -> str:
+    if isinstance(e, httpx.HTTPStatusError):
+        return f"http_{e.response.status_code}"
+    return type(e).__name__
+
+
+async def worker(
+    client: httpx.AsyncClient,
+    ws_url: str,
+    rooms: List[str],
+    mix: Dict[str, float],
+    deadline: float,
+    recorder: Recorder,
+    rng: random.Random,
+    remaining: List[int],
+) -> None:
+    names, weights = list(mix), list(mix.values())
+    while time.perf_counter() < deadline:
+        if remaining[0] == 0:
+            return
+        if remaining[0] > 0:
+            remaining[0] -= 1
+        op = rng.choices(names, weights)[0]
+        room_id = rng.choice(rooms)
+        start = time.perf_counter()
+        try:
+            await OPERATIONS[op](client, ws_url, room_id, rng)
+        except Exception as e:
+            recorder.record(op, time.perf_counter() - start, _error_kind(e))
+        else:
+            recorder.record(op, time.perf_counter() - start)
+
+
+async def watcher(ws_url: str, room_id: str, stats: Dict[str, int], stop: asyncio.Event) -> None:
+    """保持订阅房间，统计收到的帧"""
+    try:
+        async with websockets.connect(f"{ws_url}/ws/rooms/{room_id}") as ws:
+            while not stop.is_set():
+                try:
+                    frame = await asyncio.wait_for(ws.recv(), timeout=0.2)
+                except asyncio.TimeoutError:
+                    continue
+                stats["frames"] += 1
+                stats["bytes"] += len(frame)
+                if '"world_delta"' in frame:
+                    stats["deltas"] += 1
+    except Exception:
+        stats["errors"] += 1
+
+
+# 本地服务
+
+class LocalServer:
+    """在后台线程中运行 uvicorn（独立的事件循环，不与压测客户端抢占）"""
+
+    def __init__(self, data_dir: str):
+        self.data_dir = data_dir
+        self.server = None
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self) -> str:
+        os.environ.setdefault("MODEL_PROVIDER", "fake")
+        os.environ.setdefault("OPENAI_AGENTS_DISABLE_TRACING", "1")
+        # 服务使用相对路径 backend/data 保存状态和会话，切换到临时目录避免写入仓库
+        os.chdir(self.data_dir)
+        import uvicorn
+        from app import app
+
+        config = uvicorn.Config(app, host="127.0.0.1", port=0, log_level="warning")
+        self.server = uvicorn.Server(config)
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+        self.thread.start()
+        while not self.server.started:
+            if not self.thread.is_alive():
+                raise RuntimeError("本地服务启动失败")
+            time.sleep(0.01)
+        port = self.server.servers[0].sockets[0].getsockname()[1]
+        return f"http://127.0.0.1:{port}"
+
+    def stop(self) -> None:
+        if self.server is not None:
+            self.server.should_exit = True
+            self.thread.join(timeout=10)
+
+
+async def run_load(args: argparse.Namespace, base_url: str) -> Dict[str, Any]:
+    mix = parse_mix(args.mix)
+    rooms = [f"load-{i}" for i in range(args.rooms)]
+    ws_url = "ws" + base_url[len("http"):]
+    rng = random.Random(args.seed)
+    recorder = Recorder()
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    timeout = httpx.Timeout(args.timeout)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=timeout) as client:
+        watch_stats = {"frames": 0, "deltas": 0, "bytes": 0, "errors": 0}
+        stop = asyncio.Event()
+        watchers = [
+            asyncio.create_task(watcher(ws_url, room_id, watch_stats, stop))
+            for room_id in rooms + ["default"] for _ in range(args.ws_watchers)
+        ]
+
+        start = time.perf_counter()
+        deadline = start + args.duration if args.duration > 0 else float("inf")
+        remaining = [args.requests if args.requests > 0 else -1]
+        await asyncio.gather(*(
+            worker(client, ws_url, rooms, mix, deadline, recorder, random.Random(rng.random()), remaining)
+            for _ in range(args.concurrency)
+        ))
+        elapsed = time.perf_counter() - start
+
+        stop.set()
+        await asyncio.gather(*watchers)
+        try:
+            health = (await client.get("/api/health")).json()
+        except Exception as e:
+            health = {"error": str(e)}
+
+    return {
+        "config": {
+            "url": args.url,
+            "rooms": args.rooms,
+            "concurrency": args.concurrency,
+            "duration_s": args.duration,
+            "requests": args.requests,
+            "mix": mix,
+            "ws_watchers": args.ws_watchers,
+            "seed": args.seed,
+            "model_provider": os.getenv("MODEL_PROVIDER", "openai") if args.url is None else None,
+            "fake_model_latency": os.getenv("FAKE_MODEL_LATENCY", "0") if args.url is None else None,
+        },
+        "elapsed_s": round(elapsed, 3),
+        **recorder.summary(elapsed),
+        "websocket_watchers": {"connections": len(watchers), **watch_stats},
+        "server": health,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="多智能体协作系统端到端压测")
+    parser.add_argument("--url", help="压测已运行的服务（例如 http://127.0.0.1:8000），默认启动本地假模型服务")
+    parser.add_argument("--rooms", type=int, default=10, help="房间数")
+    parser.add_argument("--concurrency", type=int, default=20, help="并发请求数")
+    parser.add_argument("--duration", type=float, default=10.0, help="持续时间（秒），0 表示只按 --requests 结束")
+    parser.add_argument("--requests", type=int, default=0, help="总请求数上限，0 表示不限")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"操作权重，默认 {DEFAULT_MIX}")
+    parser.add_argument("--ws-watchers", type=int, default=0, help="每个房间保持的 WebSocket 订阅数")
+    parser.add_argument("--timeout", type=float, default=60.0, help="单个请求超时（秒）")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    parser.add_argument("--output", help="报告文件路径，默认输出到标准输出")
+    args = parser.parse_args(argv)
+    if args.duration <= 0 and args.requests <= 0:
+        parser.error("--duration 和 --requests 至少指定一个")
+
+    output = os.path.abspath(args.output) if args.output else None
+    server = None
+    base_url = args.url
+    with tempfile.TemporaryDirectory() as data_dir:
+        cwd, stdout = os.getcwd(), sys.stdout
+        # 服务的日志输出到标准错误，标准输出只输出报告
+        sys.stdout = sys.stderr
+        try:
+            if base_url is None:
+                server = LocalServer(data_dir)
+                base_url = server.start()
+            report = asyncio.run(run_load(args, base_url.rstrip("/")))
+        finally:
+            if server is not None:
+                server.stop()
+            os.chdir(cwd)
+            sys.stdout = stdout
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(text)
+        print(f"报告已写入 {output}（{report['requests']} 个请求，错误率 {report['error_rate']:.2%}）", file=sys.stderr)
+    else:
+        print(text)
+    return 0 if report["requests"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,377 @@
+"""运行指标：耗时 span、直方图和计数器，以 Prometheus 文本格式在 /metrics 暴露
+
+每段耗时（span）按名称记录：
+    agent           智能体从开始运行到给出结果或 handoff（target 为智能体名称）
+    llm             一次模型调用
+    tool            一次工具调用（target 为工具名称）
+    state.*         StateStore 的加载、保存、刷写和事件应用（state.load / state.save / state.flush / state.apply）
+    session.*       会话历史读写和压缩（session.read / session.write / session.compact）
+    admission       模型调用在准入控制中排队等待的时间（target 为通道，见 admission.py）
+
+所有 span 累加到直方图 span_duration_seconds{span, target}；如果当前请求开启了追踪，
+同时记录到该请求的追踪中，可以按 trace ID 查看一次请求在模型、工具、状态存储和会话上各花了多少时间。
+"""
+import bisect
+import contextvars
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from agents import RunHooks
+
+# 是否为每个请求记录追踪（响应头 X-Trace-Id / Server-Timing，/api/traces/{trace_id} 查询）
+METRICS_TRACE = os.getenv("METRICS_TRACE", "1").lower() in ("1", "true", "yes")
+# 保留最近多少个请求的追踪
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "1000"))
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Server-Timing 和追踪汇总中统计的类别（agent 包含其中的 llm / tool，不单独汇总）
+TRACE_CATEGORIES = ("llm", "tool", "state", "session", "admission")
+# 包含同类别其他 span 的外层 span，汇总时跳过以免重复计算
+_CONTAINER_SPANS = frozenset(("state.apply", "session.compact"))
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    """按标签累加的计数器"""
+
+    def __init__(self, name: str, help: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels: Tuple[str, ...] = (), amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, labels: Tuple[str, ...] = ()) -> float:
+        return self._values.get(labels, 0.0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            lines.append(f"{self.name}{_format_labels(self.label_names, labels)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """按标签分组的累积直方图"""
+
+    def __init__(self, name: str, help: str, label_names: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        # 标签 → [各区间计数..., 总和, 总数]
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, labels: Tuple[str, ...] = ()) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0.0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def snapshot(self, labels: Tuple[str, ...] = ()) -> Dict[str, float]:
+        series = self._series.get(labels)
+        if series is None:
+            return {"count": 0, "sum": 0.0}
+        return {"count": series[-1], "sum": series[-2]}
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(labels, list(series)) for labels, series in self._series.items()]
+        for labels, series in items:
+            cumulative = 0.0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, labels, le)} {_format_value(cumulative)}")
+            inf = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.label_names, labels, inf)} {_format_value(series[-1])}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, labels)} {series[-2]!r}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, labels)} {_format_value(series[-1])}")
+        return lines
+
+
+class Gauge:
+    """读取时调用回调函数取值"""
+
+    def __init__(self, name: str, help: str, fn: Callable[[], float]):
+        self.name = name
+        self.help = help
+        self.fn = fn
+
+    def render(self) -> List[str]:
+        try:
+            value = float(self.fn())
+        except Exception as e:
+            print(f"[WARNING] 读取指标 {self.name} 失败: {e}")
+            return []
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {_format_value(value)}"]
+
+
+class MetricsRegistry:
+    """指标注册表，按注册顺序输出"""
+
+    def __init__(self):
+        self._metrics: "OrderedDict[str, Any]" = OrderedDict()
+
+    def _register(self, metric):
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, label_names: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help, label_names))
+
+    def histogram(self, name: str, help: str, label_names: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, label_names, buckets))
+
+    def gauge(self, name: str, help: str, fn: Callable[[], float]) -> Gauge:
+        """注册（或替换）回调取值的指标"""
+        self._metrics[name] = Gauge(name, help, fn)
+        return self._metrics[name]
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+SPAN_DURATION = registry.histogram(
+    "span_duration_seconds", "Duration of timed spans (agent, llm, tool, state.*, session.*)", ("span", "target")
+)
+HTTP_REQUEST_DURATION = registry.histogram(
+    "http_request_duration_seconds", "HTTP request duration by route", ("method", "route", "status")
+)
+HANDOFFS = registry.counter("agent_handoffs_total", "Agent handoffs", ("from_agent", "to_agent"))
+LLM_TOKENS = registry.counter("llm_tokens_total", "Tokens reported by model calls", ("agent", "kind"))
+
+
+# 请求追踪
+
+class Trace:
+    """一次请求中记录的所有 span"""
+
+    __slots__ = ("trace_id", "correlation_id", "started_at", "start", "end", "spans")
+
+    def __init__(self, trace_id: str, correlation_id: Optional[str] = None):
+        self.trace_id = trace_id
+        # 客户端提供的关联ID，只作为属性记录，不用于查找追踪
+        self.correlation_id = correlation_id
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        # (span, target, 开始时间, 结束时间)
+        self.spans: List[Tuple[str, str, float, float]] = []
+
+    def breakdown(self) -> Dict[str, float]:
+        """各类别的累计耗时（秒）；并行执行的 span 会分别累计"""
+        totals = {category: 0.0 for category in TRACE_CATEGORIES}
+        for name, _, start, end in list(self.spans):
+            category = name.split(".", 1)[0]
+            if category in totals and name not in _CONTAINER_SPANS:
+                totals[category] += end - start
+        return totals
+
+    def server_timing(self) -> str:
+        """Server-Timing 响应头（毫秒）"""
+        parts = [f"{category};dur={seconds * 1000:.1f}" for category, seconds in self.breakdown().items() if seconds > 0]
+        end = self.end if self.end is not None else time.perf_counter()
+        parts.append(f"total;dur={(end - self.start) * 1000:.1f}")
+        return ", ".join(parts)
+
+    def to_dict(self) -> Dict[str, Any]:
+        end = self.end if self.end is not None else time.perf_counter()
+        return {
+            "trace_id": self.trace_id,
+            "correlation_id": self.correlation_id,
+            "started_at": self.started_at,
+            "duration_ms": round((end - self.start) * 1000, 3),
+            "complete": self.end is not None,
+            "breakdown_ms": {category: round(seconds * 1000, 3) for category, seconds in self.breakdown().items()},
+            "spans": [
+                {
+                    "span": name,
+                    "target": target,
+                    "start_ms": round((start - self.start) * 1000, 3),
+                    "duration_ms": round((end - start) * 1000, 3),
+                }
+                for name, target, start, end in sorted(list(self.spans), key=lambda s: s[2])
+            ],
+        }
+
+
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("current_trace", default=None)
+_traces: "OrderedDict[str, Trace]" = OrderedDict()
+_traces_lock = threading.Lock()
+
+
+def start_trace(correlation_id: Optional[str] = None) -> Tuple[Trace, contextvars.Token]:
+    """开始追踪当前请求，之后（包括 asyncio.to_thread 中）记录的 span 都会加入该追踪
+
+    追踪ID总是由服务端生成（不可猜测，客户端不能覆盖其他请求的追踪）；
+    correlation_id 为客户端提供的关联ID，只随追踪一起记录。
+    """
+    trace = Trace(uuid.uuid4().hex, correlation_id)
+    with _traces_lock:
+        _traces[trace.trace_id] = trace
+        _traces.move_to_end(trace.trace_id)
+        while len(_traces) > TRACE_BUFFER_SIZE:
+            _traces.popitem(last=False)
+    return trace, _current_trace.set(trace)
+
+
+def end_trace(trace: Trace, token: contextvars.Token) -> None:
+    trace.end = time.perf_counter()
+    _current_trace.reset(token)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+def get_trace(trace_id: str) -> Optional[Trace]:
+    with _traces_lock:
+        return _traces.get(trace_id)
+
+
+def record_span(name: str, target: str, start: float, end: Optional[float] = None) -> None:
+    """记录一段已经结束的耗时（start / end 为 time.perf_counter() 的值）"""
+    if end is None:
+        end = time.perf_counter()
+    SPAN_DURATION.observe(end - start, (name, target))
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.spans.append((name, target, start, end))
+
+
+class span:
+    """with span("state.save", "sqlite"): ... 记录代码块的耗时"""
+
+    __slots__ = ("name", "target", "start")
+
+    def __init__(self, name: str, target: str = ""):
+        self.name = name
+        self.target = target
+
+    def __enter__(self) -> "span":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        record_span(self.name, self.target, self.start)
+
+
+# 模型用量监听器：listener(智能体名称, 输入 token, 输出 token)，用于按房间/智能体统计用量（见 usage.py）
+UsageListener = Callable[[str, int, int], None]
+_usage_listeners: List[UsageListener] = []
+
+
+def add_usage_listener(listener: UsageListener) -> None:
+    if listener not in _usage_listeners:
+        _usage_listeners.append(listener)
+
+
+def remove_usage_listener(listener: UsageListener) -> None:
+    if listener in _usage_listeners:
+        _usage_listeners.remove(listener)
+
+
+def record_llm_usage(agent: str, input_tokens: int, output_tokens: int) -> None:
+    """记录一次模型调用的 token 用量"""
+    LLM_TOKENS.inc((agent, "input"), input_tokens)
+    LLM_TOKENS.inc((agent, "output"), output_tokens)
+    for listener in list(_usage_listeners):
+        try:
+            listener(agent, input_tokens, output_tokens)
+        except Exception as e:
+            print(f"[WARNING] 用量监听器出错: {e}")
+
+
+def record_completion_usage(agent: str, response: Any) -> None:
+    """记录 chat.completions 响应的用量（规划器、摘要等不经过 Runner 的调用）"""
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        record_llm_usage(agent, usage.prompt_tokens or 0, usage.completion_tokens or 0)
+
+
+class MetricsHooks(RunHooks):
+    """Runner 的运行钩子：记录智能体、模型调用、工具调用的耗时和 handoff 次数
+
+    每次 Runner.run 使用一个新实例（准入控制在子类 admission.AdmissionHooks 中，见 admission.run_hooks()）。
+    """
+
+    def __init__(self):
+        self._starts: Dict[Tuple[Any, ...], float] = {}
+
+    def _finish(self, key: Tuple[Any, ...], name: str, target: str) -> None:
+        start = self._starts.pop(key, None)
+        if start is not None:
+            record_span(name, target, start)
+
+    async def on_agent_start(self, context, agent) -> None:
+        self._starts[("agent", agent.name)] = time.perf_counter()
+
+    async def on_agent_end(self, context, agent, output) -> None:
+        self._finish(("agent", agent.name), "agent", agent.name)
+
+    async def on_handoff(self, context, from_agent, to_agent) -> None:
+        # handoff 之后原智能体不会再收到 on_agent_end，在这里结束它的 span
+        self._finish(("agent", from_agent.name), "agent", from_agent.name)
+        HANDOFFS.inc((from_agent.name, to_agent.name))
+        now = time.perf_counter()
+        record_span("handoff", f"{from_agent.name}->{to_agent.name}", now, now)
+
+    async def on_llm_start(self, context, agent, system_prompt, input_items) -> None:
+        self._starts[("llm", agent.name)] = time.perf_counter()
+
+    async def on_llm_end(self, context, agent, response) -> None:
+        self._finish(("llm", agent.name), "llm", agent.name)
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            record_llm_usage(agent.name, usage.input_tokens, usage.output_tokens)
+
+    async def on_tool_start(self, context, agent, tool) -> None:
+        key = ("tool", tool.name, getattr(context, "tool_call_id", None))
+        self._starts[key] = time.perf_counter()
+
+    async def on_tool_end(self, context, agent, tool, result) -> None:
+        self._finish(("tool", tool.name, getattr(context, "tool_call_id", None)), "tool", tool.name)
+
@@ -0,0 +1,306 @@
+"""请求截止时间、模型调用超时 / 重试和对冲请求
+
+截止时间：
+    每个 HTTP 请求有一个截止时间（REQUEST_TIMEOUT 秒，客户端可用 X-Request-Timeout 请求头指定，
+    不超过 REQUEST_TIMEOUT_MAX），后台任务使用 JOB_TIMEOUT。截止时间保存在 contextvar 中，
+    随请求创建的任务（房间执行队列、协作任务的并行步骤、流式响应）一起传播；
+    路由智能体、handoff 后的智能体和协作任务的每一步共用同一个截止时间。
+
+模型调用：
+    - Runner 运行：run_config() 把单次调用超时（LLM_CALL_TIMEOUT，不超过剩余时间）和
+      带抖动的指数退避重试（LLM_MAX_RETRIES）交给 agents SDK 执行；剩余时间不足时不再重试
+    - 规划器、摘要（chat.completions）：call_with_retries() 实现同样的超时和重试，
+      只读 / 幂等的调用可以开启对冲请求（hedge_delay 秒后仍未返回时再发一个相同请求，取先返回的结果）
+
+超过截止时间抛出 DeadlineExceeded；error_status() 把常见错误映射为 HTTP 状态码
+（超时 504，上游限流 503，上游不可用 / 出错 502），其余为 500。
+"""
+import asyncio
+import contextvars
+import os
+import random
+import time
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Iterator, Optional, Tuple, TypeVar
+
+import openai
+from agents import (
+    ModelRetryBackoffSettings,
+    ModelRetrySettings,
+    ModelSettings,
+    ModelTimeoutError,
+    RetryPolicyContext,
+    RunConfig,
+    retry_policies,
+)
+
+from metrics import registry
+from usage import run_config as usage_run_config
+
+T = TypeVar("T")
+
+# HTTP 请求的默认截止时间（秒），0 表示不限制
+REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", "120"))
+# 客户端通过 X-Request-Timeout 指定的截止时间上限（秒）
+REQUEST_TIMEOUT_MAX = float(os.getenv("REQUEST_TIMEOUT_MAX", "600"))
+# 后台任务（jobs）的截止时间（秒），0 表示不限制
+JOB_TIMEOUT = float(os.getenv("JOB_TIMEOUT", "1800"))
+# 单次模型调用的超时（秒），不超过请求的剩余时间
+LLM_CALL_TIMEOUT = float(os.getenv("LLM_CALL_TIMEOUT", "60"))
+# 瞬时错误（超时、连接失败、限流、5xx）的最大重试次数
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+# 重试的退避时间（秒）：第 n 次重试等待 min(初始值 × 2^(n-1), 上限) 并加随机抖动
+LLM_RETRY_INITIAL_DELAY = float(os.getenv("LLM_RETRY_INITIAL_DELAY", "0.5"))
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "8"))
+# 剩余时间少于该值（秒）时不再重试，直接返回错误
+LLM_RETRY_MIN_REMAINING = float(os.getenv("LLM_RETRY_MIN_REMAINING", "1"))
+# 规划请求的对冲延迟（秒）：超过该时间仍未返回时再发一个相同请求，0 表示不对冲
+PLAN_HEDGE_DELAY = float(os.getenv("PLAN_HEDGE_DELAY", "0"))
+
+# 视为瞬时错误的上游状态码
+TRANSIENT_STATUSES = frozenset((408, 409, 429, 500, 502, 503, 504))
+
+LLM_RETRIES = registry.counter(
+    "llm_call_retries_total", "Retried chat.completions calls by error type", ("error",)
+)
+LLM_HEDGES = registry.counter(
+    "llm_hedged_requests_total", "Hedged chat.completions calls by winning request", ("winner",)
+)
+
+
+class DeadlineExceeded(Exception):
+    """请求超过截止时间"""
+
+    def __init__(self, timeout: float):
+        super().__init__(f"超过截止时间（{timeout:g} 秒）")
+        self.timeout = timeout
+
+
+class Deadline:
+    """截止时间（time.monotonic() 时刻）"""
+
+    __slots__ = ("timeout", "expires_at")
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self.expires_at = time.monotonic() + timeout
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+
+_current_deadline: contextvars.ContextVar[Optional[Deadline]] = contextvars.ContextVar("deadline", default=None)
+
+
+def request_timeout(header: Optional[str]) -> float:
+    """请求的截止时间（秒）：X-Request-Timeout 请求头（限制在 REQUEST_TIMEOUT_MAX 以内），没有或无效时为 REQUEST_TIMEOUT"""
+    try:
+        timeout = float(header) if header else 0.0
+    except ValueError:
+        timeout = 0.0
+    if timeout <= 0:
+        return REQUEST_TIMEOUT
+    return min(timeout, REQUEST_TIMEOUT_MAX) if REQUEST_TIMEOUT_MAX > 0 else timeout
+
+
+def _narrowed(timeout: float) -> Optional[Deadline]:
+    """timeout 秒后的截止时间；已有更早的截止时间时保留原来的"""
+    current = _current_deadline.get()
+    if timeout <= 0 or (current is not None and current.remaining() <= timeout):
+        return current
+    return Deadline(timeout)
+
+
+@contextmanager
+def deadline_scope(timeout: float) -> Iterator[Optional[Deadline]]:
+    """with 块内（包括其中创建的任务）的运行在 timeout 秒内完成，0 表示不限制"""
+    deadline = _narrowed(timeout)
+    token = _current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current_deadline.reset(token)
+
+
+def current_deadline() -> Optional[Deadline]:
+    return _current_deadline.get()
+
+
+def remaining() -> Optional[float]:
+    """当前请求的剩余时间（秒），没有截止时间时为 None"""
+    deadline = _current_deadline.get()
+    return deadline.remaining() if deadline is not None else None
+
+
+def check_deadline() -> None:
+    """已超过截止时间时抛出 DeadlineExceeded"""
+    deadline = _current_deadline.get()
+    if deadline is not None and deadline.remaining() <= 0:
+        raise DeadlineExceeded(deadline.timeout)
+
+
+def call_timeout() -> float:
+    """单次模型调用的超时：LLM_CALL_TIMEOUT 和剩余时间中较小的一个"""
+    check_deadline()
+    left = remaining()
+    return min(LLM_CALL_TIMEOUT, left) if left is not None else LLM_CALL_TIMEOUT
+
+
+async def with_deadline(awaitable: Awaitable[T]) -> T:
+    """在剩余时间内等待 awaitable，超时则取消并抛出 DeadlineExceeded"""
+    deadline = _current_deadline.get()
+    if deadline is None:
+        return await awaitable
+    task = asyncio.ensure_future(awaitable)
+    try:
+        done, _ = await asyncio.wait({task}, timeout=max(deadline.remaining(), 0))
+    except asyncio.CancelledError:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        raise
+    if task in done:
+        return task.result()
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    raise DeadlineExceeded(deadline.timeout)
+
+
+def cancel_at_deadline(cancel: Callable[[], Any]) -> Optional[asyncio.TimerHandle]:
+    """到截止时间时调用 cancel（用于流式运行），返回的句柄需要在运行结束后 cancel()"""
+    left = remaining()
+    if left is None:
+        return None
+    return asyncio.get_running_loop().call_later(max(left, 0), cancel)
+
+
+# Runner：交给 agents SDK 执行超时和重试
+
+def _within_deadline(context: RetryPolicyContext) -> bool:
+    left = remaining()
+    return left is None or left > LLM_RETRY_MIN_REMAINING
+
+
+def retry_settings() -> ModelRetrySettings:
+    """瞬时错误按带抖动的指数退避重试，剩余时间不足时不重试"""
+    return ModelRetrySettings(
+        max_retries=LLM_MAX_RETRIES,
+        backoff=ModelRetryBackoffSettings(
+            initial_delay=LLM_RETRY_INITIAL_DELAY,
+            max_delay=LLM_RETRY_MAX_DELAY,
+            multiplier=2.0,
+            jitter=True,
+        ),
+        policy=retry_policies.all(
+            retry_policies.any(
+                retry_policies.provider_suggested(),
+                retry_policies.network_error(),
+                retry_policies.retry_after(),
+                retry_policies.http_status(TRANSIENT_STATUSES),
+            ),
+            _within_deadline,
+        ),
+    )
+
+
+def run_config() -> RunConfig:
+    """传给 Runner.run(run_config=...)：单次调用超时和重试设置，请求已降级时叠加降级设置
+
+    设置作用于本次运行中的所有智能体（包括 handoff 之后的智能体）。
+    """
+    config = usage_run_config() or RunConfig()
+    settings = ModelSettings(timeout=call_timeout(), retry=retry_settings())
+    config.model_settings = settings.resolve(config.model_settings)
+    return config
+
+
+# chat.completions：规划器和摘要
+
+def is_transient(error: BaseException) -> bool:
+    """超时、连接失败、限流和 5xx 视为瞬时错误，可以重试"""
+    if isinstance(error, (asyncio.TimeoutError, openai.APIConnectionError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in TRANSIENT_STATUSES
+    return False
+
+
+def backoff_delay(retry: int) -> float:
+    """第 retry 次重试（从 1 开始）前的等待时间：指数退避，在 [一半, 全部] 之间随机抖动"""
+    delay = min(LLM_RETRY_INITIAL_DELAY * 2 ** (retry - 1), LLM_RETRY_MAX_DELAY)
+    return random.uniform(delay / 2, delay)
+
+
+async def _hedged(call: Callable[[], Awaitable[T]], hedge_delay: float, timeout: float) -> T:
+    """先发一个请求，hedge_delay 秒后仍未返回时再发一个，返回先成功的结果并取消另一个"""
+    expires_at = time.monotonic() + timeout
+    primary = asyncio.ensure_future(call())
+    tasks = {primary}
+    winners = {primary: "primary"}
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=min(hedge_delay, timeout))
+        if not done:
+            hedge = asyncio.ensure_future(call())
+            tasks.add(hedge)
+            winners[hedge] = "hedge"
+        error: Optional[BaseException] = None
+        while tasks:
+            done, _ = await asyncio.wait(
+                tasks, timeout=max(expires_at - time.monotonic(), 0), return_when=asyncio.FIRST_COMPLETED
+            )
+            if not done:
+                raise asyncio.TimeoutError()
+            for task in done:
+                tasks.discard(task)
+                if task.exception() is None:
+                    if len(winners) > 1:
+                        LLM_HEDGES.inc((winners[task],))
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def call_with_retries(call: Callable[[], Awaitable[T]], hedge_delay: float = 0.0) -> T:
+    """执行一次模型调用：每次尝试受 call_timeout() 限制，瞬时错误按带抖动的指数退避重试
+
+    hedge_delay > 0 时开启对冲请求，只用于只读 / 幂等的调用（如任务规划）。
+    """
+    retry = 0
+    while True:
+        timeout = call_timeout()
+        try:
+            if hedge_delay > 0:
+                return await _hedged(call, hedge_delay, timeout)
+            return await asyncio.wait_for(call(), timeout)
+        except Exception as e:
+            retry += 1
+            if retry > LLM_MAX_RETRIES or not is_transient(e):
+                raise
+            delay = backoff_delay(retry)
+            left = remaining()
+            if left is not None and left - delay <= LLM_RETRY_MIN_REMAINING:
+                raise
+            LLM_RETRIES.inc((type(e).__name__,))
+            print(f"[WARNING] 模型调用失败，{delay:.2f} 秒后第 {retry} 次重试: {type(e).__name__}: {e}")
+            await asyncio.sleep(delay)
+
+
+# 错误 → HTTP 状态码
+
+def error_status(error: BaseException) -> Tuple[int, str]:
+    """错误对应的 HTTP 状态码和说明"""
+    if isinstance(error, DeadlineExceeded):
+        return 504, str(error)
+    if isinstance(error, (asyncio.TimeoutError, ModelTimeoutError, openai.APITimeoutError)):
+        return 504, "模型调用超时"
+    if isinstance(error, openai.RateLimitError):
+        return 503, "上游模型限流，请稍后重试"
+    if isinstance(error, openai.APIConnectionError):
+        return 502, "无法连接上游模型服务"
+    if isinstance(error, openai.APIStatusError):
+        return 502, f"上游模型服务返回错误（{error.status_code}）"
+    return 500, str(error)
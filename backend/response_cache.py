@@ -0,0 +1,325 @@
+"""智能体响应缓存（可选，RESPONSE_CACHE=1 开启）
+
+相同的请求（同一智能体、规范化后相同的输入、相同的会话历史）直接返回上次的结果，
+不再调用 Runner.run。缓存保存在 SQLite 中（按 TTL 和条目数上限淘汰），
+前面有一层进程内 LRU，命中时只需计算一次哈希和一次字典查找。
+
+缓存条目可以由任意房间命中：命中时把原运行写入会话的条目追加到当前房间的会话，
+并把原运行产生的世界状态事件重放到当前房间。条目记录产生它的房间，清空该房间时删除。模型输出本身不保证确定性，所以默认关闭。
+"""
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+from agent_systems.planner import normalize_description
+from session_compaction import CompactingSession
+from shared_state import STATE_SHARED
+from state_store import get_state_store
+
+# 是否启用响应缓存
+RESPONSE_CACHE = os.getenv("RESPONSE_CACHE", "0").lower() in ("1", "true", "yes")
+# 缓存有效期（秒）和 SQLite 中保留的最大条目数
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "10000"))
+# 进程内 LRU 的条目数
+RESPONSE_CACHE_MEMORY_ENTRIES = int(os.getenv("RESPONSE_CACHE_MEMORY_ENTRIES", "1024"))
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", "backend/data/response_cache.db")
+
+_EMPTY_HISTORY = hashlib.sha256(b"").hexdigest()
+
+
+def _dumps(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+
+
+def chain_fingerprint(fingerprint: str, items: List[Dict[str, Any]]) -> str:
+    """在历史指纹后追加条目：fp_n = sha256(fp_{n-1} + item_n)，追加新条目时不必重新读取整个历史"""
+    for item in items:
+        fingerprint = hashlib.sha256((fingerprint + _dumps(item)).encode("utf-8")).hexdigest()
+    return fingerprint
+
+
+def _raw_session(session):
+    """压缩会话读取完整历史（摘要由完整历史决定）"""
+    return session.session if isinstance(session, CompactingSession) else session
+
+
+class ResponseCache:
+    """SQLite 持久化 + 进程内 LRU 的响应缓存"""
+
+    def __init__(
+        self,
+        db_path: str = RESPONSE_CACHE_PATH,
+        enabled: Optional[bool] = None,
+        ttl: Optional[float] = None,
+        max_entries: Optional[int] = None,
+        memory_entries: Optional[int] = None,
+    ):
+        self.enabled = RESPONSE_CACHE if enabled is None else enabled
+        if self.enabled and STATE_SHARED:
+            # 历史指纹缓存在进程内，命中时截取的会话条目和世界状态事件也可能混入其他 worker 的运行，
+            # 多进程共享状态下无法保证缓存 key 与房间的真实历史一致
+            print("[WARNING] 共享状态模式（STATE_SHARED）下不使用响应缓存")
+            self.enabled = False
+        self.db_path = db_path
+        self.ttl = RESPONSE_CACHE_TTL if ttl is None else ttl
+        self.max_entries = max_entries or RESPONSE_CACHE_MAX_ENTRIES
+        self.memory_entries = RESPONSE_CACHE_MEMORY_ENTRIES if memory_entries is None else memory_entries
+        # key → (房间ID, 过期时间, 缓存值)
+        self._memory: "OrderedDict[str, Tuple[str, float, Dict[str, Any]]]" = OrderedDict()
+        # 房间ID → 会话历史指纹（由 run_cached 维护，其他路径写入会话后需调用 forget_history）
+        self._fingerprints: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        # SQLite 中的条目数（连接时统计一次，之后随写入和删除维护，写入时不必 COUNT(*)）
+        self._entries = 0
+        # 统计
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            with conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS response_cache ("
+                    "key TEXT PRIMARY KEY, room_id TEXT NOT NULL, value TEXT NOT NULL, "
+                    "expires_at REAL NOT NULL, last_used REAL NOT NULL)"
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_response_cache_room ON response_cache (room_id)")
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_response_cache_used ON response_cache (last_used)")
+            self._entries = conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0]
+            self._conn = conn
+        return self._conn
+
+    # 缓存 key
+
+    @staticmethod
+    def make_key(
+        kind: str,
+        agent_id: str,
+        text: str,
+        history: str,
+        options: Any = None,
+    ) -> str:
+        """kind（message/collaborative）+ 智能体ID + 规范化输入 + 会话历史指纹 + 其他影响结果的参数"""
+        key = [kind, agent_id, normalize_description(text), history, options]
+        return hashlib.sha256(_dumps(key).encode("utf-8")).hexdigest()
+
+    async def history_fingerprint(self, room_id: str, session) -> str:
+        """房间会话历史的指纹（缓存在内存中，首次使用时读取完整历史计算）"""
+        fingerprint = self._fingerprints.get(room_id)
+        if fingerprint is None:
+            items = await _raw_session(session).get_items()
+            fingerprint = chain_fingerprint(_EMPTY_HISTORY, items)
+            self._fingerprints[room_id] = fingerprint
+        return fingerprint
+
+    def forget_history(self, room_id: str) -> None:
+        """房间会话被缓存之外的运行修改后调用，下次重新计算指纹"""
+        self._fingerprints.pop(room_id, None)
+
+    # 读写
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        value = self.get_memory(key)
+        if value is None:
+            value = self.get_stored(key)
+        return value
+
+    def get_memory(self, key: str) -> Optional[Dict[str, Any]]:
+        """只查进程内 LRU（不访问数据库，可以在事件循环中调用）"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= now:
+                del self._memory[key]
+                return None
+            self._memory.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def get_stored(self, key: str) -> Optional[Dict[str, Any]]:
+        """查询 SQLite（阻塞，在事件循环中需放到线程池执行）"""
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT room_id, value, expires_at FROM response_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or row[2] <= now:
+                if row is not None:
+                    with conn:
+                        self._entries -= conn.execute("DELETE FROM response_cache WHERE key = ?", (key,)).rowcount
+                self.misses += 1
+                return None
+            # 内存层命中不更新 last_used，这里记录从数据库加载的时间，作为 LRU 淘汰依据
+            with conn:
+                conn.execute("UPDATE response_cache SET last_used = ? WHERE key = ?", (now, key))
+            value = json.loads(row[1])
+            self._remember(key, row[0], row[2], value)
+            self.hits += 1
+            return value
+
+    def put(self, key: str, room_id: str, value: Dict[str, Any]) -> None:
+        now = time.time()
+        expires_at = now + self.ttl
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                exists = conn.execute("SELECT 1 FROM response_cache WHERE key = ?", (key,)).fetchone()
+                conn.execute(
+                    "INSERT INTO response_cache (key, room_id, value, expires_at, last_used) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET room_id = excluded.room_id, value = excluded.value, "
+                    "expires_at = excluded.expires_at, last_used = excluded.last_used",
+                    (key, room_id, _dumps(value), expires_at, now)
+                )
+            if exists is None:
+                self._entries += 1
+            if self._entries > self.max_entries:
+                self._evict_locked(conn, now)
+            self._remember(key, room_id, expires_at, value)
+
+    def _remember(self, key: str, room_id: str, expires_at: float, value: Dict[str, Any]) -> None:
+        if self.memory_entries <= 0:
+            return
+        self._memory[key] = (room_id, expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict_locked(self, conn: sqlite3.Connection, now: float) -> None:
+        """超过条目上限时调用：先删除过期条目，仍然超过时删除最久未使用的条目"""
+        with conn:
+            evicted = conn.execute("DELETE FROM response_cache WHERE expires_at <= ?", (now,)).rowcount
+            self._entries -= evicted
+            overflow = self._entries - self.max_entries
+            if overflow > 0:
+                rows = conn.execute(
+                    "SELECT key FROM response_cache ORDER BY last_used LIMIT ?", (overflow,)
+                ).fetchall()
+                conn.executemany("DELETE FROM response_cache WHERE key = ?", rows)
+                for (key,) in rows:
+                    self._memory.pop(key, None)
+                evicted += len(rows)
+                self._entries -= len(rows)
+        self.evictions += evicted
+
+    def invalidate_room(self, room_id: str) -> int:
+        """删除由该房间产生的缓存条目（清空房间时调用），返回删除的条目数"""
+        self.forget_history(room_id)
+        with self._lock:
+            for key in [k for k, entry in self._memory.items() if entry[0] == room_id]:
+                del self._memory[key]
+            if self._conn is None and not os.path.exists(self.db_path):
+                return 0
+            conn = self._connect()
+            with conn:
+                deleted = conn.execute("DELETE FROM response_cache WHERE room_id = ?", (room_id,)).rowcount
+            self._entries -= deleted
+            return deleted
+
+    # 带缓存的运行
+
+    @contextmanager
+    def capture_events(self, room_id: str) -> Iterator[List[List[Dict[str, Any]]]]:
+        """收集 with 块内该房间应用的世界状态事件（每次 apply_events 一批）"""
+        batches: List[List[Dict[str, Any]]] = []
+
+        def listener(changed_room: str, delta: Dict[str, Any]) -> None:
+            if changed_room == room_id:
+                batches.append(delta["events"])
+
+        store = get_state_store()
+        store.subscribe(listener)
+        try:
+            yield batches
+        finally:
+            store.unsubscribe(listener)
+
+    async def run_cached(
+        self,
+        room_id: str,
+        session,
+        kind: str,
+        agent_id: str,
+        text: str,
+        run: Callable[[], Awaitable[Dict[str, Any]]],
+        options: Any = None,
+    ) -> Tuple[Dict[str, Any], bool]:
+        """命中时重放会话条目和世界状态事件并返回缓存结果，否则运行 run() 并写入缓存
+
+        run() 的返回值必须可以 JSON 序列化。需要在房间的执行队列中调用（运行期间会话不被其他请求修改）。
+        返回 (结果, 是否命中)。
+        """
+        if not self.enabled:
+            return await run(), False
+
+        history = await self.history_fingerprint(room_id, session)
+        store = get_state_store()
+        key = self.make_key(kind, agent_id, text, history, options)
+        cached = self.get_memory(key)
+        if cached is None:
+            cached = await asyncio.to_thread(self.get_stored, key)
+        if cached is not None:
+            if cached["items"]:
+                await session.add_items(cached["items"])
+            # 事件重放到当前房间（条目可能由其他房间产生）
+            for events in cached["events"]:
+                store.apply_events(room_id, events)
+            self._fingerprints[room_id] = chain_fingerprint(history, cached["items"])
+            return cached["value"], True
+
+        raw = _raw_session(session)
+        before = len(await raw.get_items())
+        try:
+            with self.capture_events(room_id) as events:
+                value = await run()
+        except BaseException:
+            self.forget_history(room_id)
+            raise
+        items = (await raw.get_items())[before:]
+        await asyncio.to_thread(self.put, key, room_id, {"value": value, "items": items, "events": events})
+        self._fingerprints[room_id] = chain_fingerprint(history, items)
+        return value, False
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "entries": self._entries,
+                "memory_entries": len(self._memory),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+# 全局单例
+_response_cache: Optional[ResponseCache] = None
+
+def get_response_cache() -> ResponseCache:
+    """获取全局响应缓存"""
+    global _response_cache
+    if _response_cache is None:
+        _response_cache = ResponseCache()
+    return _response_cache
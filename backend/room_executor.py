@@ -0,0 +1,179 @@
+"""按房间串行执行：每个房间一个执行队列（actor），不同房间完全并行
+
+同一房间的智能体运行共享会话历史和世界状态，必须依次执行；
+每个房间有自己的任务队列和工作协程，队列空闲后自动回收。
+
+合并模式（ROOM_COALESCE_MESSAGES）：房间忙碌时排队的多条消息，如果目标智能体相同，
+会合并成一次运行，所有请求得到同一个结果。
+"""
+import asyncio
+import contextvars
+import os
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional
+
+# 是否合并同一房间排队中的连续消息
+ROOM_COALESCE_MESSAGES = os.getenv("ROOM_COALESCE_MESSAGES", "0").lower() in ("1", "true", "yes")
+
+
+class _Job:
+    __slots__ = ("fn", "inputs", "coalesce_key", "future", "started", "task", "waiters", "context")
+
+    def __init__(self, fn: Callable[[List[Any]], Awaitable[Any]], inputs: List[Any], coalesce_key: Any = None):
+        self.fn = fn
+        self.inputs = inputs
+        # 可以合并的任务标识，None 表示不合并
+        self.coalesce_key = coalesce_key
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.started = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.waiters = 1
+        # 提交者的上下文（请求追踪等 contextvars），任务在该上下文中运行
+        self.context = contextvars.copy_context()
+
+
+class _RoomActor:
+    __slots__ = ("room_id", "jobs", "running", "worker")
+
+    def __init__(self, room_id: str):
+        self.room_id = room_id
+        self.jobs: Deque[_Job] = deque()
+        self.running: Optional[_Job] = None
+        self.worker: Optional[asyncio.Task] = None
+
+
+class RoomExecutor:
+    """按房间串行、跨房间并行地执行协程"""
+
+    def __init__(self, coalesce: Optional[bool] = None):
+        self.coalesce = ROOM_COALESCE_MESSAGES if coalesce is None else coalesce
+        self._actors: Dict[str, _RoomActor] = {}
+        # 统计
+        self.processed = 0
+        self.coalesced = 0
+
+    def _submit(self, room_id: str, job: _Job) -> None:
+        actor = self._actors.get(room_id)
+        if actor is None:
+            actor = self._actors[room_id] = _RoomActor(room_id)
+        actor.jobs.append(job)
+        if actor.worker is None:
+            actor.worker = asyncio.create_task(self._work(actor))
+
+    async def _work(self, actor: _RoomActor) -> None:
+        try:
+            while actor.jobs:
+                job = actor.jobs.popleft()
+                if job.future.done():
+                    # 等待者已全部取消
+                    continue
+                actor.running = job
+                job.task = asyncio.create_task(job.fn(job.inputs), context=job.context)
+                job.started.set()
+                await asyncio.wait({job.task})
+                if not job.future.done():
+                    if job.task.cancelled():
+                        job.future.cancel()
+                    elif job.task.exception() is not None:
+                        job.future.set_exception(job.task.exception())
+                    else:
+                        job.future.set_result(job.task.result())
+                actor.running = None
+                self.processed += 1
+        finally:
+            actor.running = None
+            actor.worker = None
+            if not actor.jobs and self._actors.get(actor.room_id) is actor:
+                del self._actors[actor.room_id]
+
+    async def _wait(self, job: _Job) -> Any:
+        try:
+            return await asyncio.shield(job.future)
+        except asyncio.CancelledError:
+            job.waiters -= 1
+            if job.waiters == 0:
+                if job.task is not None:
+                    job.task.cancel()
+                elif not job.future.done():
+                    job.future.cancel()
+            raise
+
+    async def run(self, room_id: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """排队执行 fn()，等待其结果"""
+        job = _Job(lambda _: fn(), [])
+        self._submit(room_id, job)
+        return await self._wait(job)
+
+    async def run_coalesced(
+        self,
+        room_id: str,
+        key: Any,
+        item: Any,
+        fn: Callable[[List[Any]], Awaitable[Any]],
+    ) -> Any:
+        """排队执行 fn([item])；合并模式下，与队尾尚未开始、key 相同的任务合并为 fn([item1, item2, ...])"""
+        if self.coalesce:
+            actor = self._actors.get(room_id)
+            if actor is not None and actor.jobs:
+                tail = actor.jobs[-1]
+                if tail.coalesce_key == key and not tail.started.is_set() and not tail.future.done():
+                    tail.inputs.append(item)
+                    tail.waiters += 1
+                    self.coalesced += 1
+                    return await self._wait(tail)
+
+        job = _Job(fn, [item], coalesce_key=key)
+        self._submit(room_id, job)
+        return await self._wait(job)
+
+    @asynccontextmanager
+    async def exclusive(self, room_id: str) -> AsyncIterator[None]:
+        """在 async with 块内独占房间（用于流式响应等持续时间不确定的运行）"""
+        released = asyncio.Event()
+
+        async def hold(_):
+            await released.wait()
+
+        job = _Job(hold, [])
+        self._submit(room_id, job)
+        try:
+            await job.started.wait()
+        except asyncio.CancelledError:
+            job.future.cancel()
+            released.set()
+            raise
+        try:
+            yield
+        finally:
+            released.set()
+
+    def depth(self, room_id: str) -> Dict[str, Any]:
+        """房间的排队情况：等待中的任务数和是否正在执行"""
+        actor = self._actors.get(room_id)
+        if actor is None:
+            return {"queued": 0, "running": False}
+        queued = sum(1 for job in actor.jobs if not job.future.done())
+        return {"queued": queued, "running": actor.running is not None}
+
+    def stats(self) -> Dict[str, Any]:
+        rooms = {room_id: self.depth(room_id) for room_id in self._actors}
+        return {
+            "active_rooms": len(rooms),
+            "queued": sum(room["queued"] for room in rooms.values()),
+            "max_room_queue": max((room["queued"] for room in rooms.values()), default=0),
+            "processed": self.processed,
+            "coalesced": self.coalesced,
+            "coalesce": self.coalesce,
+        }
+
+
+# 全局单例
+_room_executor: Optional[RoomExecutor] = None
+
+def get_room_executor() -> RoomExecutor:
+    """获取全局房间执行器"""
+    global _room_executor
+    if _room_executor is None:
+        _room_executor = RoomExecutor()
+    return _room_executor
@@ -0,0 +1,225 @@
+"""会话历史压缩：较早的对话折叠成滚动摘要，只把摘要 + 最近的对话发给模型
+
+完整历史仍然保存在原会话中；摘要和已折叠的条目数保存在同一个数据库的
+session_summaries 表中，重启后继续生效。多个进程共用会话数据库时（cache_state=False）
+每次读取都从数据库获取摘要状态。
+"""
+import asyncio
+import inspect
+import os
+import sqlite3
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from agents.memory import SQLiteSession
+from agents.memory.session import SessionABC
+
+from metrics import span
+
+# 是否启用历史压缩（默认关闭：摘要策略为 summarize 时会额外调用模型）
+SESSION_COMPACTION = os.getenv("SESSION_COMPACTION", "0").lower() in ("1", "true", "yes")
+# 未折叠的历史超过该 token 数时触发折叠
+SESSION_COMPACT_THRESHOLD = int(os.getenv("SESSION_COMPACT_THRESHOLD", "3000"))
+# 始终原样保留的最近条目数
+SESSION_KEEP_ITEMS = int(os.getenv("SESSION_KEEP_ITEMS", "10"))
+# 滚动摘要的 token 上限和压缩策略（见 agent_systems.context.COMPACTION_STRATEGIES）
+SESSION_SUMMARY_TOKENS = int(os.getenv("SESSION_SUMMARY_TOKENS", "500"))
+SESSION_SUMMARY_STRATEGY = os.getenv("SESSION_SUMMARY_STRATEGY", "extractive")
+
+SUMMARY_PREFIX = "以下是本房间较早对话的摘要：\n"
+
+
+def item_text(item: Dict[str, Any]) -> str:
+    """把一个会话条目转换为用于估算和摘要的纯文本"""
+    item_type = item.get("type")
+    if item_type == "function_call":
+        return f"调用工具 {item.get('name')}({item.get('arguments', '')})"
+    if item_type == "function_call_output":
+        return f"工具结果: {item.get('output', '')}"
+
+    content = item.get("content", "")
+    if isinstance(content, list):
+        content = " ".join(
+            part.get("text", "") for part in content if isinstance(part, dict)
+        )
+    role = item.get("role")
+    return f"{role}: {content}" if role else str(content)
+
+
+def _estimate_tokens(text: str) -> int:
+    from agent_systems.context import estimate_tokens
+    return estimate_tokens(text)
+
+
+class CompactingSession(SessionABC):
+    """在任意会话外层提供滚动摘要
+
+    - get_items()：返回 [摘要] + 未折叠的条目
+    - add_items()：写入原会话后，如果未折叠条目（最近 keep_items 条除外）超过阈值，
+      把它们连同旧摘要一起压缩成新的摘要
+    """
+
+    def __init__(
+        self,
+        session: SQLiteSession,
+        threshold_tokens: Optional[int] = None,
+        keep_items: Optional[int] = None,
+        summary_tokens: Optional[int] = None,
+        strategy: Optional[str] = None,
+        cache_state: bool = True,
+    ):
+        self.session = session
+        self.session_id = session.session_id
+        self.session_settings = session.session_settings
+        self.threshold_tokens = threshold_tokens or SESSION_COMPACT_THRESHOLD
+        self.keep_items = SESSION_KEEP_ITEMS if keep_items is None else keep_items
+        self.summary_tokens = summary_tokens or SESSION_SUMMARY_TOKENS
+        self.strategy = strategy or SESSION_SUMMARY_STRATEGY
+        self.db_path = str(session.db_path)
+        self._lock = asyncio.Lock()
+        # 摘要状态的进程内缓存；其他进程也会折叠同一个会话时关闭
+        self.cache_state = cache_state
+        self._state: Optional[Tuple[str, int]] = None
+        # 最近一次 get_items 的 token 统计
+        self._stats: Dict[str, int] = {}
+
+    # 摘要持久化
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS session_summaries ("
+            "session_id TEXT PRIMARY KEY, summary TEXT NOT NULL, folded INTEGER NOT NULL, updated_at TEXT)"
+        )
+        return conn
+
+    def _read_state_sync(self) -> Tuple[str, int]:
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT summary, folded FROM session_summaries WHERE session_id = ?", (self.session_id,)
+            ).fetchone()
+        finally:
+            conn.close()
+        return (row[0], row[1]) if row else ("", 0)
+
+    def _write_state_sync(self, summary: str, folded: int) -> None:
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT INTO session_summaries (session_id, summary, folded, updated_at) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(session_id) DO UPDATE SET summary = excluded.summary, "
+                    "folded = excluded.folded, updated_at = excluded.updated_at",
+                    (self.session_id, summary, folded, datetime.now().isoformat())
+                )
+        finally:
+            conn.close()
+
+    def _delete_state_sync(self) -> None:
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("DELETE FROM session_summaries WHERE session_id = ?", (self.session_id,))
+        finally:
+            conn.close()
+
+    async def _get_state(self) -> Tuple[str, int]:
+        if self._state is None or not self.cache_state:
+            self._state = await asyncio.to_thread(self._read_state_sync)
+        return self._state
+
+    async def _set_state(self, summary: str, folded: int) -> None:
+        await asyncio.to_thread(self._write_state_sync, summary, folded)
+        self._state = (summary, folded)
+
+    # Session 接口
+
+    async def get_items(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        items = await self.session.get_items()
+        summary, folded = await self._get_state()
+        folded = min(folded, len(items))
+        visible = list(items[folded:])
+        if summary:
+            visible.insert(0, {"role": "system", "content": SUMMARY_PREFIX + summary})
+
+        full_tokens = sum(_estimate_tokens(item_text(item)) for item in items)
+        sent_tokens = sum(_estimate_tokens(item_text(item)) for item in visible)
+        self._stats = {
+            "items": len(items),
+            "folded_items": folded,
+            "summary_tokens": _estimate_tokens(summary),
+            "full_tokens": full_tokens,
+            "sent_tokens": sent_tokens,
+            "tokens_saved": max(full_tokens - sent_tokens, 0),
+        }
+
+        if limit is not None:
+            visible = visible[-limit:] if limit > 0 else []
+        return visible
+
+    async def add_items(self, items: List[Dict[str, Any]]) -> None:
+        await self.session.add_items(items)
+        await self.compact()
+
+    async def pop_item(self) -> Optional[Dict[str, Any]]:
+        item = await self.session.pop_item()
+        summary, folded = await self._get_state()
+        if folded > 0:
+            remaining = len(await self.session.get_items())
+            if folded > remaining:
+                await self._set_state(summary, remaining)
+        return item
+
+    async def clear_session(self) -> None:
+        await self.session.clear_session()
+        await asyncio.to_thread(self._delete_state_sync)
+        self._state = ("", 0)
+        self._stats = {}
+
+    def close(self) -> None:
+        self.session.close()
+
+    # 压缩
+
+    def _fold_boundary(self, items: List[Dict[str, Any]], folded: int) -> int:
+        """选择折叠位置：保留最近 keep_items 条，并从用户消息处切分（不拆开工具调用和结果）
+
+        未折叠部分中最近 keep_items 条之前没有用户消息时不折叠。
+        """
+        target = len(items) - self.keep_items
+        if target <= folded:
+            return folded
+        for i in range(target, folded, -1):
+            if items[i].get("role") == "user":
+                return i
+        return folded
+
+    async def compact(self, force: bool = False) -> bool:
+        """未折叠的较早条目超过阈值时，折叠进滚动摘要，返回是否发生了折叠"""
+        with span("session.compact"):
+            return await self._compact(force)
+
+    async def _compact(self, force: bool) -> bool:
+        async with self._lock:
+            items = await self.session.get_items()
+            summary, folded = await self._get_state()
+            boundary = self._fold_boundary(items, folded)
+            if boundary <= folded:
+                return False
+
+            older = "\n".join(item_text(item) for item in items[folded:boundary])
+            if not force and _estimate_tokens(summary) + _estimate_tokens(older) < self.threshold_tokens:
+                return False
+
+            from agent_systems.context import COMPACTION_STRATEGIES
+            text = f"{summary}\n{older}" if summary else older
+            new_summary = COMPACTION_STRATEGIES[self.strategy](text, self.summary_tokens)
+            if inspect.isawaitable(new_summary):
+                new_summary = await new_summary
+            await self._set_state(new_summary, boundary)
+            return True
+
+    def stats(self) -> Dict[str, int]:
+        """最近一次读取历史时的 token 统计（完整历史 vs 实际发送）"""
+        return dict(self._stats)
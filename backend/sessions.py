@@ -1,29 +1,224 @@
 """会话管理模块"""
 from agents.memory import SQLiteSession
-from typing import Optional
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Union
 import os
+import threading
+import time
+
+from metrics import span
+from session_compaction import SESSION_COMPACTION, CompactingSession
+from shared_state import STATE_SHARED
 
 # 会话存储目录
 SESSION_DB_DIR = "backend/data/sessions"
 os.makedirs(SESSION_DB_DIR, exist_ok=True)
 
-# 全局会话缓存
-_sessions: dict[str, SQLiteSession] = {}
+# 同时打开的会话数上限，以及会话空闲多久（秒）后关闭
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "256"))
+SESSION_IDLE_TTL = float(os.getenv("SESSION_IDLE_TTL", "1800"))
+# 共享数据库模式：所有房间的会话保存在同一个 SQLite 数据库中（按 session_id 区分）
+# 多进程共享状态（STATE_SHARED=1）时默认开启：清空房间只删除记录，不删除其他进程正在使用的数据库文件
+SESSION_SHARED_DB = os.getenv("SESSION_SHARED_DB", "1" if STATE_SHARED else "0").lower() in ("1", "true", "yes")
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", os.path.join(SESSION_DB_DIR, "sessions.db"))
+
+# 房间会话：启用历史压缩时为 CompactingSession
+RoomSession = Union[SQLiteSession, CompactingSession]
+
+
+class TimedSQLiteSession(SQLiteSession):
+    """记录会话读写耗时（session.read / session.write 指标）"""
+
+    async def get_items(self, limit: Optional[int] = None):
+        with span("session.read"):
+            return await super().get_items(limit)
+
+    async def add_items(self, items) -> None:
+        with span("session.write"):
+            await super().add_items(items)
+
+
+class _Entry:
+    __slots__ = ("room_id", "session", "last_used", "leases", "evicted")
+
+    def __init__(self, room_id: str, session: RoomSession):
+        self.room_id = room_id
+        self.session = session
+        self.last_used = time.monotonic()
+        # 正在使用该会话的请求数，大于 0 时不会被关闭
+        self.leases = 0
+        self.evicted = False
+
+
+class SessionManager:
+    """按 LRU + 空闲时间淘汰的会话缓存
+
+    超过 max_sessions 或空闲超过 idle_ttl 的会话会被关闭（释放连接和文件句柄），
+    下次访问时重新打开，历史记录保存在数据库中不会丢失。
+    通过 lease() 使用的会话在使用期间不会被关闭，使用结束后再按需淘汰。
+    compaction 为 True 时会话外层包一层 CompactingSession（滚动摘要）。
+    历史记录每次都从数据库读取，多个进程可以同时使用同一个房间的会话；
+    multi_process 为 True 时滚动摘要的状态也不在进程内缓存。
+    """
+
+    def __init__(
+        self,
+        max_sessions: Optional[int] = None,
+        idle_ttl: Optional[float] = None,
+        shared_db: Optional[bool] = None,
+        db_dir: str = SESSION_DB_DIR,
+        db_path: Optional[str] = None,
+        compaction: Optional[bool] = None,
+        multi_process: Optional[bool] = None,
+    ):
+        self.max_sessions = max_sessions or SESSION_CACHE_SIZE
+        self.idle_ttl = SESSION_IDLE_TTL if idle_ttl is None else idle_ttl
+        self.shared_db = SESSION_SHARED_DB if shared_db is None else shared_db
+        self.db_dir = db_dir
+        self.db_path = db_path or SESSION_DB_PATH
+        self.compaction = SESSION_COMPACTION if compaction is None else compaction
+        self.multi_process = STATE_SHARED if multi_process is None else multi_process
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+        # 统计
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _room_db_path(self, room_id: str) -> str:
+        if self.shared_db:
+            return self.db_path
+        return os.path.join(self.db_dir, f"{room_id}.db")
+    
+    def _open(self, room_id: str) -> RoomSession:
+        session = TimedSQLiteSession(room_id, self._room_db_path(room_id))
+        if self.compaction:
+            return CompactingSession(session, cache_state=not self.multi_process)
+        return session
 
-def get_session(room_id: str) -> SQLiteSession:
+    def _acquire(self, room_id: str, lease: bool) -> _Entry:
+        to_close = []
+        with self._lock:
+            entry = self._entries.get(room_id)
+            if entry is None:
+                self.misses += 1
+                entry = _Entry(room_id, self._open(room_id))
+                self._entries[room_id] = entry
+            else:
+                self.hits += 1
+                self._entries.move_to_end(room_id)
+            entry.last_used = time.monotonic()
+            if lease:
+                entry.leases += 1
+            to_close = self._evict_locked()
+        for evicted in to_close:
+            evicted.session.close()
+        return entry
+
+    def _evict_locked(self) -> list:
+        """淘汰空闲超时的会话和超出上限的最久未使用会话（跳过正在使用的），返回需要关闭的条目"""
+        now = time.monotonic()
+        overflow = len(self._entries) - self.max_sessions
+        evicted = []
+        for room_id, entry in list(self._entries.items()):
+            expired = self.idle_ttl > 0 and now - entry.last_used > self.idle_ttl
+            if not expired and overflow <= 0:
+                break
+            if entry.leases > 0:
+                continue
+            del self._entries[room_id]
+            entry.evicted = True
+            evicted.append(entry)
+            overflow -= 1
+        self.evictions += len(evicted)
+        return evicted
+
+    def _release(self, entry: _Entry) -> None:
+        with self._lock:
+            entry.leases -= 1
+            entry.last_used = time.monotonic()
+            if not entry.evicted:
+                self._entries.move_to_end(entry.room_id)
+            close = entry.evicted and entry.leases == 0
+            to_close = [] if close else self._evict_locked()
+        if close:
+            entry.session.close()
+        for evicted in to_close:
+            evicted.session.close()
+
+    def get(self, room_id: str) -> RoomSession:
+        """获取或创建指定房间的会话"""
+        return self._acquire(room_id, lease=False).session
+
+    @contextmanager
+    def lease(self, room_id: str) -> Iterator[RoomSession]:
+        """在 with 块内使用房间会话，期间不会被淘汰关闭"""
+        entry = self._acquire(room_id, lease=True)
+        try:
+            yield entry.session
+        finally:
+            self._release(entry)
+
+    async def clear(self, room_id: str) -> None:
+        """清空指定房间的会话历史"""
+        with self._lock:
+            entry = self._entries.pop(room_id, None)
+            if entry is not None:
+                entry.evicted = True
+
+        if self.shared_db:
+            session = entry.session if entry is not None else self._open(room_id)
+            await session.clear_session()
+            if entry is None:
+                session.close()
+
+        if entry is not None and entry.leases == 0:
+            entry.session.close()
+
+        if not self.shared_db:
+            db_path = self._room_db_path(room_id)
+            for path in (db_path, db_path + "-wal", db_path + "-shm"):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def close(self) -> None:
+        """关闭所有会话"""
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+        for entry in entries:
+            entry.session.close()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "open_sessions": len(self._entries),
+                "leased_sessions": sum(1 for e in self._entries.values() if e.leases > 0),
+                "max_sessions": self.max_sessions,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+# 全局会话管理器
+_session_manager: Optional[SessionManager] = None
+
+def get_session_manager() -> SessionManager:
+    """获取全局会话管理器"""
+    global _session_manager
+    if _session_manager is None:
+        _session_manager = SessionManager()
+    return _session_manager
+
+def get_session(room_id: str) -> RoomSession:
     """获取或创建指定房间的会话"""
-    if room_id not in _sessions:
-        db_path = os.path.join(SESSION_DB_DIR, f"{room_id}.db")
-        _sessions[room_id] = SQLiteSession(room_id, db_path)
-    return _sessions[room_id]
+    return get_session_manager().get(room_id)
+
+def session_scope(room_id: str):
+    """在 with 块内使用房间会话（运行智能体期间使用，避免会话被淘汰关闭）"""
+    return get_session_manager().lease(room_id)
 
-def clear_session(room_id: str) -> None:
+async def clear_session(room_id: str) -> None:
     """清空指定房间的会话"""
-    if room_id in _sessions:
-        session = _sessions[room_id]
-        # 注意：SQLiteSession 可能没有 clear_session 方法，这里先删除缓存
-        del _sessions[room_id]
-        # 也可以删除数据库文件
-        db_path = os.path.join(SESSION_DB_DIR, f"{room_id}.db")
-        if os.path.exists(db_path):
-            os.remove(db_path)
+    await get_session_manager().clear(room_id)
@@ -0,0 +1,203 @@
+"""多进程共享的世界状态（STATE_SHARED=1）
+
+多个 worker 进程（uvicorn --workers N）服务同一批房间时，每个进程内存中的状态只是缓存，
+权威状态保存在同一个 SQLite 数据库（WAL 模式）中：
+- shared_worlds：每个房间的状态和版本号，版本号单调递增（清空房间也会加一）
+- world_changes：每次变更的增量，供其他进程读取
+
+写入时先用 BEGIN IMMEDIATE 取得跨进程的写锁，内存中的版本落后时先从数据库重新加载，
+应用事件后按版本号条件更新（compare-and-set），不会覆盖其他进程的更新。
+读取时先比较数据库中的版本号，落后时重新加载，不会读到其他进程已经覆盖的旧状态。
+StateStore 的同步线程每 STATE_SYNC_INTERVAL 秒读取其他进程的变更，刷新内存并通知监听器
+（从而推送给连接在本进程的 WebSocket 客户端）。
+"""
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# 是否启用多进程共享状态
+STATE_SHARED = os.getenv("STATE_SHARED", "0").lower() in ("1", "true", "yes")
+# 共享状态数据库，默认为存储目录下的 shared_state.db
+STATE_SHARED_DB_PATH = os.getenv("STATE_SHARED_DB_PATH")
+# 读取其他进程变更的间隔（秒）
+STATE_SYNC_INTERVAL = float(os.getenv("STATE_SYNC_INTERVAL", "0.1"))
+# 变更记录保留时间（秒）
+STATE_CHANGE_RETENTION = float(os.getenv("STATE_CHANGE_RETENTION", "600"))
+
+
+class StateVersionConflict(Exception):
+    """按版本号条件更新失败：数据库中的版本已被其他进程修改"""
+
+    def __init__(self, room_id: str, expected: int):
+        super().__init__(f"房间 {room_id} 的状态版本已变化（期望 {expected}）")
+        self.room_id = room_id
+        self.expected = expected
+
+
+class SharedWorldStore:
+    """带版本号的房间状态 + 变更记录，所有进程共用一个 SQLite 数据库
+
+    每个线程使用自己的连接（autocommit 模式，事务由 locked() 显式控制）。
+    """
+
+    def __init__(self, db_path: str, retention: Optional[float] = None, timeout: float = 30.0):
+        self.db_path = db_path
+        self.retention = STATE_CHANGE_RETENTION if retention is None else retention
+        self.timeout = timeout
+        # 本进程写入的变更带有 origin，同步时跳过自己的变更
+        self.origin = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS shared_worlds ("
+            "room_id TEXT PRIMARY KEY, version INTEGER NOT NULL, data TEXT, updated_at TEXT)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS world_changes ("
+            "seq INTEGER PRIMARY KEY AUTOINCREMENT, room_id TEXT NOT NULL, version INTEGER NOT NULL, "
+            "origin TEXT NOT NULL, delta TEXT, created_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_world_changes_created ON world_changes (created_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        """当前线程的连接（首次使用时创建）"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.db_path, timeout=self.timeout, isolation_level=None, check_same_thread=False
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    @contextmanager
+    def locked(self) -> Iterator[None]:
+        """with 块内持有跨进程的写锁（BEGIN IMMEDIATE），正常退出时提交，出错时回滚
+
+        已在事务中时直接复用外层事务。
+        """
+        conn = self._connect()
+        if conn.in_transaction:
+            yield
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+
+    def version(self, room_id: str) -> Optional[int]:
+        """房间在数据库中的版本号，没有记录时为 None"""
+        row = self._connect().execute(
+            "SELECT version FROM shared_worlds WHERE room_id = ?", (room_id,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def load(self, room_id: str) -> Optional[Tuple[int, Dict[str, Any]]]:
+        """房间的 (版本号, 状态)，不存在或已清空时为 None"""
+        row = self._connect().execute(
+            "SELECT version, data FROM shared_worlds WHERE room_id = ?", (room_id,)
+        ).fetchone()
+        if row is None or row[1] is None:
+            return None
+        return row[0], json.loads(row[1])
+
+    def create(self, room_id: str, data: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        """房间不存在（或已清空）时写入初始状态，返回数据库中的 (版本号, 状态)
+
+        其他进程同时创建时以先写入的为准。
+        """
+        with self.locked():
+            self._connect().execute(
+                "INSERT INTO shared_worlds (room_id, version, data, updated_at) VALUES (?, 0, ?, ?) "
+                "ON CONFLICT(room_id) DO UPDATE SET data = excluded.data, version = shared_worlds.version + 1, "
+                "updated_at = excluded.updated_at WHERE shared_worlds.data IS NULL",
+                (room_id, json.dumps(data, ensure_ascii=False, separators=(",", ":")), datetime.now().isoformat())
+            )
+            return self.load(room_id)
+
+    def save(self, room_id: str, base_version: int, data: Dict[str, Any], delta: Dict[str, Any]) -> None:
+        """把 base_version 的状态更新为 delta["version"]，并记录增量（需要在 locked() 内调用）"""
+        conn = self._connect()
+        cursor = conn.execute(
+            "UPDATE shared_worlds SET version = ?, data = ?, updated_at = ? WHERE room_id = ? AND version = ?",
+            (
+                delta["version"],
+                json.dumps(data, ensure_ascii=False, separators=(",", ":")),
+                datetime.now().isoformat(),
+                room_id,
+                base_version,
+            )
+        )
+        if cursor.rowcount == 0:
+            raise StateVersionConflict(room_id, base_version)
+        self._record_change(room_id, delta["version"], delta)
+
+    def clear(self, room_id: str) -> Optional[int]:
+        """清空房间（保留版本号并加一），返回新的版本号，房间不存在时为 None"""
+        with self.locked():
+            conn = self._connect()
+            conn.execute(
+                "UPDATE shared_worlds SET data = NULL, version = version + 1, updated_at = ? WHERE room_id = ?",
+                (datetime.now().isoformat(), room_id)
+            )
+            version = self.version(room_id)
+            if version is not None:
+                self._record_change(room_id, version, None)
+        return version
+
+    def _record_change(self, room_id: str, version: int, delta: Optional[Dict[str, Any]]) -> None:
+        self._connect().execute(
+            "INSERT INTO world_changes (room_id, version, origin, delta, created_at) VALUES (?, ?, ?, ?, ?)",
+            (
+                room_id,
+                version,
+                self.origin,
+                json.dumps(delta, ensure_ascii=False, separators=(",", ":")) if delta is not None else None,
+                time.time(),
+            )
+        )
+
+    def last_seq(self) -> int:
+        row = self._connect().execute("SELECT MAX(seq) FROM world_changes").fetchone()
+        return row[0] or 0
+
+    def changes(self, after_seq: int) -> Tuple[int, List[Tuple[str, int, Optional[Dict[str, Any]]]]]:
+        """after_seq 之后的变更，返回 (最新序号, 其他进程的变更 [(room_id, version, 增量或 None（清空）)])"""
+        rows = self._connect().execute(
+            "SELECT seq, room_id, version, origin, delta FROM world_changes WHERE seq > ? ORDER BY seq",
+            (after_seq,)
+        ).fetchall()
+        last_seq = rows[-1][0] if rows else after_seq
+        return last_seq, [
+            (room_id, version, json.loads(delta) if delta is not None else None)
+            for _, room_id, version, origin, delta in rows
+            if origin != self.origin
+        ]
+
+    def prune(self) -> None:
+        """删除超过保留时间的变更记录"""
+        self._connect().execute(
+            "DELETE FROM world_changes WHERE created_at < ?", (time.time() - self.retention,)
+        )
+
+    def close(self) -> None:
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
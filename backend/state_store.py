@@ -1,235 +1,570 @@
 """世界状态存储管理"""
-from typing import Dict, List, Optional, Any
+from typing import Callable, Dict, List, Optional, Any, Set, Tuple, Union
+import asyncio
+import atexit
 import json
 import os
+import sqlite3
+import threading
+import time
 from datetime import datetime
 from dotenv import load_dotenv
 
+from metrics import span
+from shared_state import STATE_SHARED, STATE_SHARED_DB_PATH, STATE_SYNC_INTERVAL, SharedWorldStore
+from storage_backends import StorageBackend, create_storage_backend, save_json_atomic
+from supabase_backend import FAKE_SUPABASE_URL_PREFIX, SupabaseBackend
+from world_model import WorldState, apply_event
+
 load_dotenv()
 
+# 写回（write-behind）模式：状态变更只标记为脏，由后台线程按间隔合并写入
+STATE_WRITE_BEHIND = os.getenv("STATE_WRITE_BEHIND", "0").lower() in ("1", "true", "yes")
+STATE_FLUSH_INTERVAL = float(os.getenv("STATE_FLUSH_INTERVAL", "0.5"))
+
+# 事件日志模式：事件追加写入每个房间的日志，每 N 个事件压缩成一次快照
+STATE_EVENT_LOG = os.getenv("STATE_EVENT_LOG", "0").lower() in ("1", "true", "yes")
+STATE_SNAPSHOT_EVERY = int(os.getenv("STATE_SNAPSHOT_EVERY", "100"))
+
 # 尝试导入 supabase
 try:
-    from supabase import create_client, Client
+    import supabase
     SUPABASE_AVAILABLE = True
 except ImportError:
     SUPABASE_AVAILABLE = False
 
+# 多进程共享状态模式下清理过期变更记录的间隔（秒）
+STATE_PRUNE_INTERVAL = 60.0
+
+# 状态变化监听器：(room_id, delta) → None，在持有锁时同步调用，必须快速返回且不能阻塞
+# 共享状态模式下其他进程的变更由同步线程通知
+StateListener = Callable[[str, Dict[str, Any]], None]
+
 class StateStore:
     """管理虚拟城市的世界状态（智能体的位置、情绪、任务等）"""
     
-    def __init__(self, storage_path: str = "backend/data"):
+    def __init__(
+        self,
+        storage_path: str = "backend/data",
+        write_behind: Optional[bool] = None,
+        flush_interval: Optional[float] = None,
+        event_log: Optional[bool] = None,
+        snapshot_every: Optional[int] = None,
+        storage: Optional[Union[str, StorageBackend]] = None,
+        shared: Optional[bool] = None,
+        sync_interval: Optional[float] = None,
+    ):
         self.storage_path = storage_path
         os.makedirs(storage_path, exist_ok=True)
-        # 内存中的状态：{room_id: {agents: [...], environment: {...}}}
-        self._memory: Dict[str, Dict[str, Any]] = {}
+        # 本地存储后端（json / sqlite，默认由 STATE_STORAGE_BACKEND 决定），也是 Supabase 的降级存储
+        if isinstance(storage, StorageBackend):
+            self.storage = storage
+        else:
+            self.storage = create_storage_backend(storage, storage_path)
+        # 内存中的状态：{room_id: WorldState}，对外通过 to_dict() 提供 {agents: [...], environment: {...}}
+        self._memory: Dict[str, WorldState] = {}
+        # 保护 _memory 和 _dirty：状态可能同时被请求线程修改、被后台刷写线程读取
+        self._lock = threading.RLock()
         
-        # 初始化 Supabase
-        self.supabase: Optional[Client] = None
+        # 写回模式：待持久化的房间集合和后台刷写线程
+        self.write_behind = STATE_WRITE_BEHIND if write_behind is None else write_behind
+        self.flush_interval = STATE_FLUSH_INTERVAL if flush_interval is None else flush_interval
+        self._dirty: Set[str] = set()
+        # 串行化刷写与清空房间的存储写入：刷写在锁外写入快照，不能把刚清空的房间写回去
+        # 加锁顺序：_write_lock → _lock
+        self._write_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._flush_thread: Optional[threading.Thread] = None
+        
+        # 事件日志模式：每个房间最新事件序号和最近一次快照的序号
+        self.event_log = STATE_EVENT_LOG if event_log is None else event_log
+        self.snapshot_every = STATE_SNAPSHOT_EVERY if snapshot_every is None else snapshot_every
+        self._event_seq: Dict[str, int] = {}
+        self._snapshot_seq: Dict[str, int] = {}
+        
+        # 状态变化监听器（用于向 WebSocket 订阅者推送增量）
+        self._listeners: List[StateListener] = []
+        
+        # 多进程共享状态模式：权威状态在共享的 SQLite 数据库中，内存只是带版本号的缓存
+        self.shared: Optional[SharedWorldStore] = None
+        self.sync_interval = STATE_SYNC_INTERVAL if sync_interval is None else sync_interval
+        self._change_seq = 0
+        self._sync_thread: Optional[threading.Thread] = None
+        if STATE_SHARED if shared is None else shared:
+            if self.write_behind or self.event_log:
+                raise ValueError("共享状态模式（STATE_SHARED）不能与 STATE_WRITE_BEHIND / STATE_EVENT_LOG 同时使用")
+            self.shared = SharedWorldStore(STATE_SHARED_DB_PATH or os.path.join(storage_path, "shared_state.db"))
+            # 只同步启动之后的变更
+            self._change_seq = self.shared.last_seq()
+        
+        # 初始化 Supabase（异步客户端运行在独立的 I/O 线程上，写入批量合并）
+        self.supabase: Optional[SupabaseBackend] = None
         self.use_supabase = False
         
         supabase_url = os.getenv("SUPABASE_URL")
         supabase_key = os.getenv("SUPABASE_KEY")
         
-        if SUPABASE_AVAILABLE and supabase_url and supabase_key:
+        if supabase_url and self.shared is not None:
+            print("[WARNING] 共享状态模式下不使用 Supabase")
+        elif supabase_url and (
+            supabase_url.startswith(FAKE_SUPABASE_URL_PREFIX) or (SUPABASE_AVAILABLE and supabase_key)
+        ):
             try:
-                self.supabase = create_client(supabase_url, supabase_key)
+                self.supabase = SupabaseBackend.connect(
+                    supabase_url, supabase_key or "", on_write_failed=self._save_local
+                )
                 self.use_supabase = True
                 print(f"[INFO] 已连接到 Supabase: {supabase_url}")
             except Exception as e:
                 print(f"[ERROR] 连接 Supabase 失败: {e}")
+        
+        if self.write_behind:
+            self._flush_thread = threading.Thread(
+                target=self._flush_loop, name="state-store-flush", daemon=True
+            )
+            self._flush_thread.start()
+            atexit.register(self.close)
+        
+        if self.shared is not None:
+            self._sync_thread = threading.Thread(
+                target=self._sync_loop, name="state-store-sync", daemon=True
+            )
+            self._sync_thread.start()
+            atexit.register(self.close)
+            print(f"[INFO] 共享状态模式: {self.shared.db_path}（{self.shared.origin}）")
 
     def get_world(self, room_id: str) -> Dict[str, Any]:
         """获取指定房间的世界状态"""
+        if self.shared is not None:
+            self._check_version(room_id)
+        world = self._memory.get(room_id)
+        if world is not None:
+            cached = world.cached_dict
+            if cached is not None:
+                return cached
+        
+        self._prefetch(room_id)
+        with self._lock:
+            return self._get_world_state(room_id).to_dict()
+    
+    async def preload(self, room_id: str) -> None:
+        """在线程池中加载房间，避免在事件循环中等待远程存储"""
         if room_id not in self._memory:
-            # 尝试从存储加载
-            self._load_state(room_id)
+            await asyncio.to_thread(self.get_world, room_id)
+    
+    def get_versioned_world(self, room_id: str) -> Tuple[int, Dict[str, Any]]:
+        """获取世界状态及其版本号（两者保证一致）"""
+        if self.shared is not None:
+            self._check_version(room_id)
+        self._prefetch(room_id)
+        with self._lock:
+            world = self._get_world_state(room_id)
+            return world.version, world.to_dict()
+    
+    def subscribe(self, listener: StateListener) -> None:
+        """注册状态变化监听器，每次 apply_events 后收到一个增量"""
+        self._listeners.append(listener)
+    
+    def unsubscribe(self, listener: StateListener) -> None:
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+    
+    def _prefetch(self, room_id: str) -> None:
+        """Supabase 模式下在锁外读取房间，网络延迟不会阻塞其他房间的状态更新"""
+        if not self.use_supabase or self.event_log or room_id in self._memory:
+            return
+        try:
+            with span("state.load", "supabase"):
+                data = self.supabase.load(room_id)
+        except Exception as e:
+            print(f"[ERROR] 从 Supabase 加载失败: {e}")
+            return
+        if data is not None:
+            world = WorldState.from_dict(data)
+            with self._lock:
+                self._memory.setdefault(room_id, world)
+    
+    def _get_world_state(self, room_id: str) -> WorldState:
+        """获取房间的内部状态，不存在时加载或创建默认状态（调用方需持有锁）"""
+        world = self._memory.get(room_id)
+        if world is not None:
+            return world
+        
+        # 尝试从存储加载
+        self._load_state(room_id)
         
         if room_id not in self._memory:
             # 初始化默认状态
-            self._memory[room_id] = {
-                "agents": [
-                    {
-                        "id": "mathematician",
-                        "name": "Mathematician",
-                        "role": "mathematician",
-                        "x": 150,
-                        "y": 250,
-                        "mood": "calm",
-                        "currentTask": None,
-                        "relations": {}
-                    },
-                    {
-                        "id": "artist",
-                        "name": "Artist",
-                        "role": "artist",
-                        "x": 350,
-                        "y": 250,
-                        "mood": "creative",
-                        "currentTask": None,
-                        "relations": {}
-                    },
-                    {
-                        "id": "engineer",
-                        "name": "Engineer",
-                        "role": "engineer",
-                        "x": 550,
-                        "y": 250,
-                        "mood": "focused",
-                        "currentTask": None,
-                        "relations": {}
-                    },
-                    {
-                        "id": "merchant",
-                        "name": "Merchant",
-                        "role": "merchant",
-                        "x": 750,
-                        "y": 250,
-                        "mood": "cautious",
-                        "currentTask": None,
-                        "relations": {}
-                    },
-                    {
-                        "id": "athlete",
-                        "name": "Athlete",
-                        "role": "athlete",
-                        "x": 250,
-                        "y": 450,
-                        "mood": "energetic",
-                        "currentTask": None,
-                        "relations": {}
-                    },
-                    {
-                        "id": "doctor",
-                        "name": "Doctor",
-                        "role": "doctor",
-                        "x": 450,
-                        "y": 450,
-                        "mood": "caring",
-                        "currentTask": None,
-                        "relations": {}
-                    }
-                ],
-                "environment": {
-                    "timeOfDay": "day",
-                    "weather": "sunny",
-                    "rooms": []
-                },
-                "lastUpdated": datetime.now().isoformat()
-            }
-            self._save_state(room_id)
+            world = WorldState.default(datetime.now().isoformat())
+            if self.shared is not None:
+                # 其他进程同时创建时以数据库中的为准
+                version, data = self.shared.create(room_id, world.to_dict())
+                world = WorldState.from_dict(data)
+                world.version = version
+                self._memory[room_id] = world
+            else:
+                self._memory[room_id] = world
+                self._save_state(room_id)
         
         return self._memory[room_id]
     
-    def apply_events(self, room_id: str, events: List[Dict[str, Any]]) -> None:
-        """应用事件更新世界状态"""
-        world = self.get_world(room_id)
+    def apply_events(self, room_id: str, events: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """应用事件更新世界状态，返回本次变化的增量
         
-        for event in events:
-            event_type = event.get("type")
-            
-            if event_type == "agent_moved":
-                agent_id = event.get("agent_id")
-                x = event.get("x")
-                y = event.get("y")
-                for agent in world["agents"]:
-                    if agent["id"] == agent_id:
-                        agent["x"] = x
-                        agent["y"] = y
-                        break
-            
-            elif event_type == "task_started":
-                agent_id = event.get("agent_id")
-                task = event.get("task")
-                for agent in world["agents"]:
-                    if agent["id"] == agent_id:
-                        agent["currentTask"] = task
-                        agent["mood"] = event.get("mood", agent["mood"])
-                        break
-            
-            elif event_type == "task_finished":
-                agent_id = event.get("agent_id")
-                for agent in world["agents"]:
-                    if agent["id"] == agent_id:
-                        agent["currentTask"] = None
-                        agent["mood"] = event.get("mood", "calm")
-                        break
-            
-            elif event_type == "mood_changed":
-                agent_id = event.get("agent_id")
-                mood = event.get("mood")
-                for agent in world["agents"]:
-                    if agent["id"] == agent_id:
-                        agent["mood"] = mood
-                        break
-        
-        world["lastUpdated"] = datetime.now().isoformat()
+        增量格式：{"room_id", "base_version", "version", "patch", "events"}，
+        patch 为相对 base_version 状态的 JSON Patch 操作列表，events 为本次应用的事件。
+        """
+        self._prefetch(room_id)
+        with span("state.apply"), self._lock:
+            if self.shared is not None:
+                delta = self._apply_events_shared(room_id, events)
+            else:
+                delta = self._apply_events(room_id, events)
+            # 在锁内通知，保证监听器按版本顺序收到增量
+            self._notify(room_id, delta)
+        return delta
+    
+    def _notify(self, room_id: str, delta: Dict[str, Any]) -> None:
+        for listener in list(self._listeners):
+            try:
+                listener(room_id, delta)
+            except Exception as e:
+                print(f"[ERROR] 状态监听器出错: {e}")
+    
+    def _apply_events(self, room_id: str, events: List[Dict[str, Any]]) -> Dict[str, Any]:
+        if self.event_log:
+            # 先追加日志再修改内存：追加失败时抛出异常，内存状态与日志保持一致
+            timestamp = datetime.now().isoformat()
+            self._get_world_state(room_id)
+            self._append_events(room_id, events, timestamp)
+            delta = self._apply_to_memory(room_id, events, timestamp)
+            if self._event_seq[room_id] - self._snapshot_seq.get(room_id, 0) >= self.snapshot_every:
+                self._write_snapshot(room_id)
+            return delta
+        
+        delta = self._apply_to_memory(room_id, events)
         self._save_state(room_id)
+        return delta
+    
+    def _apply_events_shared(self, room_id: str, events: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """共享状态模式：持有跨进程写锁，在数据库中的最新版本上应用事件，再按版本号写回"""
+        with self.shared.locked():
+            # 先通知其他进程已提交的变更，监听器按版本顺序收到增量
+            self.sync()
+            world = self._memory.get(room_id)
+            if world is not None and world.version != self.shared.version(room_id):
+                # 其他进程已经更新（或清空）了该房间，丢弃内存中的旧状态
+                del self._memory[room_id]
+            try:
+                delta = self._apply_to_memory(room_id, events)
+                with span("state.save", "shared"):
+                    self.shared.save(room_id, delta["base_version"], self._memory[room_id].to_dict(), delta)
+            except BaseException:
+                # 写回失败时内存状态与数据库不一致，下次访问时重新加载
+                self._memory.pop(room_id, None)
+                raise
+        return delta
+    
+    def _apply_to_memory(
+        self, room_id: str, events: List[Dict[str, Any]], timestamp: Optional[str] = None
+    ) -> Dict[str, Any]:
+        world = self._get_world_state(room_id)
+        
+        patch = []
+        for event in events:
+            patch.extend(apply_event(world, event))
+        
+        world.touch(timestamp or datetime.now().isoformat())
+        patch.append({"op": "replace", "path": "/lastUpdated", "value": world.lastUpdated})
+        world.version += 1
+        
+        return {
+            "room_id": room_id,
+            "base_version": world.version - 1,
+            "version": world.version,
+            "patch": patch,
+            "events": list(events)
+        }
     
     def _save_state(self, room_id: str) -> None:
-        """保存状态（优先 Supabase，降级为文件）"""
-        if self.use_supabase:
+        """保存状态：事件日志模式下写快照，写回模式下只标记为脏，否则立即持久化"""
+        if self.event_log:
+            self._write_snapshot(room_id)
+            return
+        if self.write_behind:
+            with self._lock:
+                self._dirty.add(room_id)
+            return
+        self._persist(room_id, self._memory[room_id].to_dict())
+    
+    def _check_version(self, room_id: str) -> None:
+        """共享状态模式：内存中的房间与数据库中的版本不一致时丢弃，随后从数据库重新加载"""
+        world = self._memory.get(room_id)
+        if world is None or world.version == self.shared.version(room_id):
+            return
+        with self._lock:
+            if self._memory.get(room_id) is world:
+                del self._memory[room_id]
+    
+    def _sync_loop(self) -> None:
+        """同步线程：每隔 sync_interval 读取一次其他进程的变更"""
+        pruned_at = time.monotonic()
+        while not self._stop_event.wait(self.sync_interval):
+            self.sync()
+            if time.monotonic() - pruned_at >= STATE_PRUNE_INTERVAL:
+                pruned_at = time.monotonic()
+                try:
+                    self.shared.prune()
+                except sqlite3.Error as e:
+                    print(f"[WARNING] 清理状态变更记录失败: {e}")
+    
+    def sync(self) -> int:
+        """读取其他进程的变更：丢弃内存中过期的房间并通知监听器，返回变更数"""
+        with self._lock:
             try:
-                data = {
-                    "room_id": room_id,
-                    "data": self._memory[room_id],
-                    "updated_at": datetime.now().isoformat()
-                }
-                # Upsert data
-                self.supabase.table("world_states").upsert(data).execute()
-                return
-            except Exception as e:
-                print(f"[ERROR] 保存到 Supabase 失败: {e}")
-                # 降级到文件保存
+                self._change_seq, changes = self.shared.changes(self._change_seq)
+            except sqlite3.Error as e:
+                print(f"[WARNING] 读取状态变更失败: {e}")
+                return 0
+            for room_id, version, delta in changes:
+                world = self._memory.get(room_id)
+                if world is not None and world.version < version:
+                    del self._memory[room_id]
+                if delta is None:
+                    # 房间被清空：增量的基准版本不存在，订阅者会收到完整状态
+                    delta = {"room_id": room_id, "base_version": -1, "version": version, "patch": [], "events": []}
+                self._notify(room_id, delta)
+        return len(changes)
+    
+    def _flush_loop(self) -> None:
+        """后台刷写线程：每隔 flush_interval 合并写入一次脏房间"""
+        while not self._stop_event.wait(self.flush_interval):
+            self.flush()
+    
+    def flush(self) -> None:
+        """把所有脏房间写入存储（在后台线程或关闭时调用，不阻塞事件循环）"""
+        with span("state.flush"):
+            self._flush()
+    
+    def _flush(self) -> None:
+        with self._write_lock:
+            self._flush_locked()
+    
+    def _flush_locked(self) -> None:
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            # 在锁内序列化快照，避免与正在进行的状态修改交错
+            snapshots = {
+                room_id: json.dumps(self._memory[room_id].to_dict(), ensure_ascii=False, separators=(",", ":"))
+                for room_id in dirty if room_id in self._memory
+            }
+        
+        if self.use_supabase:
+            for room_id, serialized in snapshots.items():
+                self._persist(room_id, json.loads(serialized))
+            return
+        
+        # 本地存储一次写入所有脏房间（SQLite 后端在同一个事务中完成）
+        failed = self.storage.save_many(
+            [(room_id, None, serialized) for room_id, serialized in snapshots.items()], durable=True
+        )
+        if failed:
+            # 写入失败，留到下一轮重试
+            with self._lock:
+                self._dirty.update(room_id for room_id in failed if room_id in self._memory)
+    
+    def close(self) -> None:
+        """停止后台刷写线程，并把剩余的脏房间全部写入"""
+        self._stop_event.set()
+        for thread in (self._flush_thread, self._sync_thread):
+            if thread is not None and thread is not threading.current_thread():
+                thread.join()
+        self.flush()
+        if self.supabase is not None:
+            self.supabase.close()
+        if self.shared is not None:
+            self.shared.close()
+        self.storage.close()
+    
+    def _persist(
+        self,
+        room_id: str,
+        data: Dict[str, Any],
+        serialized: Optional[str] = None,
+        durable: bool = False,
+    ) -> bool:
+        """保存状态（优先 Supabase，降级为本地存储），返回是否成功
+        
+        Supabase 写入只是排队，由后台批量提交；最终失败时通过 on_write_failed 降级写入本地存储。
+        """
+        if self.use_supabase:
+            with span("state.save", "supabase"):
+                self.supabase.upsert(room_id, data)
+            return True
         
-        self._save_to_file(room_id)
+        with span("state.save", "local"):
+            return self._save_local(room_id, data, serialized=serialized, durable=durable)
 
     def _load_state(self, room_id: str) -> None:
-        """加载状态（优先 Supabase，降级为文件）"""
-        if self.use_supabase:
-            try:
-                response = self.supabase.table("world_states").select("data").eq("room_id", room_id).execute()
-                if response.data and len(response.data) > 0:
-                    self._memory[room_id] = response.data[0]["data"]
-                    return
-            except Exception as e:
-                print(f"[ERROR] 从 Supabase 加载失败: {e}")
-                # 降级到文件加载
+        """加载状态（共享状态模式：从共享数据库加载；事件日志模式：快照 + 日志回放；否则从本地存储加载）
         
-        self._load_from_file(room_id)
+        Supabase 中的状态已由 _prefetch 在锁外读取，这里只处理降级到本地存储的情况。
+        """
+        if self.shared is not None:
+            with span("state.load", "shared"):
+                loaded = self.shared.load(room_id)
+            if loaded is not None:
+                version, data = loaded
+                world = WorldState.from_dict(data)
+                world.version = version
+                self._memory[room_id] = world
+            return
+        with span("state.load", "event_log" if self.event_log else "local"):
+            if self.event_log:
+                self._load_from_event_log(room_id)
+            else:
+                self._load_local(room_id)
 
-    def _save_to_file(self, room_id: str) -> None:
-        """保存状态到文件"""
-        file_path = os.path.join(self.storage_path, f"{room_id}.json")
+    def _save_local(
+        self,
+        room_id: str,
+        data: Dict[str, Any],
+        serialized: Optional[str] = None,
+        durable: bool = False,
+    ) -> bool:
+        """保存状态到本地存储"""
+        return self.storage.save(room_id, data, serialized=serialized, durable=durable)
+    
+    def _load_local(self, room_id: str) -> None:
+        """从本地存储加载状态"""
+        data = self.storage.load(room_id)
+        if data is not None:
+            self._memory[room_id] = WorldState.from_dict(data)
+    
+    def _event_log_path(self, room_id: str, previous: bool = False) -> str:
+        suffix = "events.prev.jsonl" if previous else "events.jsonl"
+        return os.path.join(self.storage_path, f"{room_id}.{suffix}")
+    
+    def _snapshot_path(self, room_id: str) -> str:
+        return os.path.join(self.storage_path, f"{room_id}.snapshot.json")
+    
+    def _append_events(self, room_id: str, events: List[Dict[str, Any]], timestamp: str) -> None:
+        """把一批事件追加到房间的事件日志（写入量与事件大小成正比，与世界大小无关），失败时抛出异常"""
+        seq = self._event_seq.get(room_id, 0)
+        lines = []
+        for event in events:
+            seq += 1
+            record = {"seq": seq, "ts": timestamp, **event}
+            lines.append(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
         try:
-            with open(file_path, "w", encoding="utf-8") as f:
-                json.dump(self._memory[room_id], f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"保存状态文件失败: {e}")
+            with span("state.save", "event_log"), open(self._event_log_path(room_id), "a", encoding="utf-8") as f:
+                f.write("".join(lines))
+        except OSError as e:
+            print(f"[ERROR] 追加事件日志失败: {e}")
+            raise
+        self._event_seq[room_id] = seq
+    
+    def _write_snapshot(self, room_id: str) -> None:
+        """写入快照并轮换事件日志（保留上一段日志用于调试历史）"""
+        seq = self._event_seq.get(room_id, 0)
+        snapshot = {"seq": seq, "world": self._memory[room_id].to_dict()}
+        if not save_json_atomic(self._snapshot_path(room_id), snapshot):
+            return
+        self._snapshot_seq[room_id] = seq
+        log_path = self._event_log_path(room_id)
+        if os.path.exists(log_path):
+            os.replace(log_path, self._event_log_path(room_id, previous=True))
     
-    def _load_from_file(self, room_id: str) -> None:
-        """从文件加载状态"""
-        file_path = os.path.join(self.storage_path, f"{room_id}.json")
-        if os.path.exists(file_path):
+    def _load_from_event_log(self, room_id: str) -> None:
+        """从快照加载状态，再回放快照之后的事件"""
+        seq = 0
+        snapshot_path = self._snapshot_path(room_id)
+        if os.path.exists(snapshot_path):
             try:
-                with open(file_path, "r", encoding="utf-8") as f:
-                    self._memory[room_id] = json.load(f)
+                with open(snapshot_path, "r", encoding="utf-8") as f:
+                    snapshot = json.load(f)
+                self._memory[room_id] = WorldState.from_dict(snapshot["world"])
+                seq = snapshot["seq"]
             except Exception as e:
-                print(f"加载状态文件失败: {e}")
+                print(f"加载快照失败: {e}")
+        else:
+            # 兼容之前按整份文件保存的状态
+            self._load_local(room_id)
+        self._snapshot_seq[room_id] = seq
+        
+        world = self._memory.get(room_id)
+        if world is not None:
+            for record in self._read_event_log(room_id):
+                if record["seq"] <= seq:
+                    continue
+                apply_event(world, record)
+                world.touch(record["ts"])
+                seq = record["seq"]
+        self._event_seq[room_id] = seq
+    
+    def _read_event_log(self, room_id: str, include_previous: bool = False) -> List[Dict[str, Any]]:
+        """读取事件日志（按序号升序）"""
+        paths = [self._event_log_path(room_id)]
+        if include_previous:
+            paths.insert(0, self._event_log_path(room_id, previous=True))
+        records = []
+        for path in paths:
+            if not os.path.exists(path):
+                continue
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        records.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        # 进程崩溃时最后一行可能不完整，跳过
+                        print(f"[WARNING] 跳过损坏的事件日志行: {path}")
+        return records
+    
+    def get_history(self, room_id: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """获取房间最近的事件历史（仅事件日志模式可用，包含当前和上一段日志）"""
+        if not self.event_log:
+            return []
+        with self._lock:
+            records = self._read_event_log(room_id, include_previous=True)
+        if limit is not None:
+            records = records[-limit:] if limit > 0 else []
+        return records
     
     def clear_room(self, room_id: str) -> None:
         """清空指定房间的状态"""
-        if room_id in self._memory:
-            del self._memory[room_id]
+        with self._write_lock:
+            self._clear_room(room_id)
+    
+    def _clear_room(self, room_id: str) -> None:
+        with self._lock:
+            self._memory.pop(room_id, None)
+            self._dirty.discard(room_id)
+            self._event_seq.pop(room_id, None)
+            self._snapshot_seq.pop(room_id, None)
+            for path in (
+                self._event_log_path(room_id),
+                self._event_log_path(room_id, previous=True),
+                self._snapshot_path(room_id),
+            ):
+                if os.path.exists(path):
+                    os.remove(path)
+            if self.shared is not None:
+                # 版本号继续递增，其他进程据此丢弃旧状态并通知订阅者
+                self.shared.clear(room_id)
             
         if self.use_supabase:
-            try:
-                self.supabase.table("world_states").delete().eq("room_id", room_id).execute()
-            except Exception as e:
-                print(f"[ERROR] 从 Supabase 删除失败: {e}")
+            self.supabase.delete(room_id)
+
+        self.storage.delete(room_id)
 
-        file_path = os.path.join(self.storage_path, f"{room_id}.json")
-        if os.path.exists(file_path):
-            os.remove(file_path)
+    def stats(self) -> Dict[str, Any]:
+        stats = {"rooms": len(self._memory), "shared": self.shared is not None}
+        if self.shared is not None:
+            stats.update(origin=self.shared.origin, change_seq=self._change_seq)
+        return stats
 
 # 全局单例
 _state_store = None
@@ -0,0 +1,210 @@
+"""StateStore 的本地存储后端
+
+- json：每个房间一个 {room_id}.json 文件（之前的实现，默认）
+- sqlite：所有房间保存在同一个 SQLite 数据库（WAL 模式），以 room_id 为主键
+
+通过 STATE_STORAGE_BACKEND 选择，也可以用 register_storage_backend 注册自定义后端。
+"""
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+# 本地存储后端：json / sqlite
+STATE_STORAGE_BACKEND = os.getenv("STATE_STORAGE_BACKEND", "json")
+# SQLite 后端的数据库文件，默认为存储目录下的 state.db
+STATE_SQLITE_PATH = os.getenv("STATE_SQLITE_PATH")
+
+
+def save_json_atomic(
+    file_path: str,
+    data: Any,
+    serialized: Optional[str] = None,
+    durable: bool = False,
+) -> bool:
+    """先写临时文件再原子替换，避免读到写了一半的文件"""
+    if serialized is None:
+        serialized = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+    tmp_path = None
+    try:
+        fd, tmp_path = tempfile.mkstemp(
+            prefix=f".{os.path.basename(file_path)}.", suffix=".tmp", dir=os.path.dirname(file_path)
+        )
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(serialized)
+            if durable:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, file_path)
+        return True
+    except Exception as e:
+        print(f"保存状态文件失败: {e}")
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False
+
+
+class StorageBackend(ABC):
+    """房间状态的本地持久化接口"""
+
+    @abstractmethod
+    def save(
+        self,
+        room_id: str,
+        data: Dict[str, Any],
+        serialized: Optional[str] = None,
+        durable: bool = False,
+    ) -> bool:
+        """保存房间状态，返回是否成功
+
+        serialized 为 data 已序列化的 JSON（可选）；提供 serialized 时 data 可以为 None。
+        """
+
+    def save_many(self, items: Iterable[Tuple[str, Dict[str, Any], Optional[str]]], durable: bool = False) -> List[str]:
+        """批量保存 (room_id, data, serialized)，返回保存失败的房间ID"""
+        return [
+            room_id for room_id, data, serialized in items
+            if not self.save(room_id, data, serialized=serialized, durable=durable)
+        ]
+
+    @abstractmethod
+    def load(self, room_id: str) -> Optional[Dict[str, Any]]:
+        """加载房间状态，不存在时返回 None"""
+
+    @abstractmethod
+    def delete(self, room_id: str) -> None:
+        """删除房间状态"""
+
+    def close(self) -> None:
+        pass
+
+
+class JsonFileBackend(StorageBackend):
+    """每个房间一个 JSON 文件"""
+
+    def __init__(self, storage_path: str):
+        self.storage_path = storage_path
+
+    def _path(self, room_id: str) -> str:
+        return os.path.join(self.storage_path, f"{room_id}.json")
+
+    def save(self, room_id, data, serialized=None, durable=False) -> bool:
+        return save_json_atomic(self._path(room_id), data, serialized=serialized, durable=durable)
+
+    def load(self, room_id: str) -> Optional[Dict[str, Any]]:
+        file_path = self._path(room_id)
+        if not os.path.exists(file_path):
+            return None
+        try:
+            with open(file_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"加载状态文件失败: {e}")
+            return None
+
+    def delete(self, room_id: str) -> None:
+        file_path = self._path(room_id)
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+
+class SQLiteBackend(StorageBackend):
+    """所有房间保存在同一个 SQLite 数据库中（WAL 模式）
+
+    每个线程使用自己的连接（WAL 下读写互不阻塞），SQL 语句固定，
+    由 sqlite3 的语句缓存复用预编译结果。
+    """
+
+    _UPSERT = (
+        "INSERT INTO world_states (room_id, data, updated_at) VALUES (?, ?, ?) "
+        "ON CONFLICT(room_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at"
+    )
+    _SELECT = "SELECT data FROM world_states WHERE room_id = ?"
+    _DELETE = "DELETE FROM world_states WHERE room_id = ?"
+
+    def __init__(self, db_path: str, timeout: float = 30.0):
+        self.db_path = db_path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS world_states ("
+                "room_id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at TEXT)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        """当前线程的连接（首次使用时创建）"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=self.timeout, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # WAL 下 NORMAL 不会损坏数据库，只可能丢失最后一次提交
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    @staticmethod
+    def _serialize(data: Dict[str, Any], serialized: Optional[str]) -> str:
+        if serialized is None:
+            serialized = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+        return serialized
+
+    def save(self, room_id, data, serialized=None, durable=False) -> bool:
+        return not self.save_many([(room_id, data, serialized)], durable=durable)
+
+    def save_many(self, items, durable=False) -> List[str]:
+        """在一个事务中写入所有房间"""
+        now = datetime.now().isoformat()
+        rows = [(room_id, self._serialize(data, serialized), now) for room_id, data, serialized in items]
+        try:
+            with self._connect() as conn:
+                conn.executemany(self._UPSERT, rows)
+            return []
+        except Exception as e:
+            print(f"保存状态到 SQLite 失败: {e}")
+            return [row[0] for row in rows]
+
+    def load(self, room_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            row = self._connect().execute(self._SELECT, (room_id,)).fetchone()
+        except Exception as e:
+            print(f"从 SQLite 加载状态失败: {e}")
+            return None
+        return json.loads(row[0]) if row else None
+
+    def delete(self, room_id: str) -> None:
+        with self._connect() as conn:
+            conn.execute(self._DELETE, (room_id,))
+
+    def close(self) -> None:
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+
+
+STORAGE_BACKENDS: Dict[str, Callable[[str], StorageBackend]] = {
+    "json": JsonFileBackend,
+    "sqlite": lambda storage_path: SQLiteBackend(STATE_SQLITE_PATH or os.path.join(storage_path, "state.db")),
+}
+
+
+def register_storage_backend(name: str, factory: Callable[[str], StorageBackend]) -> None:
+    """注册自定义存储后端：factory(storage_path) → StorageBackend"""
+    STORAGE_BACKENDS[name] = factory
+
+
+def create_storage_backend(name: Optional[str], storage_path: str) -> StorageBackend:
+    name = name or STATE_STORAGE_BACKEND
+    if name not in STORAGE_BACKENDS:
+        raise ValueError(f"未知的存储后端 '{name}'。可用后端: {list(STORAGE_BACKENDS)}")
+    return STORAGE_BACKENDS[name](storage_path)
@@ -0,0 +1,165 @@
+"""流式响应工具：Server-Sent Events (SSE)"""
+import asyncio
+import json
+import os
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+from fastapi.responses import StreamingResponse
+
+# 长时间没有事件时发送心跳注释的间隔（秒），避免代理因连接空闲而断开
+SSE_HEARTBEAT_INTERVAL = float(os.getenv("SSE_HEARTBEAT_INTERVAL", "15"))
+
+# 智能体运行事件的缓冲区大小（事件数），缓冲区满时暂停读取模型输出
+RUN_STREAM_BUFFER_SIZE = int(os.getenv("RUN_STREAM_BUFFER_SIZE", "64"))
+# 缓冲区持续满载超过该时间（秒）视为慢客户端，取消本次运行
+RUN_STREAM_SEND_TIMEOUT = float(os.getenv("RUN_STREAM_SEND_TIMEOUT", "30"))
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    # 关闭 nginx 等反向代理的响应缓冲，保证事件立即下发
+    "X-Accel-Buffering": "no",
+}
+
+
+def format_sse(event: str, data: Any) -> str:
+    """把一个事件编码为 SSE 帧"""
+    payload = json.dumps(data, ensure_ascii=False, default=str)
+    return f"event: {event}\ndata: {payload}\n\n"
+
+
+async def sse_stream(
+    events: AsyncIterator[Tuple[str, Any]],
+    heartbeat_interval: float = SSE_HEARTBEAT_INTERVAL,
+) -> AsyncIterator[str]:
+    """把 (事件名, 数据) 异步迭代器转换为 SSE 文本流，空闲时插入心跳
+
+    客户端断开时响应被取消，会同时关闭上游迭代器（从而取消正在执行的智能体）。
+    """
+    iterator = events.__aiter__()
+    pending = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+            done, _ = await asyncio.wait({pending}, timeout=heartbeat_interval)
+            if not done:
+                yield ": keep-alive\n\n"
+                continue
+            task, pending = pending, None
+            try:
+                event, data = task.result()
+            except StopAsyncIteration:
+                break
+            yield format_sse(event, data)
+    finally:
+        if pending is not None:
+            pending.cancel()
+            await asyncio.gather(pending, return_exceptions=True)
+        aclose = getattr(iterator, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+
+def sse_response(events: AsyncIterator[Tuple[str, Any]]) -> StreamingResponse:
+    """创建 text/event-stream 响应"""
+    return StreamingResponse(
+        sse_stream(events),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS,
+    )
+
+
+def _convert_run_event(event: Any) -> Optional[Tuple[str, Dict[str, Any]]]:
+    """把 Agents SDK 的流式事件转换为 (事件名, 数据)，不需要转发的事件返回 None"""
+    if event.type == "raw_response_event":
+        if getattr(event.data, "type", None) == "response.output_text.delta":
+            return "token", {"delta": event.data.delta}
+        return None
+
+    if event.type == "agent_updated_stream_event":
+        return "agent", {"agent": event.new_agent.name}
+
+    if event.type == "run_item_stream_event":
+        item = event.item
+        if event.name == "handoff_requested":
+            return "handoff", {"status": "requested", "tool": getattr(item.raw_item, "name", None)}
+        if event.name == "handoff_occured":
+            return "handoff", {
+                "status": "completed",
+                "from": item.source_agent.name,
+                "to": item.target_agent.name
+            }
+        if event.name == "tool_called":
+            return "tool_call", {
+                "agent": item.agent.name,
+                "tool": getattr(item.raw_item, "name", None),
+                "arguments": getattr(item.raw_item, "arguments", None)
+            }
+        if event.name == "tool_output":
+            return "tool_output", {"agent": item.agent.name, "output": item.output}
+    return None
+
+
+async def iter_run_events(
+    result: Any,
+    buffer_size: int = RUN_STREAM_BUFFER_SIZE,
+    send_timeout: float = RUN_STREAM_SEND_TIMEOUT,
+) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+    """逐个产出 Runner.run_streamed 结果中的 token / handoff / 工具调用事件
+
+    背压：模型事件先进入有界缓冲区，缓冲区满时暂停读取模型输出；
+    消费端积压时，相邻的 token 事件会合并成一帧发送，减少帧数。
+    缓冲区持续满载超过 send_timeout 时取消运行并抛出 TimeoutError，
+    保证慢客户端不会让服务端无限缓存输出。
+    """
+    queue: "asyncio.Queue[Tuple[str, Dict[str, Any]]]" = asyncio.Queue(maxsize=max(1, buffer_size))
+
+    async def produce() -> None:
+        try:
+            async for event in result.stream_events():
+                converted = _convert_run_event(event)
+                if converted is None:
+                    continue
+                await asyncio.wait_for(queue.put(converted), send_timeout)
+        except asyncio.TimeoutError:
+            result.cancel()
+            raise TimeoutError("客户端读取过慢，已取消本次运行")
+
+    async def next_item() -> Optional[Tuple[str, Dict[str, Any]]]:
+        """取下一个事件，运行结束且缓冲区为空时返回 None"""
+        while True:
+            if not queue.empty():
+                return queue.get_nowait()
+            if producer.done():
+                return None
+            getter = asyncio.ensure_future(queue.get())
+            await asyncio.wait({getter, producer}, return_when=asyncio.FIRST_COMPLETED)
+            if getter.done():
+                return getter.result()
+            getter.cancel()
+
+    producer = asyncio.ensure_future(produce())
+    held = None
+    try:
+        while True:
+            item, held = held or await next_item(), None
+            if item is None:
+                break
+            event, data = item
+            if event == "token":
+                # 合并已缓冲的连续 token，遇到其他事件时留到下一轮发送
+                deltas = [data["delta"]]
+                while not queue.empty():
+                    following = queue.get_nowait()
+                    if following[0] != "token":
+                        held = following
+                        break
+                    deltas.append(following[1]["delta"])
+                data = {"delta": "".join(deltas)}
+            yield event, data
+        # 传播运行中的异常
+        await producer
+    finally:
+        if not producer.done():
+            result.cancel()
+            producer.cancel()
+            await asyncio.gather(producer, return_exceptions=True)
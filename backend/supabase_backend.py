@@ -0,0 +1,258 @@
+"""Supabase 存储后端：异步客户端 + 共享连接池 + 跨房间批量写入
+
+StateStore 的调用都是同步的（来自请求处理和工具线程），这里用一个专用的 I/O 线程
+运行事件循环和 Supabase 异步客户端：
+- 写入（upsert / delete）只放入待写队列立即返回，同一房间的多次写入合并为最新一次，
+  后台按批次把多个房间合并成一次多行 upsert
+- 读取在 I/O 线程上执行，调用方线程等待结果；待写队列和正在提交的批次中的数据优先返回
+  （读到自己的写入，刚删除的房间不会从数据库中读回旧数据）
+- 每个请求有超时和有限次数的指数退避重试，写入最终失败时交给 on_write_failed 降级处理
+"""
+import asyncio
+import os
+import random
+import threading
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+# 连接池大小、批量写入的行数上限和攒批间隔（秒）
+SUPABASE_POOL_SIZE = int(os.getenv("SUPABASE_POOL_SIZE", "10"))
+SUPABASE_BATCH_SIZE = int(os.getenv("SUPABASE_BATCH_SIZE", "100"))
+SUPABASE_BATCH_INTERVAL = float(os.getenv("SUPABASE_BATCH_INTERVAL", "0.05"))
+# 单次请求超时（秒）、最大重试次数和首次重试的退避时间（秒）
+SUPABASE_TIMEOUT = float(os.getenv("SUPABASE_TIMEOUT", "10"))
+SUPABASE_MAX_RETRIES = int(os.getenv("SUPABASE_MAX_RETRIES", "3"))
+SUPABASE_RETRY_BACKOFF = float(os.getenv("SUPABASE_RETRY_BACKOFF", "0.2"))
+
+# SUPABASE_URL 使用该前缀时改用进程内的假客户端（用于本地开发和测试）
+FAKE_SUPABASE_URL_PREFIX = "memory://"
+
+# 写入最终失败时的回调：(room_id, data) → None
+WriteFailedCallback = Callable[[str, Dict[str, Any]], None]
+
+
+class SupabaseBackend:
+    """world_states 表的非阻塞读写"""
+
+    def __init__(
+        self,
+        client_factory: Callable[[], Awaitable[Any]],
+        table: str = "world_states",
+        batch_size: Optional[int] = None,
+        batch_interval: Optional[float] = None,
+        timeout: Optional[float] = None,
+        max_retries: Optional[int] = None,
+        retry_backoff: Optional[float] = None,
+        on_write_failed: Optional[WriteFailedCallback] = None,
+    ):
+        self.table = table
+        self.batch_size = batch_size or SUPABASE_BATCH_SIZE
+        self.batch_interval = SUPABASE_BATCH_INTERVAL if batch_interval is None else batch_interval
+        self.timeout = timeout or SUPABASE_TIMEOUT
+        self.max_retries = SUPABASE_MAX_RETRIES if max_retries is None else max_retries
+        self.retry_backoff = SUPABASE_RETRY_BACKOFF if retry_backoff is None else retry_backoff
+        self.on_write_failed = on_write_failed
+
+        # 待写入的行：{room_id: row}，同一房间只保留最新一次；待删除的房间（保持顺序）
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._deletes: Dict[str, None] = {}
+        # 已取出、尚未提交完成的写入：{room_id: row}，删除为 None
+        self._inflight: Dict[str, Optional[Dict[str, Any]]] = {}
+        self._busy = False
+        self._closed = False
+        self._cond = threading.Condition()
+
+        # 统计
+        self.batches = 0
+        self.rows_written = 0
+        self.retries = 0
+        self.failures = 0
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="supabase-io", daemon=True)
+        self._thread.start()
+        self.client = self._call(client_factory())
+        self._call(self._start_writer())
+
+    @classmethod
+    def connect(cls, url: str, key: str, **kwargs) -> "SupabaseBackend":
+        """根据 URL 创建后端：memory:// 使用进程内假客户端，否则连接真实的 Supabase"""
+        if url.startswith(FAKE_SUPABASE_URL_PREFIX):
+            from fake_supabase import FakeSupabaseClient
+
+            async def create_fake():
+                return FakeSupabaseClient()
+            return cls(create_fake, **kwargs)
+
+        async def create():
+            import httpx
+            from supabase import AsyncClientOptions, acreate_client
+
+            # 所有请求共享一个连接池
+            http_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=SUPABASE_POOL_SIZE,
+                    max_keepalive_connections=SUPABASE_POOL_SIZE,
+                ),
+                timeout=SUPABASE_TIMEOUT,
+            )
+            options = AsyncClientOptions(httpx_client=http_client, postgrest_client_timeout=SUPABASE_TIMEOUT)
+            return await acreate_client(url, key, options=options)
+        return cls(create, **kwargs)
+
+    async def _start_writer(self) -> None:
+        self._wakeup = asyncio.Event()
+        self._writer = asyncio.create_task(self._write_loop())
+
+    async def _stop_writer(self) -> None:
+        self._writer.cancel()
+        await asyncio.gather(self._writer, return_exceptions=True)
+
+    def _call(self, coro: Awaitable[Any]) -> Any:
+        """在 I/O 线程上执行协程并等待结果（调用方线程阻塞，事件循环不受影响）"""
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def _notify(self) -> None:
+        self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def upsert(self, room_id: str, data: Dict[str, Any]) -> None:
+        """排队写入房间状态（立即返回）"""
+        row = {"room_id": room_id, "data": data, "updated_at": datetime.now().isoformat()}
+        with self._cond:
+            self._pending[room_id] = row
+        self._notify()
+
+    def delete(self, room_id: str) -> None:
+        """排队删除房间状态（立即返回，之前未写入的数据一并丢弃）"""
+        with self._cond:
+            self._pending.pop(room_id, None)
+            self._deletes[room_id] = None
+        self._notify()
+
+    def load(self, room_id: str) -> Optional[Dict[str, Any]]:
+        """读取房间状态，不存在时返回 None；请求最终失败时抛出异常"""
+        with self._cond:
+            if room_id in self._pending:
+                return self._pending[room_id]["data"]
+            if room_id in self._deletes:
+                return None
+            if room_id in self._inflight:
+                row = self._inflight[room_id]
+                return row["data"] if row is not None else None
+
+        def select():
+            return self.client.table(self.table).select("data").eq("room_id", room_id).execute()
+        response = self._call(self._with_retry(select))
+        if response.data:
+            return response.data[0]["data"]
+        return None
+
+    async def _with_retry(self, request: Callable[[], Awaitable[Any]]) -> Any:
+        """执行请求，超时或出错时按指数退避（带抖动）重试"""
+        attempt = 0
+        while True:
+            try:
+                return await asyncio.wait_for(request(), self.timeout)
+            except Exception as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = self.retry_backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+                attempt += 1
+                self.retries += 1
+                print(f"[WARNING] Supabase 请求失败，{delay:.2f} 秒后第 {attempt} 次重试: {e!r}")
+                await asyncio.sleep(delay)
+
+    async def _write_loop(self) -> None:
+        """后台写入：先执行删除，再把待写入的行分批 upsert"""
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            # 短暂等待，让同一时间段内的写入合并到一个批次
+            if self.batch_interval > 0 and not self._closed:
+                await asyncio.sleep(self.batch_interval)
+
+            with self._cond:
+                deletes = list(self._deletes)
+                self._deletes.clear()
+                for room_id in deletes:
+                    self._inflight[room_id] = None
+                self._busy = True
+            try:
+                for room_id in deletes:
+                    try:
+                        await self._delete(room_id)
+                    finally:
+                        self._settle(room_id, None)
+                while True:
+                    with self._cond:
+                        room_ids = list(self._pending)[:self.batch_size]
+                        rows = [self._pending.pop(room_id) for room_id in room_ids]
+                        for row in rows:
+                            self._inflight[row["room_id"]] = row
+                    if not rows:
+                        break
+                    try:
+                        await self._upsert_batch(rows)
+                    finally:
+                        for row in rows:
+                            self._settle(row["room_id"], row)
+            finally:
+                with self._cond:
+                    self._busy = False
+                    self._cond.notify_all()
+
+    def _settle(self, room_id: str, entry: Optional[Dict[str, Any]]) -> None:
+        """写入提交完成（或最终失败）后不再从 _inflight 读取，之后又取出的新写入保留"""
+        with self._cond:
+            if room_id in self._inflight and self._inflight[room_id] is entry:
+                del self._inflight[room_id]
+
+    async def _delete(self, room_id: str) -> None:
+        try:
+            await self._with_retry(
+                lambda: self.client.table(self.table).delete().eq("room_id", room_id).execute()
+            )
+        except Exception as e:
+            self.failures += 1
+            print(f"[ERROR] 从 Supabase 删除失败: {e}")
+
+    async def _upsert_batch(self, rows: List[Dict[str, Any]]) -> None:
+        try:
+            await self._with_retry(lambda: self.client.table(self.table).upsert(rows).execute())
+            self.batches += 1
+            self.rows_written += len(rows)
+        except Exception as e:
+            self.failures += 1
+            print(f"[ERROR] 保存到 Supabase 失败（{len(rows)} 个房间）: {e}")
+            if self.on_write_failed is not None:
+                for row in rows:
+                    self.on_write_failed(row["room_id"], row["data"])
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """等待所有排队的写入完成，返回是否在超时前完成"""
+        self._notify()
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: not self._pending and not self._deletes and not self._busy, timeout
+            )
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """写完剩余数据后停止 I/O 线程"""
+        if self._closed:
+            return
+        self._closed = True
+        self.flush(timeout)
+        self._call(self._stop_writer())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            pending = len(self._pending) + len(self._deletes)
+        return {
+            "pending": pending,
+            "batches": self.batches,
+            "rows_written": self.rows_written,
+            "retries": self.retries,
+            "failures": self.failures,
+        }
@@ -0,0 +1,87 @@
+"""协作任务上下文构建测试（ContextBuilder）
+
+[测试 1] 每种压缩策略下上下文都不超过 token 预算
+[测试 2] 预算充足时前置结果和房间历史原样保留；预算不足时房间历史保留最近的对话
+
+用法: python backend/test_context.py 或 pytest backend/test_context.py
+"""
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+# 设置编码
+if sys.platform == 'win32':
+    sys.stdout.reconfigure(encoding='utf-8')
+
+# 添加路径
+backend_path = Path(__file__).parent
+sys.path.insert(0, str(backend_path))
+
+# 使用本地假模型，不需要 API key（summarize 策略会调用模型）
+os.environ.setdefault("MODEL_PROVIDER", "fake")
+
+from agent_systems.context import COMPACTION_STRATEGIES, ContextBuilder, estimate_tokens
+
+BUDGET = 300
+
+PRIOR_RESULTS = [
+    {"agent_name": "数学家", "output": "预算分配需要按比例计算。" * 60},
+    {"agent_name": "艺术家", "output": "The poster uses a warm palette with large headlines. " * 40},
+    {"agent_name": "工程师", "output": "接口已完成"},
+]
+
+HISTORY = [f"user: 第 {i} 轮对话，讨论海报的尺寸和配色方案" for i in range(1, 41)]
+
+
+def test_budget_per_strategy() -> None:
+    """每种压缩策略下上下文都不超过预算"""
+    print(f"\n[测试 1] 各压缩策略的上下文预算（{BUDGET} tokens）...")
+    for strategy in COMPACTION_STRATEGIES:
+        builder = ContextBuilder("设计一张活动海报", budget_tokens=BUDGET, strategy=strategy)
+        context, stats = asyncio.run(builder.build("医生", PRIOR_RESULTS, history=HISTORY))
+        assert estimate_tokens(context) <= BUDGET, f"{strategy}: {estimate_tokens(context)} > {BUDGET}"
+        assert stats["context_tokens"] == estimate_tokens(context), stats
+        assert stats["full_tokens"] > BUDGET and stats["tokens_saved"] > 0, stats
+        for result in PRIOR_RESULTS:
+            assert context.count(f"- {result['agent_name']}: ") == 1, f"{strategy}: {result['agent_name']} 出现次数不为 1"
+        print(f"  - {strategy}: {stats['context_tokens']} / {stats['full_tokens']} tokens")
+    print("[OK] 所有策略都不超过预算")
+
+
+def test_history() -> None:
+    """预算充足时原样保留；预算不足时保留最近的对话"""
+    print("\n[测试 2] 房间历史...")
+    builder = ContextBuilder("设计一张活动海报", budget_tokens=100000)
+    context, stats = asyncio.run(builder.build("医生", PRIOR_RESULTS, history=HISTORY))
+    assert all(line in context for line in HISTORY), "预算充足时历史应当原样保留"
+    assert PRIOR_RESULTS[0]["output"] in context, "预算充足时前置结果应当原样保留"
+    assert stats["tokens_saved"] == 0, stats
+
+    builder = ContextBuilder("设计一张活动海报", budget_tokens=BUDGET)
+    context, _ = asyncio.run(builder.build("医生", [], history=HISTORY))
+    assert estimate_tokens(context) <= BUDGET, estimate_tokens(context)
+    assert HISTORY[-1] in context, "应当保留最近的对话"
+    assert HISTORY[0] not in context, "应当先丢弃最早的对话"
+    print("[OK] 预算充足时原样保留，预算不足时保留最近的对话")
+
+
+def main() -> None:
+    print("="*60)
+    print("上下文构建测试")
+    print("="*60)
+
+    for test in (test_budget_per_strategy, test_history):
+        try:
+            test()
+        except AssertionError as e:
+            print(f"[ERROR] {test.__doc__}失败: {e}")
+            sys.exit(1)
+
+    print("\n" + "="*60)
+    print("[SUCCESS] 所有测试通过！")
+    print("="*60)
+
+
+if __name__ == "__main__":
+    main()
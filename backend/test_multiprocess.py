@@ -0,0 +1,274 @@
+"""多进程共享状态测试（STATE_SHARED=1）
+
+[测试 1] 多个进程各自创建 StateStore，共用一个共享状态数据库并发更新同一个房间，
+         检查版本号连续、没有丢失更新，监听进程按版本顺序收到其他进程的增量
+[测试 2] 用 uvicorn --workers 3 启动服务（假模型，不需要 API key），并发向同一个房间发消息，
+         检查各 worker 读到的状态一致，WebSocket 客户端能收到其他 worker 产生的变更
+
+用法: python backend/test_multiprocess.py 或 pytest backend/test_multiprocess.py
+"""
+import asyncio
+import json
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# 设置编码
+if sys.platform == 'win32':
+    sys.stdout.reconfigure(encoding='utf-8')
+
+# 添加路径
+backend_path = Path(__file__).parent
+sys.path.insert(0, str(backend_path))
+
+# 测试 1 的规模：写入进程数 × 每个进程的更新次数
+WRITERS = 4
+UPDATES = 50
+ROOM = "multiprocess-test"
+AGENTS = ["mathematician", "artist", "engineer", "merchant", "athlete", "doctor"]
+
+# 测试 2 的 worker 数
+WORKERS = 3
+
+
+def writer(storage_path: str, agent_id: str, ready, start) -> None:
+    """写入进程：把自己的智能体依次移动到 (i, i)"""
+    from state_store import StateStore
+    store = StateStore(storage_path, shared=True)
+    ready.put(agent_id)
+    start.wait()
+    for i in range(1, UPDATES + 1):
+        store.apply_events(ROOM, [{"type": "agent_moved", "agent_id": agent_id, "x": i, "y": i}])
+    store.close()
+
+
+def listener(storage_path: str, ready, result) -> None:
+    """监听进程：收集同步线程通知的 (base_version, version)，直到收到最后一个版本"""
+    from state_store import StateStore
+    store = StateStore(storage_path, shared=True, sync_interval=0.02)
+    versions = []
+    store.subscribe(lambda room_id, delta: versions.append((delta["base_version"], delta["version"])))
+    ready.put("listener")
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if versions and versions[-1][1] >= WRITERS * UPDATES:
+            break
+        time.sleep(0.05)
+    store.close()
+    result.put(versions)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def apply_patch(doc, patch) -> None:
+    """应用 world_delta 中的 JSON Patch（只有 replace 操作）"""
+    for op in patch:
+        parts = op["path"].strip("/").split("/")
+        target = doc
+        for part in parts[:-1]:
+            target = target[int(part)] if isinstance(target, list) else target[part]
+        target[parts[-1]] = op["value"]
+
+
+def check_state_store(tmpdir: str) -> None:
+    print(f"\n[测试 1] {WRITERS} 个进程并发更新同一个房间（每个 {UPDATES} 次）...")
+    storage_path = os.path.join(tmpdir, "store")
+    from state_store import StateStore
+    store = StateStore(storage_path, shared=True)
+    base_version = store.get_versioned_world(ROOM)[0]
+
+    ctx = multiprocessing.get_context("spawn")
+    start = ctx.Event()
+    ready, result = ctx.Queue(), ctx.Queue()
+    watcher = ctx.Process(target=listener, args=(storage_path, ready, result))
+    writers = [
+        ctx.Process(target=writer, args=(storage_path, AGENTS[i], ready, start))
+        for i in range(WRITERS)
+    ]
+    for p in [watcher] + writers:
+        p.start()
+    # 所有进程都创建好 StateStore 之后再同时开始写入
+    for _ in range(WRITERS + 1):
+        ready.get(timeout=60)
+    started = time.perf_counter()
+    start.set()
+    for p in writers:
+        p.join(120)
+    elapsed = time.perf_counter() - started
+    versions = result.get(timeout=60)
+    watcher.join(30)
+
+    if any(p.exitcode != 0 for p in writers + [watcher]):
+        raise AssertionError(f"子进程异常退出: {[p.exitcode for p in writers + [watcher]]}")
+
+    version, world = store.get_versioned_world(ROOM)
+    store.close()
+    expected = base_version + WRITERS * UPDATES
+    if version != expected:
+        raise AssertionError(f"版本号 {version}，期望 {expected}（有更新丢失）")
+    positions = {a["id"]: (a["x"], a["y"]) for a in world["agents"]}
+    for agent_id in AGENTS[:WRITERS]:
+        if positions[agent_id] != (UPDATES, UPDATES):
+            raise AssertionError(f"{agent_id} 的位置为 {positions[agent_id]}，期望 {(UPDATES, UPDATES)}")
+    if [v for _, v in versions] != list(range(base_version + 1, expected + 1)):
+        raise AssertionError(f"监听进程收到的版本不连续: {[v for _, v in versions][:20]}...")
+    if any(base != v - 1 for base, v in versions):
+        raise AssertionError("监听进程收到的增量基准版本不连续")
+
+    print(f"[OK] 最终版本 {version}，没有丢失更新（含进程退出共耗时 {elapsed:.2f} 秒）")
+    print(f"  - 监听进程按顺序收到 {len(versions)} 个增量")
+
+
+async def check_workers(tmpdir: str) -> None:
+    import httpx
+    import websockets
+
+    print(f"\n[测试 2] uvicorn --workers {WORKERS} 共享同一个房间...")
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    env = dict(
+        os.environ,
+        MODEL_PROVIDER="fake",
+        OPENAI_AGENTS_DISABLE_TRACING="1",
+        STATE_SHARED="1",
+        STATE_SHARED_DB_PATH=os.path.join(tmpdir, "shared_state.db"),
+        PYTHONUNBUFFERED="1",
+    )
+    for name in ("SUPABASE_URL", "STATE_WRITE_BEHIND", "STATE_EVENT_LOG"):
+        env.pop(name, None)
+    log = open(os.path.join(tmpdir, "server.log"), "w")
+    server = subprocess.Popen(
+        [
+            sys.executable, "-m", "uvicorn", "app:app",
+            "--app-dir", str(backend_path.resolve()),
+            "--host", "127.0.0.1", "--port", str(port), "--workers", str(WORKERS),
+        ],
+        cwd=tmpdir, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+    try:
+        # 不复用连接，每个请求都可能由不同的 worker 接受
+        limits = httpx.Limits(max_keepalive_connections=0)
+        async with httpx.AsyncClient(base_url=base, timeout=30, limits=limits) as client:
+            # 等待所有 worker 启动：不同的 origin 来自不同的进程
+            origins = set()
+            deadline = time.monotonic() + 60
+            while len(origins) < 2 and time.monotonic() < deadline:
+                try:
+                    health = (await client.get("/api/health")).json()
+                    origins.add(health["state"]["origin"])
+                except (httpx.HTTPError, KeyError):
+                    await asyncio.sleep(0.2)
+            if len(origins) < 2:
+                raise AssertionError(f"没有观察到多个 worker（origin: {origins}）")
+            print(f"[OK] 服务已启动，观察到 {len(origins)} 个 worker")
+
+            # 假模型的 update_world_state 固定写入 default 房间
+            room = "default"
+            await client.delete(f"/api/rooms/{room}")
+            async with websockets.connect(f"ws://127.0.0.1:{port}/ws/rooms/{room}") as ws:
+                first = json.loads(await ws.recv())
+                ws_version, doc = first["version"], first["data"]
+
+                # 每个智能体一条消息，各个 worker 并发处理
+                responses = await asyncio.gather(*[
+                    client.post(f"/api/rooms/{room}/message",
+                                json={"message": f"多进程任务 {agent_id}", "target_agent": agent_id})
+                    for agent_id in AGENTS
+                ])
+                for response in responses:
+                    if response.status_code != 200:
+                        raise AssertionError(f"消息请求失败: {response.status_code} {response.text}")
+
+                # 每次读取都可能落在不同的 worker 上，状态必须一致
+                states = [(await client.get(f"/api/rooms/{room}/state")).json() for _ in range(WORKERS * 4)]
+                if any(s != states[0] for s in states):
+                    raise AssertionError(f"各 worker 读到的状态不一致: {sorted({s['version'] for s in states})}")
+                state = states[0]
+                tasks = {a["id"]: a["currentTask"] for a in state["world_state"]["agents"]}
+                for agent_id in AGENTS:
+                    if f"多进程任务 {agent_id}" not in (tasks[agent_id] or ""):
+                        raise AssertionError(f"{agent_id} 的任务为 {tasks[agent_id]!r}（更新丢失）")
+                print(f"[OK] {len(AGENTS)} 条并发消息全部生效，{len(states)} 次读取的状态一致（版本 {state['version']}）")
+
+                # WebSocket 连接在某一个 worker 上，也要收到其他 worker 产生的变更
+                deadline = time.monotonic() + 10
+                while ws_version < state["version"] and time.monotonic() < deadline:
+                    message = json.loads(await asyncio.wait_for(ws.recv(), 10))
+                    if message["type"] == "world_delta":
+                        if message["base_version"] != ws_version:
+                            raise AssertionError(f"增量不连续: {ws_version} → {message['base_version']}")
+                        apply_patch(doc, message["patch"])
+                        ws_version = message["version"]
+                    elif message["type"] == "world_state":
+                        ws_version, doc = message["version"], message["data"]
+                if ws_version != state["version"]:
+                    raise AssertionError(f"WebSocket 客户端停留在版本 {ws_version}，期望 {state['version']}")
+                if doc != state["world_state"]:
+                    raise AssertionError("WebSocket 客户端的状态与服务端不一致")
+                print(f"[OK] WebSocket 客户端同步到版本 {ws_version}")
+    finally:
+        server.terminate()
+        try:
+            server.wait(15)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        log.close()
+
+
+def server_log(tmpdir: str) -> str:
+    """测试 2 中服务输出的最后一部分"""
+    log_path = os.path.join(tmpdir, "server.log")
+    if not os.path.exists(log_path):
+        return ""
+    return Path(log_path).read_text(encoding="utf-8")[-3000:]
+
+
+def test_state_store_processes(tmp_path) -> None:
+    """多个进程共用一个共享状态数据库，版本号收敛且没有丢失更新"""
+    check_state_store(str(tmp_path))
+
+
+def test_uvicorn_workers(tmp_path) -> None:
+    """多个 uvicorn worker 共用 STATE_SHARED_DB_PATH，读到的版本和状态一致"""
+    try:
+        asyncio.run(check_workers(str(tmp_path)))
+    except Exception:
+        print(server_log(str(tmp_path)))
+        raise
+
+
+def main() -> None:
+    print("="*60)
+    print("多进程共享状态测试")
+    print("="*60)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        try:
+            check_state_store(tmpdir)
+        except Exception as e:
+            print(f"[ERROR] 共享状态存储测试失败: {e}")
+            sys.exit(1)
+
+        try:
+            asyncio.run(check_workers(tmpdir))
+        except Exception as e:
+            print(f"[ERROR] 多 worker 测试失败: {e}")
+            print(server_log(tmpdir))
+            sys.exit(1)
+
+    print("\n" + "="*60)
+    print("[SUCCESS] 所有测试通过！")
+    print("="*60)
+
+
+if __name__ == "__main__":
+    main()
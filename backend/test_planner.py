@@ -0,0 +1,157 @@
+"""任务规划测试（PlanCache / validate_plan / plan_task_async）
+
+[测试 1] PlanCache 按 TTL 过期、超过容量时淘汰最久未使用的条目
+[测试 2] validate_plan 拒绝结构不合法或智能体不存在的规划
+[测试 3] 合法的规划被缓存；不合法的规划返回降级结果且不缓存；准入被拒绝时直接抛出
+
+用法: python backend/test_planner.py 或 pytest backend/test_planner.py
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+# 设置编码
+if sys.platform == 'win32':
+    sys.stdout.reconfigure(encoding='utf-8')
+
+# 添加路径
+backend_path = Path(__file__).parent
+sys.path.insert(0, str(backend_path))
+
+# 使用本地假模型，不需要 API key
+os.environ.setdefault("MODEL_PROVIDER", "fake")
+
+from admission import AdmissionRejected
+from agent_systems import planner
+from agent_systems.fake_models import _Completion
+from agent_systems.planner import PlanCache, plan_cache, plan_task_async, validate_plan
+
+VALID_PLAN = {
+    "description": "设计海报",
+    "steps": [
+        {"agent": "artist", "instruction": "设计版式", "reason": "负责视觉设计"},
+        {"agent": "engineer", "instruction": "实现页面", "reason": "负责技术实现"},
+    ],
+}
+
+
+def _raises(plan, message: str) -> None:
+    try:
+        validate_plan(plan)
+    except ValueError:
+        return
+    raise AssertionError(message)
+
+
+def test_plan_cache() -> None:
+    """PlanCache 按 TTL 过期、按 LRU 淘汰"""
+    print("\n[测试 1] PlanCache 的 TTL 和 LRU 淘汰...")
+    cache = PlanCache(max_size=2, ttl=60)
+    cache.set("a", {"plan": "a"})
+    cache.set("b", {"plan": "b"})
+    assert cache.get("a") == {"plan": "a"}
+    cache.set("c", {"plan": "c"})
+    assert cache.get("b") is None, "最久未使用的 b 应当被淘汰"
+    assert cache.get("a") is not None and cache.get("c") is not None
+    assert len(cache) == 2
+
+    cache = PlanCache(max_size=2, ttl=0.05)
+    cache.set("a", {"plan": "a"})
+    time.sleep(0.1)
+    assert cache.get("a") is None, "过期的条目应当失效"
+    assert len(cache) == 0
+
+    cache = PlanCache(max_size=0)
+    cache.set("a", {"plan": "a"})
+    assert cache.get("a") is None, "容量为 0 时不缓存"
+    print("[OK] 过期、LRU 淘汰和容量为 0 均符合预期")
+
+
+def test_validate_plan() -> None:
+    """validate_plan 拒绝不合法的规划"""
+    print("\n[测试 2] validate_plan...")
+    assert validate_plan(VALID_PLAN) is VALID_PLAN
+    _raises(["artist"], "不是 JSON 对象的规划应当被拒绝")
+    _raises({"steps": []}, "缺少 description 的规划应当被拒绝")
+    _raises({"description": "x", "steps": "artist"}, "steps 不是列表的规划应当被拒绝")
+    _raises({"description": "x", "steps": ["artist"]}, "步骤不是 JSON 对象的规划应当被拒绝")
+    _raises({"description": "x", "steps": [{"agent": "wizard", "instruction": "x", "reason": "x"}]},
+            "智能体不存在的规划应当被拒绝")
+    _raises({"description": "x", "steps": [{"agent": "artist", "instruction": "x"}]},
+            "缺少 reason 的规划应当被拒绝")
+    print("[OK] 不合法的规划均被拒绝")
+
+
+async def _plan_with(create, description: str):
+    """用 create 替换规划器的上游调用后规划一次，返回 (规划, 上游调用次数)"""
+    completions = planner.async_client.chat.completions
+    original = completions.create
+    calls = []
+
+    async def counted(**kwargs):
+        calls.append(kwargs)
+        return await create(**kwargs)
+
+    completions.create = counted
+    try:
+        return await plan_task_async(description), len(calls)
+    finally:
+        completions.create = original
+
+
+def test_plan_task_async() -> None:
+    """合法的规划被缓存，不合法的规划降级且不缓存，准入被拒绝时抛出"""
+    print("\n[测试 3] plan_task_async 的缓存和降级...")
+    plan_cache.clear()
+
+    async def valid(**kwargs):
+        return _Completion(json.dumps(VALID_PLAN, ensure_ascii=False), 100)
+
+    async def invalid(**kwargs):
+        return _Completion(json.dumps({"description": "x", "steps": [{"agent": "wizard"}]}), 100)
+
+    async def rejected(**kwargs):
+        raise AdmissionRejected("batch", 1, 1.0, "queue_full")
+
+    plan, calls = asyncio.run(_plan_with(invalid, "不合法的规划"))
+    assert plan == {"description": "不合法的规划", "steps": []} and calls == 1, plan
+    plan, calls = asyncio.run(_plan_with(invalid, "不合法的规划"))
+    assert calls == 1, "不合法的规划不应被缓存"
+
+    plan, calls = asyncio.run(_plan_with(valid, "设计海报"))
+    assert plan == VALID_PLAN and calls == 1, plan
+    plan, calls = asyncio.run(_plan_with(valid, "  设计海报 "))
+    assert plan == VALID_PLAN and calls == 0, "规范化后相同的描述应当命中缓存"
+
+    try:
+        asyncio.run(_plan_with(rejected, "准入被拒绝"))
+    except AdmissionRejected:
+        pass
+    else:
+        raise AssertionError("准入被拒绝时应当抛出 AdmissionRejected，而不是返回降级结果")
+    plan_cache.clear()
+    print("[OK] 合法规划命中缓存，不合法规划降级，准入错误直接抛出")
+
+
+def main() -> None:
+    print("="*60)
+    print("任务规划测试")
+    print("="*60)
+
+    for test in (test_plan_cache, test_validate_plan, test_plan_task_async):
+        try:
+            test()
+        except AssertionError as e:
+            print(f"[ERROR] {test.__doc__}失败: {e}")
+            sys.exit(1)
+
+    print("\n" + "="*60)
+    print("[SUCCESS] 所有测试通过！")
+    print("="*60)
+
+
+if __name__ == "__main__":
+    main()
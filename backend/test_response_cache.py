@@ -0,0 +1,122 @@
+"""响应缓存测试（RESPONSE_CACHE）
+
+[测试 1] 新房间中相同的请求命中其他房间产生的缓存，会话条目和世界状态事件应用到当前房间
+[测试 2] 清空房间时删除该房间产生的缓存条目
+
+用法: python backend/test_response_cache.py 或 pytest backend/test_response_cache.py
+"""
+import asyncio
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# 设置编码
+if sys.platform == 'win32':
+    sys.stdout.reconfigure(encoding='utf-8')
+
+# 添加路径
+backend_path = Path(__file__).parent
+sys.path.insert(0, str(backend_path))
+
+# 使用本地假模型，不需要 API key
+os.environ.setdefault("MODEL_PROVIDER", "fake")
+
+from agents.memory import SQLiteSession
+
+import state_store
+from response_cache import ResponseCache
+from state_store import StateStore
+
+
+async def _ask(cache: ResponseCache, room_id: str, calls: list):
+    """模拟一次 /message：写入会话、移动数学家，返回 (结果, 是否命中)"""
+    session = SQLiteSession(room_id)
+
+    async def run():
+        calls.append(room_id)
+        await session.add_items([
+            {"role": "user", "content": "去广场"},
+            {"role": "assistant", "content": "好的，我去广场"},
+        ])
+        state_store.get_state_store().apply_events(
+            room_id, [{"type": "agent_moved", "agent_id": "mathematician", "x": 7, "y": 3}]
+        )
+        return {"output": "好的，我去广场"}
+
+    value, cached = await cache.run_cached(room_id, session, "message", "数学家", "  去广场 ", run)
+    return value, cached, await session.get_items()
+
+
+def _with_cache(check) -> None:
+    """在临时目录中创建状态存储和响应缓存后运行 check(cache)"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        previous = state_store._state_store
+        state_store._state_store = StateStore(str(Path(tmpdir) / "state"), storage="json")
+        cache = ResponseCache(str(Path(tmpdir) / "cache.db"), enabled=True)
+        try:
+            check(cache)
+        finally:
+            cache.close()
+            state_store._state_store.close()
+            state_store._state_store = previous
+
+
+def test_identical_request_hits() -> None:
+    """第二个相同的请求命中缓存，不再运行"""
+    print("\n[测试 1] 相同请求命中缓存...")
+
+    def check(cache: ResponseCache) -> None:
+        calls = []
+        first, cached, _ = asyncio.run(_ask(cache, "room-a", calls))
+        assert not cached, "第一次请求不应命中"
+        second, cached, items = asyncio.run(_ask(cache, "room-b", calls))
+        assert cached, "相同的第二次请求应当命中"
+        assert calls == ["room-a"], f"命中时不应运行: {calls}"
+        assert second == first
+        assert [item["content"] for item in items] == ["去广场", "好的，我去广场"], "会话条目未写入当前房间"
+        world = state_store.get_state_store().get_world("room-b")
+        position = next((a["x"], a["y"]) for a in world["agents"] if a["id"] == "mathematician")
+        assert position == (7, 3), f"世界状态事件未重放到当前房间: {position}"
+        stats = cache.stats()
+        assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 1), stats
+        print(f"[OK] 第二次请求命中（{stats}）")
+
+    _with_cache(check)
+
+
+def test_invalidate_room() -> None:
+    """清空房间时删除该房间产生的缓存条目"""
+    print("\n[测试 2] 清空房间时删除缓存...")
+
+    def check(cache: ResponseCache) -> None:
+        calls = []
+        asyncio.run(_ask(cache, "room-a", calls))
+        assert cache.invalidate_room("room-a") == 1
+        _, cached, _ = asyncio.run(_ask(cache, "room-a", calls))
+        assert not cached, "清空后不应命中"
+        assert calls == ["room-a", "room-a"]
+        print("[OK] 清空房间后重新运行")
+
+    _with_cache(check)
+
+
+def main() -> None:
+    print("="*60)
+    print("响应缓存测试")
+    print("="*60)
+
+    for test in (test_identical_request_hits, test_invalidate_room):
+        try:
+            test()
+        except AssertionError as e:
+            print(f"[ERROR] {test.__doc__}失败: {e}")
+            sys.exit(1)
+
+    print("\n" + "="*60)
+    print("[SUCCESS] 所有测试通过！")
+    print("="*60)
+
+
+if __name__ == "__main__":
+    main()
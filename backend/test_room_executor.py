@@ -0,0 +1,133 @@
+"""房间执行器测试（RoomExecutor）
+
+[测试 1] 同一房间的运行按提交顺序串行执行，不同房间并行执行
+[测试 2] exclusive() 独占房间期间，同一房间的其他运行等待，其他房间不受影响
+[测试 3] 合并模式下，排队中发给同一目标的消息合并为一次运行
+
+用法: python backend/test_room_executor.py 或 pytest backend/test_room_executor.py
+"""
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+# 设置编码
+if sys.platform == 'win32':
+    sys.stdout.reconfigure(encoding='utf-8')
+
+# 添加路径
+backend_path = Path(__file__).parent
+sys.path.insert(0, str(backend_path))
+
+from room_executor import RoomExecutor
+
+DELAY = 0.05
+
+
+def test_serial_per_room() -> None:
+    """同一房间串行，不同房间并行"""
+    print("\n[测试 1] 同一房间串行、不同房间并行...")
+
+    async def check() -> None:
+        executor = RoomExecutor(coalesce=False)
+        running = {"room-a": 0, "room-b": 0}
+        peak = {"room-a": 0, "room-b": 0}
+        order = []
+
+        async def work(room_id: str, index: int):
+            running[room_id] += 1
+            peak[room_id] = max(peak[room_id], running[room_id])
+            await asyncio.sleep(DELAY)
+            order.append((room_id, index))
+            running[room_id] -= 1
+            return index
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*[
+            executor.run(room_id, lambda room_id=room_id, i=i: work(room_id, i))
+            for i in range(4) for room_id in ("room-a", "room-b")
+        ])
+        elapsed = time.perf_counter() - started
+
+        assert results == [i for i in range(4) for _ in range(2)], results
+        assert peak == {"room-a": 1, "room-b": 1}, f"同一房间的运行出现并发: {peak}"
+        for room_id in ("room-a", "room-b"):
+            assert [i for r, i in order if r == room_id] == [0, 1, 2, 3], order
+        # 串行时每个房间约 4 × DELAY；两个房间并行，总时间远小于 8 × DELAY
+        assert elapsed < 6 * DELAY, f"不同房间没有并行执行: {elapsed:.3f} 秒"
+        print(f"[OK] 每个房间最大并发 1，两个房间共耗时 {elapsed:.3f} 秒")
+
+    asyncio.run(check())
+
+
+def test_exclusive() -> None:
+    """独占房间期间同一房间的其他运行等待"""
+    print("\n[测试 2] exclusive() 独占房间...")
+
+    async def check() -> None:
+        executor = RoomExecutor(coalesce=False)
+        events = []
+
+        async def record(name: str):
+            events.append(name)
+
+        async with executor.exclusive("room-a"):
+            waiting = asyncio.ensure_future(executor.run("room-a", lambda: record("room-a")))
+            await executor.run("room-b", lambda: record("room-b"))
+            await asyncio.sleep(DELAY)
+            assert events == ["room-b"], f"独占期间同一房间的运行不应开始: {events}"
+            assert executor.depth("room-a")["queued"] >= 1
+        await waiting
+        assert events == ["room-b", "room-a"], events
+        print("[OK] 独占结束后才执行同一房间的运行")
+
+    asyncio.run(check())
+
+
+def test_coalesce() -> None:
+    """排队中发给同一目标的消息合并为一次运行"""
+    print("\n[测试 3] 合并排队中的消息...")
+
+    async def check() -> None:
+        executor = RoomExecutor(coalesce=True)
+        batches = []
+
+        async def run_messages(messages):
+            batches.append(list(messages))
+            await asyncio.sleep(DELAY)
+            return len(messages)
+
+        async with executor.exclusive("room-a"):
+            waiters = [
+                asyncio.ensure_future(executor.run_coalesced("room-a", "artist", f"消息 {i}", run_messages))
+                for i in range(3)
+            ]
+            await asyncio.sleep(0)
+        results = await asyncio.gather(*waiters)
+        assert batches == [["消息 0", "消息 1", "消息 2"]], batches
+        assert results == [3, 3, 3], results
+        assert executor.stats()["coalesced"] == 2, executor.stats()
+        print(f"[OK] 3 条消息合并为 {len(batches)} 次运行")
+
+    asyncio.run(check())
+
+
+def main() -> None:
+    print("="*60)
+    print("房间执行器测试")
+    print("="*60)
+
+    for test in (test_serial_per_room, test_exclusive, test_coalesce):
+        try:
+            test()
+        except AssertionError as e:
+            print(f"[ERROR] {test.__doc__}失败: {e}")
+            sys.exit(1)
+
+    print("\n" + "="*60)
+    print("[SUCCESS] 所有测试通过！")
+    print("="*60)
+
+
+if __name__ == "__main__":
+    main()
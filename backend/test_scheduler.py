@@ -0,0 +1,130 @@
+"""协作任务调度测试（依赖图）
+
+[测试 1] 依赖图按拓扑顺序排列，parallel_groups 按组依赖
+[测试 2] 存在环、未知智能体、依赖自身时抛出 ValueError
+[测试 3] 按依赖图执行：前置步骤完成后才开始，无依赖的步骤并行
+
+用法: python backend/test_scheduler.py 或 pytest backend/test_scheduler.py
+"""
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+# 设置编码
+if sys.platform == 'win32':
+    sys.stdout.reconfigure(encoding='utf-8')
+
+# 添加路径
+backend_path = Path(__file__).parent
+sys.path.insert(0, str(backend_path))
+
+# 使用本地假模型，不需要 API key
+os.environ.setdefault("MODEL_PROVIDER", "fake")
+
+from agent_systems.scheduler import build_dependency_graph, run_dependency_graph
+
+
+def _raises(call, message: str) -> str:
+    """call() 应当抛出 ValueError，返回错误信息"""
+    try:
+        call()
+    except ValueError as e:
+        return str(e)
+    raise AssertionError(message)
+
+
+def test_topological_order() -> None:
+    """依赖图按拓扑顺序排列"""
+    print("\n[测试 1] 依赖图的拓扑顺序...")
+    graph = build_dependency_graph(
+        ["engineer", "artist", "mathematician"],
+        {"engineer": ["mathematician"], "artist": ["engineer"]},
+    )
+    assert list(graph) == ["mathematician", "engineer", "artist"], list(graph)
+    assert graph == {"mathematician": [], "engineer": ["mathematician"], "artist": ["engineer"]}, graph
+
+    graph = build_dependency_graph(
+        ["mathematician", "artist", "engineer"],
+        parallel_groups=[["mathematician", "artist"], ["engineer"]],
+    )
+    assert graph["engineer"] == ["mathematician", "artist"], graph
+    assert graph["mathematician"] == [] and graph["artist"] == [], graph
+    print(f"[OK] 拓扑顺序: {list(graph)}")
+
+
+def test_invalid_dependencies() -> None:
+    """存在环、未知智能体、依赖自身时抛出 ValueError"""
+    print("\n[测试 2] 不合法的依赖关系...")
+    error = _raises(
+        lambda: build_dependency_graph(
+            ["mathematician", "artist", "engineer"],
+            {"mathematician": ["engineer"], "artist": ["mathematician"], "engineer": ["artist"]},
+        ),
+        "存在环时应当抛出 ValueError",
+    )
+    assert "环" in error, error
+    error = _raises(
+        lambda: build_dependency_graph(["mathematician", "artist"], {"artist": ["doctor"]}),
+        "依赖未知智能体时应当抛出 ValueError",
+    )
+    assert "doctor" in error, error
+    error = _raises(
+        lambda: build_dependency_graph(["mathematician"], {"doctor": ["mathematician"]}),
+        "为未知智能体声明依赖时应当抛出 ValueError",
+    )
+    assert "doctor" in error, error
+    _raises(
+        lambda: build_dependency_graph(["mathematician"], {"mathematician": ["mathematician"]}),
+        "依赖自身时应当抛出 ValueError",
+    )
+    _raises(
+        lambda: build_dependency_graph(["mathematician", "mathematician"]),
+        "agent_order 重复时应当抛出 ValueError",
+    )
+    print("[OK] 环、未知智能体、依赖自身、重复智能体均被拒绝")
+
+
+def test_run_dependency_graph() -> None:
+    """前置步骤完成后才开始，无依赖的步骤并行"""
+    print("\n[测试 3] 按依赖图执行...")
+    graph = build_dependency_graph(
+        ["mathematician", "artist", "engineer"], {"engineer": ["mathematician", "artist"]}
+    )
+    running, peak, finished = set(), [0], []
+
+    async def run_step(agent_id, prior_results):
+        assert sorted(r["agent_id"] for r in prior_results) == sorted(graph[agent_id]), prior_results
+        running.add(agent_id)
+        peak[0] = max(peak[0], len(running))
+        await asyncio.sleep(0.05)
+        running.discard(agent_id)
+        finished.append(agent_id)
+        return {"agent_id": agent_id}
+
+    results = asyncio.run(run_dependency_graph(graph, run_step, max_concurrency=4))
+    assert set(results) == {"mathematician", "artist", "engineer"}, results
+    assert finished[-1] == "engineer", finished
+    assert peak[0] == 2, f"无依赖的两个步骤应当并行，最大并发 {peak[0]}"
+    print(f"[OK] 执行顺序 {finished}，最大并发 {peak[0]}")
+
+
+def main() -> None:
+    print("="*60)
+    print("协作任务调度测试")
+    print("="*60)
+
+    for test in (test_topological_order, test_invalid_dependencies, test_run_dependency_graph):
+        try:
+            test()
+        except AssertionError as e:
+            print(f"[ERROR] {test.__doc__}失败: {e}")
+            sys.exit(1)
+
+    print("\n" + "="*60)
+    print("[SUCCESS] 所有测试通过！")
+    print("="*60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""会话缓存测试（SessionManager）
+
+[测试 1] 超过 max_sessions 时淘汰最久未使用的会话，重新打开后历史仍在
+[测试 2] 空闲超过 idle_ttl 的会话被淘汰
+[测试 3] lease() 使用中的会话不会被淘汰关闭，结束使用后再按需淘汰
+
+用法: python backend/test_sessions.py 或 pytest backend/test_sessions.py
+"""
+import asyncio
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# 设置编码
+if sys.platform == 'win32':
+    sys.stdout.reconfigure(encoding='utf-8')
+
+# 添加路径
+backend_path = Path(__file__).parent
+sys.path.insert(0, str(backend_path))
+
+from sessions import SessionManager
+
+
+def _with_manager(check, **kwargs) -> None:
+    """在临时目录中创建共用数据库的会话管理器后运行 check(manager)"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        manager = SessionManager(
+            shared_db=True, db_path=str(Path(tmpdir) / "sessions.db"), compaction=False, **kwargs
+        )
+        try:
+            check(manager)
+        finally:
+            manager.close()
+
+
+def test_lru_eviction() -> None:
+    """超过 max_sessions 时淘汰最久未使用的会话"""
+    print("\n[测试 1] LRU 淘汰...")
+
+    def check(manager: SessionManager) -> None:
+        first = manager.get("room-1")
+        asyncio.run(first.add_items([{"role": "user", "content": "你好"}]))
+        manager.get("room-2")
+        manager.get("room-1")
+        manager.get("room-3")
+        stats = manager.stats()
+        assert stats["open_sessions"] == 2 and stats["evictions"] == 1, stats
+        assert manager.get("room-1") is first, "最近使用的 room-1 不应被淘汰"
+        manager.get("room-2")
+        assert manager.stats()["misses"] == 4, "被淘汰的 room-2 应当重新打开"
+        items = asyncio.run(manager.get("room-1").get_items())
+        assert [item["content"] for item in items] == ["你好"], "重新打开后历史应当仍在"
+        print(f"[OK] {manager.stats()}")
+
+    _with_manager(check, max_sessions=2, idle_ttl=0)
+
+
+def test_idle_ttl() -> None:
+    """空闲超过 idle_ttl 的会话被淘汰"""
+    print("\n[测试 2] 空闲超时淘汰...")
+
+    def check(manager: SessionManager) -> None:
+        first = manager.get("room-1")
+        time.sleep(0.1)
+        manager.get("room-2")
+        stats = manager.stats()
+        assert stats["open_sessions"] == 1 and stats["evictions"] == 1, stats
+        assert manager.get("room-1") is not first, "空闲超时的会话应当重新打开"
+        print(f"[OK] {manager.stats()}")
+
+    _with_manager(check, max_sessions=10, idle_ttl=0.05)
+
+
+def test_lease() -> None:
+    """使用中的会话不会被淘汰关闭"""
+    print("\n[测试 3] 使用中的会话...")
+
+    def check(manager: SessionManager) -> None:
+        with manager.lease("room-1") as leased:
+            for i in range(2, 6):
+                manager.get(f"room-{i}")
+            assert manager.get("room-1") is leased, "使用中的会话不应被淘汰"
+            # 淘汰时跳过使用中的会话，仍然可以读写
+            asyncio.run(leased.add_items([{"role": "user", "content": "使用中"}]))
+            assert manager.stats()["leased_sessions"] == 1
+        stats = manager.stats()
+        assert stats["open_sessions"] == 2 and stats["leased_sessions"] == 0, stats
+        # room-1 刚刚使用过，按 LRU 保留；之后的访问把它挤出
+        manager.get("room-6")
+        manager.get("room-7")
+        assert manager.get("room-1") is not leased, "结束使用后应当按需淘汰"
+        items = asyncio.run(manager.get("room-1").get_items())
+        assert [item["content"] for item in items] == ["使用中"], items
+        print(f"[OK] {manager.stats()}")
+
+    _with_manager(check, max_sessions=2, idle_ttl=0)
+
+
+def main() -> None:
+    print("="*60)
+    print("会话缓存测试")
+    print("="*60)
+
+    for test in (test_lru_eviction, test_idle_ttl, test_lease):
+        try:
+            test()
+        except AssertionError as e:
+            print(f"[ERROR] {test.__doc__}失败: {e}")
+            sys.exit(1)
+
+    print("\n" + "="*60)
+    print("[SUCCESS] 所有测试通过！")
+    print("="*60)
+
+
+if __name__ == "__main__":
+    main()
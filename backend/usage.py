@@ -0,0 +1,426 @@
+"""模型用量统计和预算
+
+每次模型调用的 token 用量（来自 Runner 的 on_llm_end 钩子，以及规划器、摘要的 chat.completions 响应）
+按 日期（UTC）× 房间 × 智能体 × 接口 累加，写回到状态存储目录下的 SQLite 数据库（USAGE_DB_PATH）。
+房间和接口由请求处理函数通过 usage_scope() 指定，随 contextvars 传递到执行队列和协作步骤中。
+
+预算按天计算：房间的 token 数 / 费用，以及全部房间的总费用。超出后按 USAGE_BUDGET_ACTION 处理：
+    reject      拒绝新的请求（HTTP 429）
+    downgrade   继续处理，但限制每次模型调用的输出长度（USAGE_DOWNGRADE_MAX_TOKENS），
+                设置了 USAGE_DOWNGRADE_MODEL 时同时换用该模型
+"""
+import atexit
+import contextvars
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from agents import ModelSettings, RunConfig
+
+from metrics import add_usage_listener
+
+USAGE_DB_PATH = os.getenv("USAGE_DB_PATH", "backend/data/usage.db")
+# 后台写回间隔（秒）
+USAGE_FLUSH_INTERVAL = float(os.getenv("USAGE_FLUSH_INTERVAL", "2.0"))
+# 每百万 token 的价格（美元），默认为 gpt-4o-mini 的价格
+USAGE_PRICE_INPUT = float(os.getenv("USAGE_PRICE_INPUT", "0.15"))
+USAGE_PRICE_OUTPUT = float(os.getenv("USAGE_PRICE_OUTPUT", "0.60"))
+# 每天的预算，0 表示不限制
+USAGE_ROOM_DAILY_TOKENS = int(os.getenv("USAGE_ROOM_DAILY_TOKENS", "0"))
+USAGE_ROOM_DAILY_COST = float(os.getenv("USAGE_ROOM_DAILY_COST", "0"))
+USAGE_DAILY_COST = float(os.getenv("USAGE_DAILY_COST", "0"))
+# 超出预算后的处理方式：reject / downgrade
+USAGE_BUDGET_ACTION = os.getenv("USAGE_BUDGET_ACTION", "reject")
+USAGE_DOWNGRADE_MAX_TOKENS = int(os.getenv("USAGE_DOWNGRADE_MAX_TOKENS", "256"))
+USAGE_DOWNGRADE_MODEL = os.getenv("USAGE_DOWNGRADE_MODEL", "")
+
+BUDGET_ACTIONS = ("reject", "downgrade")
+if USAGE_BUDGET_ACTION not in BUDGET_ACTIONS:
+    raise ValueError(f"未知的预算处理方式 '{USAGE_BUDGET_ACTION}'。可用方式: {list(BUDGET_ACTIONS)}")
+
+# 汇总查询可用的分组字段
+GROUP_FIELDS = ("day", "room_id", "agent_id", "endpoint")
+
+
+def _today() -> str:
+    return time.strftime("%Y-%m-%d", time.gmtime())
+
+
+def _agent_id(name: str) -> str:
+    """Runner 钩子给出的是智能体名称，统一记为英文 ID（triage 和不在注册表中的名称原样保留）"""
+    from agent_systems.registry import get_agent_registry
+    registry = get_agent_registry()
+    if name == registry.triage.name:
+        return "triage"
+    return registry.resolve_id(name) or name
+
+
+class UsageScope:
+    """一次请求的用量归属（房间、接口）和累计用量"""
+
+    __slots__ = ("room_id", "endpoint", "downgraded", "calls", "input_tokens", "output_tokens", "cost")
+
+    def __init__(self, room_id: str, endpoint: str, downgraded: bool = False):
+        self.room_id = room_id
+        self.endpoint = endpoint
+        self.downgraded = downgraded
+        self.calls = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cost = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "total_tokens": self.input_tokens + self.output_tokens,
+            "cost_usd": round(self.cost, 8),
+            "downgraded": self.downgraded,
+        }
+
+
+_current_scope: contextvars.ContextVar[Optional[UsageScope]] = contextvars.ContextVar("usage_scope", default=None)
+
+
+@contextmanager
+def usage_scope(room_id: str, endpoint: str, downgraded: bool = False) -> Iterator[UsageScope]:
+    """with 块内（包括其中创建的任务）的模型调用记到该房间和接口名下"""
+    scope = UsageScope(room_id, endpoint, downgraded)
+    token = _current_scope.set(scope)
+    try:
+        yield scope
+    finally:
+        _current_scope.reset(token)
+
+
+def current_usage_scope() -> Optional[UsageScope]:
+    return _current_scope.get()
+
+
+def bind_usage_scope(room_id: str, endpoint: str, downgraded: bool = False) -> UsageScope:
+    """流式接口使用：在请求处理函数中设置，作用到本请求结束（包括之后的流式响应）
+
+    SSE 的每个事件在单独的任务中产生（见 streaming.sse_stream），在生成器里用 with 设置的作用域
+    不会带到后续事件，所以在返回响应之前设置，由这些任务从请求的上下文中继承。
+    """
+    scope = UsageScope(room_id, endpoint, downgraded)
+    _current_scope.set(scope)
+    return scope
+
+
+def run_config() -> Optional[RunConfig]:
+    """当前请求已降级时限制输出长度（并换用降级模型），由 resilience.run_config 叠加超时和重试设置"""
+    scope = _current_scope.get()
+    if scope is None or not scope.downgraded:
+        return None
+    return RunConfig(
+        model=USAGE_DOWNGRADE_MODEL or None,
+        model_settings=ModelSettings(max_tokens=USAGE_DOWNGRADE_MAX_TOKENS),
+    )
+
+
+class BudgetStatus:
+    """预算检查结果：exceeded 为超出的原因（未超出时为 None）"""
+
+    __slots__ = ("exceeded", "action")
+
+    def __init__(self, exceeded: Optional[str], action: str):
+        self.exceeded = exceeded
+        self.action = action
+
+    @property
+    def rejected(self) -> bool:
+        return self.exceeded is not None and self.action == "reject"
+
+    @property
+    def downgraded(self) -> bool:
+        return self.exceeded is not None and self.action == "downgrade"
+
+
+class UsageTracker:
+    """按 日期 × 房间 × 智能体 × 接口 累加用量，后台线程批量写入 SQLite"""
+
+    def __init__(
+        self,
+        db_path: str = USAGE_DB_PATH,
+        flush_interval: Optional[float] = None,
+        price_input: Optional[float] = None,
+        price_output: Optional[float] = None,
+        room_daily_tokens: Optional[int] = None,
+        room_daily_cost: Optional[float] = None,
+        daily_cost: Optional[float] = None,
+        budget_action: Optional[str] = None,
+    ):
+        self.db_path = db_path
+        self.flush_interval = USAGE_FLUSH_INTERVAL if flush_interval is None else flush_interval
+        self.price_input = USAGE_PRICE_INPUT if price_input is None else price_input
+        self.price_output = USAGE_PRICE_OUTPUT if price_output is None else price_output
+        self.room_daily_tokens = USAGE_ROOM_DAILY_TOKENS if room_daily_tokens is None else room_daily_tokens
+        self.room_daily_cost = USAGE_ROOM_DAILY_COST if room_daily_cost is None else room_daily_cost
+        self.daily_cost = USAGE_DAILY_COST if daily_cost is None else daily_cost
+        self.budget_action = budget_action or USAGE_BUDGET_ACTION
+
+        self._lock = threading.Lock()
+        # 尚未写入数据库的增量：(日期, 房间, 智能体, 接口) → [调用次数, 输入 token, 输出 token, 费用]
+        self._pending: Dict[Tuple[str, str, str, str], List[float]] = {}
+        # 当天各房间的累计用量（预算检查用）：房间 → [token, 费用]
+        self._day = _today()
+        self._daily: Dict[str, List[float]] = {}
+        # 房间单独设置的预算：房间 → (每天 token, 每天费用)，None 表示使用默认值
+        self._budgets: Dict[str, Tuple[Optional[int], Optional[float]]] = {}
+
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS usage ("
+                "day TEXT NOT NULL, room_id TEXT NOT NULL, agent_id TEXT NOT NULL, endpoint TEXT NOT NULL, "
+                "calls INTEGER NOT NULL, input_tokens INTEGER NOT NULL, output_tokens INTEGER NOT NULL, "
+                "cost REAL NOT NULL, PRIMARY KEY (day, room_id, agent_id, endpoint))"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS usage_budgets ("
+                "room_id TEXT PRIMARY KEY, daily_tokens INTEGER, daily_cost REAL)"
+            )
+        self._load_daily_locked()
+        for room_id, tokens, cost in self._conn.execute(
+            "SELECT room_id, daily_tokens, daily_cost FROM usage_budgets"
+        ):
+            self._budgets[room_id] = (tokens, cost)
+
+        self._stop_event = threading.Event()
+        self._flush_thread = threading.Thread(target=self._flush_loop, name="usage-flush", daemon=True)
+        self._flush_thread.start()
+        atexit.register(self.close)
+
+    def _load_daily_locked(self) -> None:
+        self._daily = {
+            room_id: [tokens, cost]
+            for room_id, tokens, cost in self._conn.execute(
+                "SELECT room_id, SUM(input_tokens + output_tokens), SUM(cost) FROM usage "
+                "WHERE day = ? GROUP BY room_id",
+                (self._day,)
+            )
+        }
+
+    def _roll_day_locked(self) -> str:
+        """日期变化后重新开始当天的累计"""
+        today = _today()
+        if today != self._day:
+            self._day = today
+            self._daily = {}
+        return today
+
+    # 记录
+
+    def cost(self, input_tokens: int, output_tokens: int) -> float:
+        return (input_tokens * self.price_input + output_tokens * self.price_output) / 1_000_000
+
+    def record(
+        self,
+        agent_id: str,
+        input_tokens: int,
+        output_tokens: int,
+        room_id: Optional[str] = None,
+        endpoint: Optional[str] = None,
+    ) -> None:
+        """记录一次模型调用；未指定房间/接口时使用当前 usage_scope（都没有时记为空字符串）"""
+        scope = _current_scope.get()
+        if scope is not None:
+            room_id = scope.room_id if room_id is None else room_id
+            endpoint = scope.endpoint if endpoint is None else endpoint
+        room_id = room_id or ""
+        endpoint = endpoint or ""
+        cost = self.cost(input_tokens, output_tokens)
+        if scope is not None:
+            scope.calls += 1
+            scope.input_tokens += input_tokens
+            scope.output_tokens += output_tokens
+            scope.cost += cost
+        with self._lock:
+            day = self._roll_day_locked()
+            pending = self._pending.setdefault((day, room_id, agent_id, endpoint), [0, 0, 0, 0.0])
+            pending[0] += 1
+            pending[1] += input_tokens
+            pending[2] += output_tokens
+            pending[3] += cost
+            daily = self._daily.setdefault(room_id, [0, 0.0])
+            daily[0] += input_tokens + output_tokens
+            daily[1] += cost
+
+    def _on_llm_usage(self, agent: str, input_tokens: int, output_tokens: int) -> None:
+        self.record(_agent_id(agent), input_tokens, output_tokens)
+
+    # 预算
+
+    def room_budget(self, room_id: str) -> Dict[str, Any]:
+        tokens, cost = self._budgets.get(room_id, (None, None))
+        return {
+            "daily_tokens": self.room_daily_tokens if tokens is None else tokens,
+            "daily_cost_usd": self.room_daily_cost if cost is None else cost,
+        }
+
+    def set_room_budget(self, room_id: str, daily_tokens: Optional[int], daily_cost: Optional[float]) -> None:
+        """设置房间的每日预算（None 表示使用默认值，0 表示不限制）"""
+        with self._lock:
+            if daily_tokens is None and daily_cost is None:
+                self._budgets.pop(room_id, None)
+            else:
+                self._budgets[room_id] = (daily_tokens, daily_cost)
+            with self._conn:
+                if room_id in self._budgets:
+                    self._conn.execute(
+                        "INSERT INTO usage_budgets (room_id, daily_tokens, daily_cost) VALUES (?, ?, ?) "
+                        "ON CONFLICT(room_id) DO UPDATE SET daily_tokens = excluded.daily_tokens, "
+                        "daily_cost = excluded.daily_cost",
+                        (room_id, daily_tokens, daily_cost)
+                    )
+                else:
+                    self._conn.execute("DELETE FROM usage_budgets WHERE room_id = ?", (room_id,))
+
+    def check_budget(self, room_id: Optional[str]) -> BudgetStatus:
+        """检查当天的预算：先检查全局费用，再检查房间（room_id 为空时只检查全局）"""
+        budget = self.room_budget(room_id) if room_id else None
+        with self._lock:
+            self._roll_day_locked()
+            if self.daily_cost > 0:
+                total_cost = sum(cost for _, cost in self._daily.values())
+                if total_cost >= self.daily_cost:
+                    return BudgetStatus(
+                        f"今日总费用 ${total_cost:.4f} 已超出预算 ${self.daily_cost:.4f}", self.budget_action
+                    )
+            if budget is not None:
+                tokens, cost = self._daily.get(room_id, (0, 0.0))
+                if budget["daily_tokens"] > 0 and tokens >= budget["daily_tokens"]:
+                    return BudgetStatus(
+                        f"房间 {room_id} 今日 token 用量 {int(tokens)} 已超出预算 {budget['daily_tokens']}",
+                        self.budget_action
+                    )
+                if budget["daily_cost_usd"] > 0 and cost >= budget["daily_cost_usd"]:
+                    return BudgetStatus(
+                        f"房间 {room_id} 今日费用 ${cost:.4f} 已超出预算 ${budget['daily_cost_usd']:.4f}",
+                        self.budget_action
+                    )
+        return BudgetStatus(None, self.budget_action)
+
+    # 持久化
+
+    def flush(self) -> None:
+        """把累计的增量写入数据库（写入失败时增量保留在内存中，下次一起写入）"""
+        with self._lock:
+            if not self._pending:
+                return
+            rows = [(*key, *values) for key, values in self._pending.items()]
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT INTO usage (day, room_id, agent_id, endpoint, calls, input_tokens, output_tokens, cost) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT(day, room_id, agent_id, endpoint) DO UPDATE SET "
+                    "calls = calls + excluded.calls, input_tokens = input_tokens + excluded.input_tokens, "
+                    "output_tokens = output_tokens + excluded.output_tokens, cost = cost + excluded.cost",
+                    rows
+                )
+            # 持有锁期间没有新的增量，事务提交后才清空
+            self._pending = {}
+
+    def _flush_loop(self) -> None:
+        while not self._stop_event.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"[ERROR] 写入用量统计失败: {e}")
+
+    def close(self) -> None:
+        if self._stop_event.is_set():
+            return
+        self._stop_event.set()
+        self.flush()
+        with self._lock:
+            self._conn.close()
+
+    # 查询
+
+    def summary(
+        self,
+        group_by: Sequence[str] = ("room_id",),
+        room_id: Optional[str] = None,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        """按给定字段分组汇总（since / until 为 YYYY-MM-DD，包含两端），按 token 用量从高到低排列"""
+        unknown = [field for field in group_by if field not in GROUP_FIELDS]
+        if unknown:
+            raise ValueError(f"未知的分组字段 {unknown}。可用字段: {list(GROUP_FIELDS)}")
+        conditions, params = [], []
+        for clause, value in (("room_id = ?", room_id), ("day >= ?", since), ("day <= ?", until)):
+            if value is not None:
+                conditions.append(clause)
+                params.append(value)
+        columns = ", ".join(group_by)
+        sql = (
+            f"SELECT {columns + ', ' if columns else ''}SUM(calls), SUM(input_tokens), SUM(output_tokens), SUM(cost) "
+            f"FROM usage {'WHERE ' + ' AND '.join(conditions) if conditions else ''} "
+            f"{'GROUP BY ' + columns if columns else ''} "
+            "ORDER BY SUM(input_tokens + output_tokens) DESC"
+        )
+        self.flush()
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        result = []
+        for row in rows:
+            calls, input_tokens, output_tokens, cost = row[len(group_by):]
+            if calls is None:
+                continue
+            entry = dict(zip(group_by, row))
+            entry.update({
+                "calls": calls,
+                "input_tokens": input_tokens,
+                "output_tokens": output_tokens,
+                "total_tokens": input_tokens + output_tokens,
+                "cost_usd": round(cost, 8),
+            })
+            result.append(entry)
+        return result
+
+    def room_usage(self, room_id: str) -> Dict[str, Any]:
+        """房间的用量：当天和累计的总量，按智能体和接口的明细，以及预算状态"""
+        today = _today()
+        totals = self.summary((), room_id=room_id)
+        today_totals = self.summary((), room_id=room_id, since=today, until=today)
+        status = self.check_budget(room_id)
+        return {
+            "room_id": room_id,
+            "total": totals[0] if totals else None,
+            "today": today_totals[0] if today_totals else None,
+            "by_agent": self.summary(("agent_id",), room_id=room_id),
+            "by_endpoint": self.summary(("endpoint",), room_id=room_id),
+            "budget": {**self.room_budget(room_id), "action": self.budget_action, "exceeded": status.exceeded},
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "day": self._day,
+                "today_tokens": int(sum(tokens for tokens, _ in self._daily.values())),
+                "today_cost_usd": round(sum(cost for _, cost in self._daily.values()), 8),
+                "daily_cost_budget_usd": self.daily_cost,
+                "budget_action": self.budget_action,
+            }
+
+
+# 全局单例
+_usage_tracker: Optional[UsageTracker] = None
+
+def get_usage_tracker() -> UsageTracker:
+    """获取全局用量统计（首次调用时开始接收模型调用的用量）"""
+    global _usage_tracker
+    if _usage_tracker is None:
+        _usage_tracker = UsageTracker()
+        add_usage_listener(_usage_tracker._on_llm_usage)
+    return _usage_tracker
@@ -0,0 +1,193 @@
+"""世界状态的内存表示：紧凑的智能体记录 + ID 索引
+
+对外（API、工具、持久化）仍然使用与之前完全相同的 JSON 结构，
+内部用 __slots__ 记录和 id → 记录 索引，让事件应用不再线性扫描智能体列表。
+"""
+from typing import Any, Dict, List, Optional, Tuple
+
+# 默认世界中的六个智能体：(id, name, x, y, mood)，role 与 id 相同
+DEFAULT_AGENTS: Tuple[Tuple[str, str, float, float, str], ...] = (
+    ("mathematician", "Mathematician", 150, 250, "calm"),
+    ("artist", "Artist", 350, 250, "creative"),
+    ("engineer", "Engineer", 550, 250, "focused"),
+    ("merchant", "Merchant", 750, 250, "cautious"),
+    ("athlete", "Athlete", 250, 450, "energetic"),
+    ("doctor", "Doctor", 450, 450, "caring"),
+)
+
+_AGENT_FIELDS = ("id", "name", "role", "x", "y", "mood", "currentTask", "relations")
+_WORLD_FIELDS = ("agents", "environment", "lastUpdated")
+
+
+class AgentRecord:
+    """单个智能体的状态记录"""
+
+    __slots__ = _AGENT_FIELDS + ("extra",)
+
+    def __init__(
+        self,
+        id: str,
+        name: str,
+        role: str,
+        x: Any,
+        y: Any,
+        mood: Optional[str],
+        currentTask: Optional[str] = None,
+        relations: Optional[Dict[str, Any]] = None,
+        extra: Optional[Dict[str, Any]] = None,
+    ):
+        self.id = id
+        self.name = name
+        self.role = role
+        self.x = x
+        self.y = y
+        self.mood = mood
+        self.currentTask = currentTask
+        self.relations = relations if relations is not None else {}
+        # 持久化数据中出现的其他字段，原样保留
+        self.extra = extra
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "AgentRecord":
+        extra = {k: v for k, v in data.items() if k not in _AGENT_FIELDS} or None
+        return cls(
+            data.get("id"),
+            data.get("name"),
+            data.get("role"),
+            data.get("x"),
+            data.get("y"),
+            data.get("mood"),
+            data.get("currentTask"),
+            data.get("relations"),
+            extra,
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {
+            "id": self.id,
+            "name": self.name,
+            "role": self.role,
+            "x": self.x,
+            "y": self.y,
+            "mood": self.mood,
+            "currentTask": self.currentTask,
+            "relations": self.relations,
+        }
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+
+class WorldState:
+    """一个房间的世界状态"""
+
+    __slots__ = ("agents", "index", "positions", "environment", "lastUpdated", "extra", "version", "_dict")
+
+    def __init__(
+        self,
+        agents: List[AgentRecord],
+        environment: Dict[str, Any],
+        lastUpdated: Optional[str],
+        extra: Optional[Dict[str, Any]] = None,
+    ):
+        self.agents = agents
+        # id → 记录，O(1) 查找
+        self.index: Dict[str, AgentRecord] = {agent.id: agent for agent in agents}
+        # id → 在 agents 列表中的位置，用于生成 JSON Patch 路径
+        self.positions: Dict[str, int] = {agent.id: i for i, agent in enumerate(agents)}
+        self.environment = environment
+        self.lastUpdated = lastUpdated
+        self.extra = extra
+        # 单调递增的版本号，每次应用一批事件加一（不包含在 to_dict() 中）
+        self.version = 0
+        # to_dict() 的缓存，状态变化时失效
+        self._dict: Optional[Dict[str, Any]] = None
+
+    @classmethod
+    def default(cls, timestamp: str) -> "WorldState":
+        """创建默认的六智能体世界"""
+        agents = [
+            AgentRecord(agent_id, name, agent_id, x, y, mood)
+            for agent_id, name, x, y, mood in DEFAULT_AGENTS
+        ]
+        environment = {"timeOfDay": "day", "weather": "sunny", "rooms": []}
+        return cls(agents, environment, timestamp)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "WorldState":
+        extra = {k: v for k, v in data.items() if k not in _WORLD_FIELDS} or None
+        return cls(
+            [AgentRecord.from_dict(agent) for agent in data.get("agents", [])],
+            data.get("environment", {}),
+            data.get("lastUpdated"),
+            extra,
+        )
+
+    def agent(self, agent_id: str) -> Optional[AgentRecord]:
+        return self.index.get(agent_id)
+
+    def touch(self, timestamp: Optional[str] = None) -> None:
+        """标记状态已变化（可同时更新 lastUpdated）"""
+        if timestamp is not None:
+            self.lastUpdated = timestamp
+        self._dict = None
+
+    @property
+    def cached_dict(self) -> Optional[Dict[str, Any]]:
+        return self._dict
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为对外的 JSON 结构（结果会缓存到下一次状态变化）"""
+        if self._dict is None:
+            data = {
+                "agents": [agent.to_dict() for agent in self.agents],
+                "environment": self.environment,
+                "lastUpdated": self.lastUpdated,
+            }
+            if self.extra:
+                data.update(self.extra)
+            self._dict = data
+        return self._dict
+
+
+def _set_field(world: WorldState, agent: AgentRecord, field: str, value: Any, patch: List[Dict[str, Any]]) -> None:
+    """修改智能体字段，值有变化时记录一条 JSON Patch 操作"""
+    if getattr(agent, field) == value:
+        return
+    setattr(agent, field, value)
+    patch.append({
+        "op": "replace",
+        "path": f"/agents/{world.positions[agent.id]}/{field}",
+        "value": value
+    })
+
+
+def apply_event(world: WorldState, event: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """把单个事件应用到世界状态（实时更新和事件日志回放共用）
+
+    返回本次变化对应的 JSON Patch（RFC 6902）操作列表，没有变化时返回空列表。
+    """
+    patch: List[Dict[str, Any]] = []
+    event_type = event.get("type")
+    agent = world.agent(event.get("agent_id"))
+    if agent is None:
+        return patch
+
+    if event_type == "agent_moved":
+        _set_field(world, agent, "x", event.get("x"), patch)
+        _set_field(world, agent, "y", event.get("y"), patch)
+
+    elif event_type == "task_started":
+        _set_field(world, agent, "currentTask", event.get("task"), patch)
+        _set_field(world, agent, "mood", event.get("mood", agent.mood), patch)
+
+    elif event_type == "task_finished":
+        _set_field(world, agent, "currentTask", None, patch)
+        _set_field(world, agent, "mood", event.get("mood", "calm"), patch)
+
+    elif event_type == "mood_changed":
+        _set_field(world, agent, "mood", event.get("mood"), patch)
+
+    if patch:
+        world.touch()
+    return patch